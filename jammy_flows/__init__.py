@@ -1,2 +1,3 @@
 from .main.default import pdf
-from .main.fully_amortized import fully_amortized_pdf
\ No newline at end of file
+from .main.fully_amortized import fully_amortized_pdf
+from .main.pdf_bank import pdf_bank
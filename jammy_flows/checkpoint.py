@@ -0,0 +1,157 @@
+import torch
+import numpy
+import json
+import struct
+import inspect
+
+## file layout: magic bytes, format version (uint32), header length (uint64), JSON header, zero padding, data section
+## the data section starts at a multiple of _ALIGNMENT bytes and holds all tensors back to back, each starting at a multiple of _ALIGNMENT bytes
+_MAGIC=b"JAMMYFLW"
+_PREFIX_FORMAT="<IQ"
+_ALIGNMENT=64
+
+## increase when the layout or the meaning of header entries changes
+CHECKPOINT_FORMAT_VERSION=1
+
+def _aligned(num_bytes):
+    return ((num_bytes+_ALIGNMENT-1)//_ALIGNMENT)*_ALIGNMENT
+
+def write_checkpoint(filename, header, tensors):
+    """
+    Writes a checkpoint file (see *pdf.save_checkpoint*).
+
+    Parameters:
+
+        filename (str): Output file.
+        header (dict): JSON-serializable description of the model. The tensor table is added.
+        tensors (OrderedDict): Named tensors, e.g. a state dict. They are stored on the CPU in their dtype.
+    """
+    tensor_table=[]
+    tensor_bytes=[]
+
+    offset=0
+
+    for name, tensor in tensors.items():
+
+        tensor=tensor.detach().cpu().contiguous()
+        raw=tensor.reshape(-1).view(torch.uint8).numpy().tobytes()
+
+        tensor_table.append(dict(name=name, dtype=str(tensor.dtype).split(".")[-1], shape=list(tensor.shape), offset=offset, num_bytes=len(raw)))
+        tensor_bytes.append(raw)
+
+        offset=_aligned(offset+len(raw))
+
+    header=dict(header)
+    header["format_version"]=CHECKPOINT_FORMAT_VERSION
+    header["tensors"]=tensor_table
+    header["data_num_bytes"]=offset
+
+    encoded_header=json.dumps(header).encode("utf-8")
+
+    prefix=_MAGIC+struct.pack(_PREFIX_FORMAT, CHECKPOINT_FORMAT_VERSION, len(encoded_header))
+    data_start=_aligned(len(prefix)+len(encoded_header))
+
+    with open(filename, "wb") as f:
+        f.write(prefix)
+        f.write(encoded_header)
+        f.write(b"\0"*(data_start-len(prefix)-len(encoded_header)))
+
+        for table_entry, raw in zip(tensor_table, tensor_bytes):
+            f.write(raw)
+            f.write(b"\0"*(_aligned(table_entry["num_bytes"])-table_entry["num_bytes"]))
+
+def read_checkpoint_header(filename):
+    """
+    Reads and validates the header of a checkpoint file.
+
+    Returns:
+
+        dict
+            The header.
+        int
+            Byte offset of the data section.
+    """
+    prefix_size=len(_MAGIC)+struct.calcsize(_PREFIX_FORMAT)
+
+    with open(filename, "rb") as f:
+        prefix=f.read(prefix_size)
+
+        if(len(prefix)<prefix_size or prefix[:len(_MAGIC)]!=_MAGIC):
+            raise Exception("File ", filename, " is not a jammy_flows checkpoint.")
+
+        format_version, header_length=struct.unpack(_PREFIX_FORMAT, prefix[len(_MAGIC):])
+
+        if(format_version>CHECKPOINT_FORMAT_VERSION):
+            raise Exception("Checkpoint format version %d is newer than the supported version %d. Update jammy_flows to read it." % (format_version, CHECKPOINT_FORMAT_VERSION))
+
+        header=json.loads(f.read(header_length).decode("utf-8"))
+
+    return header, _aligned(prefix_size+header_length)
+
+def read_checkpoint(filename, mmap=True):
+    """
+    Reads a checkpoint file. With *mmap*, the data section is memory-mapped copy-on-write and all tensors are views into the mapping,
+    so nothing is read before it is used, pages are shared between processes (also across *fork*) and writes to the tensors never reach the file.
+
+    Parameters:
+
+        filename (str): Checkpoint file.
+        mmap (bool): Memory-map the data section instead of reading it into memory.
+
+    Returns:
+
+        dict
+            The header.
+        dict
+            Named CPU tensors.
+    """
+    header, data_start=read_checkpoint_header(filename)
+
+    data_num_bytes=header["data_num_bytes"]
+
+    if(data_num_bytes==0):
+        data=torch.zeros(0, dtype=torch.uint8)
+    elif(mmap):
+        data=torch.from_numpy(numpy.memmap(filename, dtype=numpy.uint8, mode="c", offset=data_start, shape=(data_num_bytes,)))
+    else:
+        data=torch.from_numpy(numpy.fromfile(filename, dtype=numpy.uint8, count=data_num_bytes, offset=data_start))
+
+    tensors=dict()
+
+    for table_entry in header["tensors"]:
+        raw=data[table_entry["offset"]:table_entry["offset"]+table_entry["num_bytes"]]
+        tensors[table_entry["name"]]=raw.view(getattr(torch, table_entry["dtype"])).reshape(table_entry["shape"])
+
+    return header, tensors
+
+def assign_state_dict(module, tensors, use_assign=None):
+    """
+    Assigns the named *tensors* to the parameters and buffers of *module* without copies (*load_state_dict(assign=True)*).
+    Torch versions before 2.1 do not support *assign*, then the tensors are assigned directly via *.data*.
+
+    Parameters:
+
+        module (torch.nn.Module): Module whose parameters and buffers are replaced.
+        tensors (dict): Named tensors, as returned by *read_checkpoint*.
+        use_assign (bool/None): Use *load_state_dict(assign=True)*. None: if the torch version supports it.
+    """
+    if(use_assign is None):
+        use_assign="assign" in inspect.signature(module.load_state_dict).parameters
+
+    if(use_assign):
+        module.load_state_dict(tensors, assign=True)
+        return
+
+    own_tensors=module.state_dict(keep_vars=True)
+
+    missing=[name for name in own_tensors.keys() if name not in tensors.keys()]
+    unexpected=[name for name in tensors.keys() if name not in own_tensors.keys()]
+
+    if(len(missing)>0 or len(unexpected)>0):
+        raise Exception("Checkpoint tensors do not match the module. Missing: %s, unexpected: %s" % (missing, unexpected))
+
+    for name, tensor in tensors.items():
+        if(own_tensors[name].shape!=tensor.shape):
+            raise Exception("Shape mismatch for %s: %s (module) vs %s (checkpoint)" % (name, tuple(own_tensors[name].shape), tuple(tensor.shape)))
+
+        own_tensors[name].data=tensor
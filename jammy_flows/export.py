@@ -0,0 +1,224 @@
+import torch
+from torch import nn
+
+from . import precision
+from .layers import spline_fns
+
+class pdf_inference_module(nn.Module):
+    """
+    Static inference graph of a configured *pdf* (see *pdf.export_inference_module*). All structural decisions of *all_layer_inverse*/*all_layer_forward*
+    (sub-pdf slices, layer order, parameter slices of every layer, coordinate transformations between layers, MLP usage) are resolved once at construction,
+    so a call is a fixed sequence of tensor operations without type checks, assertions or option lookups.
+    This makes the module suitable for *torch.compile* and for tracing into TorchScript (see *trace_inference_module*).
+
+    The module shares the parameters of the pdf. Target inputs and outputs are in the default coordinates of the pdf.
+    """
+    def __init__(self, pdf, mode="log_prob"):
+        """
+        Parameters:
+
+            pdf (jammy_flows.pdf): The configured pdf.
+            mode (str): "log_prob" - *forward(x, conditional_input)* returns the log-probability (B,).
+                        "sample" - *forward(base_samples, conditional_input)* maps standard normal base samples (B, total base dim) to the target space and returns the samples and their log-probability.
+        """
+        super().__init__()
+
+        if(mode not in ["log_prob", "sample"]):
+            raise Exception("Unknown inference mode ", mode, " .. allowed: 'log_prob' or 'sample'")
+        if(pdf.amortize_everything):
+            raise Exception("Static inference modules do not support fully amortized pdfs (amortize_everything=True).")
+        if(pdf.use_as_passthrough_instead_of_pdf):
+            raise Exception("Static inference modules require a pdf, not a passthrough module.")
+        if(type(pdf.conditional_input_dim)==list):
+            raise Exception("Static inference modules require a single conditional input tensor, not a list of conditional inputs.")
+
+        self.pdf=pdf
+        self.mode=mode
+        self.conditional=pdf.conditional_input_dim is not None
+
+        self.num_sub_pdfs=len(pdf.layer_list)
+        self.target_slices=[tuple(ind) for ind in pdf.target_dim_indices]
+        self.base_slices=[tuple(ind) for ind in pdf.base_dim_indices]
+        self.uses_mlp=[pdf_index<len(pdf.mlp_predictors) and pdf.mlp_predictors[pdf_index] is not None for pdf_index in range(self.num_sub_pdfs)]
+        self.strip_log_normalization=[pdf.predict_log_normalization and pdf.join_poisson_and_pdf_description and pdf_index==0 for pdf_index in range(self.num_sub_pdfs)]
+
+        ## per sub-pdf and layer: (layer index, parameter slice start, parameter slice end, coordinate transformation or None)
+        ## the parameters of layer l are the slice [sum of parameters of layers <l, sum of parameters of layers <=l] of the sub-pdf parameters
+        self.inverse_plans=[]
+        self.forward_plans=[]
+
+        for pdf_index, pdf_layers in enumerate(pdf.layer_list):
+
+            param_starts=[0]
+            for layer in pdf_layers:
+                param_starts.append(param_starts[-1]+layer.total_param_num)
+
+            inverse_plan=[]
+            forward_plan=[]
+
+            for l in range(len(pdf_layers)):
+
+                outer_mode=pdf._get_layer_input_embedding_mode(pdf_index, l)
+                layer_mode=pdf.layer_embedding_modes[pdf_index][l]
+
+                coordinate_trafo=None if outer_mode==layer_mode else (outer_mode, layer_mode)
+                inverse_plan.append((l, param_starts[l], param_starts[l+1], coordinate_trafo))
+
+                coordinate_trafo=None if outer_mode==layer_mode else (layer_mode, outer_mode)
+                forward_plan.append((l, param_starts[l], param_starts[l+1], coordinate_trafo))
+
+            self.inverse_plans.append(list(reversed(inverse_plan)))
+            self.forward_plans.append(forward_plan)
+
+    def forward(self, x, conditional_input=None):
+
+        if(self.mode=="log_prob"):
+            return self.log_prob(x, conditional_input=conditional_input)
+
+        return self.sample(x, conditional_input=conditional_input)
+
+    def _layer_params(self, pdf_index, extra_conditional_input, conditional_input):
+        """
+        Flow parameters of all layers of a sub-pdf predicted by its MLP, or None if the layers hold their own parameters.
+        """
+        if(self.uses_mlp[pdf_index]==False):
+            return None
+
+        if(self.conditional):
+            data_summary=torch.cat([conditional_input]+extra_conditional_input, dim=1)
+        else:
+            data_summary=torch.cat(extra_conditional_input, dim=1)
+
+        extra_params=self.pdf._apply_mlp_predictor(self.pdf.mlp_predictors[pdf_index], data_summary)
+
+        if(self.strip_log_normalization[pdf_index]):
+            extra_params=extra_params[:,:-1]
+
+        return extra_params
+
+    def _coordinate_trafo(self, pdf_index, x, log_det, coordinate_trafo):
+
+        if(coordinate_trafo is None):
+            return x, log_det
+
+        return self.pdf._transform_between_layer_coordinates(pdf_index, x, log_det, coordinate_trafo[0], coordinate_trafo[1])
+
+    def log_prob(self, x, conditional_input=None):
+        """
+        Log-probability at target *x* (B,D) in default coordinates. Equivalent to the first output of *pdf.forward*.
+        """
+        log_det=torch.zeros(x.shape[0], dtype=precision.accumulation_dtype(x.dtype), device=x.device)
+
+        extra_conditional_input=[]
+        base_targets=[]
+
+        for pdf_index in range(self.num_sub_pdfs):
+
+            extra_params=self._layer_params(pdf_index, extra_conditional_input, conditional_input)
+
+            this_target=x[:,self.target_slices[pdf_index][0]:self.target_slices[pdf_index][1]]
+
+            for layer_index, param_start, param_end, coordinate_trafo in self.inverse_plans[pdf_index]:
+
+                this_target, log_det=self._coordinate_trafo(pdf_index, this_target, log_det, coordinate_trafo)
+
+                this_extra_params=None if extra_params is None else extra_params[:,param_start:param_end]
+                with spline_fns.recording_violations(self.pdf.spline_violations):
+                    this_target, log_det=self.pdf.layer_list[pdf_index][layer_index].inv_flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
+
+            base_targets.append(this_target)
+
+            if(pdf_index<self.num_sub_pdfs-1):
+                prev_target=x[:,self.target_slices[pdf_index][0]:self.target_slices[pdf_index][1]]
+                extra_conditional_input.append(self.pdf.layer_list[pdf_index][-1]._embedding_conditional_return(prev_target))
+
+        base_pos=torch.cat(base_targets, dim=1)
+
+        log_pdf=(-0.5*base_pos**2-0.9189385332046727).sum(dim=-1)
+
+        return log_pdf+log_det.to(x.dtype)
+
+    def sample(self, base_samples, conditional_input=None):
+        """
+        Maps standard normal *base_samples* (B, total base dim) to the target space. Equivalent to *pdf.sample* with *predefined_target_input*.
+
+        Returns:
+
+            Tensor
+                Samples in default coordinates, shape = (B,D).
+            Tensor
+                Log-probability of the samples, shape = (B,).
+        """
+        log_det=torch.zeros(base_samples.shape[0], dtype=precision.accumulation_dtype(base_samples.dtype), device=base_samples.device)
+
+        extra_conditional_input=[]
+        new_targets=[]
+
+        for pdf_index in range(self.num_sub_pdfs):
+
+            extra_params=self._layer_params(pdf_index, extra_conditional_input, conditional_input)
+
+            this_target=base_samples[:,self.base_slices[pdf_index][0]:self.base_slices[pdf_index][1]]
+
+            for layer_index, param_start, param_end, coordinate_trafo in self.forward_plans[pdf_index]:
+
+                this_extra_params=None if extra_params is None else extra_params[:,param_start:param_end]
+                with spline_fns.recording_violations(self.pdf.spline_violations):
+                    this_target, log_det=self.pdf.layer_list[pdf_index][layer_index].flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
+
+                this_target, log_det=self._coordinate_trafo(pdf_index, this_target, log_det, coordinate_trafo)
+
+            new_targets.append(this_target)
+
+            if(pdf_index<self.num_sub_pdfs-1):
+                extra_conditional_input.append(self.pdf.layer_list[pdf_index][-1]._embedding_conditional_return(this_target))
+
+        log_gauss_evals=(-0.5*base_samples**2-0.9189385332046727).sum(dim=-1)
+
+        return torch.cat(new_targets, dim=1), log_gauss_evals-log_det.to(base_samples.dtype)
+
+def trace_inference_module(module, example_inputs, check_inputs=[], tolerance=1e-5):
+    """
+    Traces a *pdf_inference_module* into a TorchScript module that can be saved with *torch.jit.save* and loaded from a C++/TorchScript runtime.
+    Tracing records the tensor operations for the example inputs. Data-dependent control flow inside layers (e.g. the early exit of Newton iterations
+    when sampling layers without analytic inverse) is frozen, so the traced module is compared to the eager module on the example inputs and all *check_inputs*.
+
+    Parameters:
+
+        module (pdf_inference_module): The static inference module.
+        example_inputs (tuple): Example inputs, (x,) or (x, conditional_input).
+        check_inputs (list(tuple)): Further inputs on which traced and eager results must agree, ideally with other batch sizes.
+        tolerance (float): Maximum allowed absolute deviation between traced and eager results.
+
+    Returns:
+
+        torch.jit.ScriptModule
+    """
+    if(type(example_inputs)!=tuple):
+        example_inputs=(example_inputs,)
+
+    with torch.no_grad():
+        traced=torch.jit.trace(module, example_inputs, check_trace=False)
+
+        for inputs in [example_inputs]+list(check_inputs):
+            if(type(inputs)!=tuple):
+                inputs=(inputs,)
+
+            eager_result=module(*inputs)
+            traced_result=traced(*inputs)
+
+            if(torch.is_tensor(eager_result)):
+                eager_result=(eager_result,)
+                traced_result=(traced_result,)
+
+            for eager_res, traced_res in zip(eager_result, traced_result):
+                finite_mask=torch.isfinite(eager_res)
+
+                deviation=0.0
+                if(finite_mask.sum()>0):
+                    deviation=(eager_res[finite_mask]-traced_res[finite_mask]).abs().max()
+
+                if( (finite_mask!=torch.isfinite(traced_res)).sum()>0 or deviation>tolerance):
+                    raise Exception("Traced inference module deviates from the eager module (data-dependent control flow in a layer?). Use the eager module, potentially with torch.compile, instead.")
+
+    return traced
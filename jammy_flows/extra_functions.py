@@ -2,11 +2,11 @@ from torch import nn
 import torch
 import numpy
 import time
-import scipy
+import threading
+import contextlib
 
 from .layers.euclidean import gaussianization_flow, multivariate_normal
 from .layers import matrix_fns
-from scipy.optimize import minimize
 import scipy.stats as stats
 
 
@@ -98,95 +98,324 @@ def list_from_str(spec):
 
 ## transformations
 
-def get_loss_fn(target_matrix, num_householder_iter=-1):
+def householder_vectors_from_orthogonal(matrices, num_reflections=None):
+    """
+    Batched Householder decomposition of orthogonal matrices. Returns normalized Householder vectors v_1..v_k such that 
+    H(v_1)...H(v_k) (as in *gf_block.compute_householder_matrix*) equals the matrix up to the signs of its columns. 
+    For k smaller than the dimension, the first k columns are matched up to their signs.
 
-    dim=target_matrix.shape[0]
+    Parameters:
+        matrices (Tensor): Orthogonal matrices, shape (B,d,d).
+        num_reflections (int/None): Number of Householder reflections k. Defaults to d.
 
-    gblock=gaussianization_flow.gf_block(dim, num_householder_iter=num_householder_iter, use_permanent_parameters=True)
-    used_shape=gblock.vs.shape
+    Returns: Tensor of Householder vectors, shape (B,k,d)
+    """
+    batch_size, dim, _=matrices.shape
 
-    def compute_matching_distance(a):
+    if(num_reflections is None):
+        num_reflections=dim
 
-        hh_pars=torch.from_numpy(numpy.reshape(a, used_shape))
-        mat=gblock.compute_householder_matrix(hh_pars).squeeze(0).detach().numpy()
+    remaining=matrices.clone()
+    vs=[]
 
-        test_vec=numpy.ones(dim)
-        test_vec/=numpy.sqrt((test_vec**2).sum())
+    for ind in range(num_reflections):
 
-        v1=numpy.matmul(mat,test_vec)
-        v2=numpy.matmul(target_matrix,test_vec)
+        ## reflect the remaining part of column *ind* onto the axis, with the sign that avoids cancellations
+        x=remaining[:,:,ind].clone()
+        x[:,:ind]=0.0
 
-        return -(v1*v2).sum()
+        sign=torch.where(x[:,ind]>=0, torch.ones_like(x[:,ind]), -torch.ones_like(x[:,ind]))
 
-    return compute_matching_distance
+        v=x.clone()
+        v[:,ind]=v[:,ind]+sign*x.norm(dim=1)
+        v=v/v.norm(dim=1, keepdim=True)
 
-def get_loss_fn_mvn(target_matrix, cov_type):
+        remaining=remaining-2*v[:,:,None]*torch.matmul(v[:,None,:], remaining)
 
-    dim=target_matrix.shape[0]
+        vs.append(v)
 
-    
+    return torch.stack(vs, dim=1)
 
-    def compute_matching_distance(a):
-       
-        test_block=multivariate_normal.mvn_block(dim,cov_type=cov_type)
+def _invert_monotone_fn(fn, target, lower=-100.0, upper=100.0, num_iter=100):
+    """
+    Elementwise inverse of a monotonically increasing function via vectorized bisection. Targets outside of the range are mapped to the boundaries.
+    """
+    lower=torch.ones_like(target)*lower
+    upper=torch.ones_like(target)*upper
 
-        pars=test_block._obtain_usable_flow_params(a, cov_type, extra_inputs=torch.from_numpy(a).unsqueeze(0))
+    for _ in range(num_iter):
+        middle=0.5*(lower+upper)
+        too_small=fn(middle)<target
 
-        lower_trig, _=matrix_fns.obtain_lower_triangular_matrix_and_logdet(dim, single_log_diagonal_entry=pars[0], log_diagonal_entries=pars[1], lower_triangular_entries=pars[2], cov_type=cov_type)
+        lower=torch.where(too_small, middle, lower)
+        upper=torch.where(too_small, upper, middle)
 
-        lower_trig=lower_trig[0].numpy()
+    return 0.5*(lower+upper)
 
-        predicted_matrix=numpy.matmul(lower_trig, lower_trig.T)
-        
-        ## it seems when the target data has larger variance than the unit gaussian, it is much faster to just take the reverse KL    
-        #inverse_predicted=scipy.linalg.pinv(predicted_matrix)
-        #forward_kl=0.5*(numpy.trace(numpy.matmul(inverse_predicted, target_matrix))+numpy.linalg.slogdet(predicted_matrix)[1]-numpy.linalg.slogdet(target_matrix)[1]-dim)
+def mvn_params_from_covariance(layer, covariance):
+    """
+    Parameters of a multivariate normal block (without offset) whose covariance minimizes the reverse KL divergence to a target covariance matrix.
+    For *full* covariances this is the Cholesky factor of the target, for *diagonal* covariances the diagonal of the target precision matrix determines the variances 
+    and for *diagonal_symmetric* covariances its trace.
 
-        ## inverse
+    Parameters:
+        layer (mvn_block): The multivariate normal layer.
+        covariance (Tensor): Symmetric positive definite target covariance, shape (d,d).
 
-        inverse_target=scipy.linalg.pinv(target_matrix)
-    
-        reverse_kl=0.5*(numpy.trace(numpy.matmul(inverse_target, predicted_matrix))-numpy.linalg.slogdet(predicted_matrix)[1]+numpy.linalg.slogdet(target_matrix)[1]-dim)
+    Returns: Tensor of layer parameters
+             Tensor of the lower triangular matrix L of the layer (covariance = L L^T), shape (d,d)
+    """
+    dim=covariance.shape[0]
 
-        return reverse_kl
-        
-    return compute_matching_distance
+    lower_triangular_entries=None
 
-def get_trafo_matrix_mvn(dimension, params, cov_type):
+    if(layer.cov_type=="diagonal_symmetric"):
+        precision_matrix=torch.linalg.inv(covariance)
+        log_diagonal=0.5*torch.log(dim/torch.trace(precision_matrix))[None]
+
+    elif(layer.cov_type=="diagonal"):
+        precision_matrix=torch.linalg.inv(covariance)
+        log_diagonal=-0.5*torch.log(torch.diagonal(precision_matrix))
+
+    elif(layer.cov_type=="full"):
+        cholesky=torch.linalg.cholesky(covariance)
+        log_diagonal=torch.log(torch.diagonal(cholesky))
+
+        ## same ordering as *matrix_fns.obtain_lower_triangular_matrix_and_logdet* .. starting from the lowest off-diagonal
+        lower_triangular_entries=torch.cat([torch.diagonal(cholesky, offset=-dim+ind+1) for ind in range(dim-1)])
+
+    else:
+        raise Exception("Unsupported cov type for data initialization ", layer.cov_type)
+
+    params=_invert_monotone_fn(layer.make_log_positive, log_diagonal)
+
+    if(lower_triangular_entries is not None):
+        params=torch.cat([params, lower_triangular_entries])
+
+    pars=layer._obtain_usable_flow_params(params, layer.cov_type, extra_inputs=params.unsqueeze(0))
+
+    lower_trig, _=matrix_fns.obtain_lower_triangular_matrix_and_logdet(dim, single_log_diagonal_entry=pars[0], log_diagonal_entries=pars[1], lower_triangular_entries=pars[2], cov_type=layer.cov_type)
+
+    return params, lower_trig[0]
+
+def _column_percentiles(x, percentiles):
     """
-    Return the transformation matrix to apply to the data, in order to remove moments.
+    Percentiles of each column of *x* with linear interpolation (like *numpy.percentile*), computed on the device of *x*.
     """
+    sorted_x=torch.sort(x, dim=0)[0]
 
-    test_block=multivariate_normal.mvn_block(dimension,cov_type=cov_type)
+    positions=torch.from_numpy(numpy.asarray(percentiles)/100.0*(x.shape[0]-1)).to(x)
 
-    pars=test_block._obtain_usable_flow_params(params, cov_type, extra_inputs=torch.from_numpy(params).unsqueeze(0))
+    lower_indices=torch.floor(positions).long()
+    upper_indices=torch.clamp(lower_indices+1, max=x.shape[0]-1)
+    fractions=(positions-lower_indices.to(x))[:,None]
 
-    lower_trig, _=matrix_fns.obtain_lower_triangular_matrix_and_logdet(dimension, single_log_diagonal_entry=pars[0], log_diagonal_entries=pars[1], lower_triangular_entries=pars[2], cov_type=cov_type)
+    return sorted_x[lower_indices]+(sorted_x[upper_indices]-sorted_x[lower_indices])*fractions
 
-    lower_trig=lower_trig[0].numpy()
+class _moment_accumulator(object):
+    """
+    Streaming mean and (optionally) second central moment of data chunks in float64, merged with the pairwise update of Chan et al.
+    """
+    def __init__(self, calc_second_moment=True):
 
-   
-    predicted_matrix=numpy.matmul(lower_trig, lower_trig.T)
+        self.calc_second_moment=calc_second_moment
+        self.num=0
+        self.mean=None
+        self.m2=None
 
-    inverse_predicted=scipy.linalg.pinv(predicted_matrix)
-    
-    l, sigma, r=scipy.linalg.svd(inverse_predicted)
+    def add(self, chunk):
 
-    ## return "sqrt" of covariance matrix
-    return numpy.sqrt(sigma)*r
+        chunk=chunk.to(torch.float64)
+        num_chunk=chunk.shape[0]
 
-        
-def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4):
+        if(num_chunk==0):
+            return
 
-    ## given an input *data_inits*, this function tries to initialize the gf block parameters
-    ## to best match the data intis
-    
-    cur_data=data
+        chunk_mean=chunk.mean(dim=0)
+
+        chunk_m2=None
+        if(self.calc_second_moment):
+            centered=chunk-chunk_mean
+            chunk_m2=torch.matmul(centered.T, centered)
+
+        if(self.num==0):
+            self.num=num_chunk
+            self.mean=chunk_mean
+            self.m2=chunk_m2
+            return
+
+        tot_num=self.num+num_chunk
+        delta=chunk_mean-self.mean
+
+        self.mean=self.mean+delta*(num_chunk/float(tot_num))
+
+        if(self.calc_second_moment):
+            self.m2=self.m2+chunk_m2+torch.outer(delta, delta)*(self.num*num_chunk/float(tot_num))
+
+        self.num=tot_num
+
+    def second_moment(self, center):
+        """
+        Second moment E[(x-center)(x-center)^T] around *center*.
+        """
+        shift=self.mean-center.to(torch.float64)
+
+        return self.m2/float(self.num)+torch.outer(shift, shift)
+
+## serializes seeded uses of the global torch random number generator (see *_seeded_global_rng*)
+_global_rng_lock=threading.Lock()
+
+@contextlib.contextmanager
+def _seeded_global_rng(generator):
+    """
+    Runs the enclosed code with the global (CPU) torch random number generator seeded from *generator* and restores its state afterwards. 
+    Used for layer code that draws from the global generator during initializations that may run in parallel threads. 
+    Seeded sections are serialized, so their random numbers do not depend on the thread scheduling. Does nothing if *generator* is None.
+    """
+    if(generator is None):
+        yield
+        return
+
+    seed=int(torch.randint(0, 2**62, (1,), generator=generator))
+
+    with _global_rng_lock:
+        with torch.random.fork_rng(devices=[]):
+            torch.default_generator.manual_seed(seed)
+            yield
+
+class _reservoir_sampler(object):
+    """
+    Uniform random subset of at most *max_size* rows of a stream of data chunks (reservoir sampling). Keeps all rows if *max_size* is None.
+    Random numbers are drawn from the torch *generator* if given, otherwise from the global numpy random state.
+    """
+    def __init__(self, max_size=None, generator=None):
+
+        self.max_size=max_size
+        self.generator=generator
+        self.num_seen=0
+        self.chunks=[]
+        self.reservoir=None
 
+    def add(self, chunk):
+
+        num_chunk=chunk.shape[0]
+
+        if(self.max_size is None or self.num_seen+num_chunk<=self.max_size):
+            self.chunks.append(chunk)
+            self.num_seen+=num_chunk
+            return
+
+        if(self.reservoir is None):
+            self.reservoir=torch.cat(self.chunks+[chunk[:self.max_size-self.num_seen]], dim=0)
+            self.chunks=[]
+
+            num_used=self.max_size-self.num_seen
+            self.num_seen=self.max_size
+
+            chunk=chunk[num_used:]
+            num_chunk=chunk.shape[0]
+
+        ## the i-th row of the stream replaces a random reservoir row with probability max_size/(i+1)
+        row_indices=numpy.arange(self.num_seen, self.num_seen+num_chunk)
+        if(self.generator is None):
+            uniforms=numpy.random.uniform(size=num_chunk)
+        else:
+            uniforms=torch.rand(num_chunk, dtype=torch.float64, generator=self.generator).numpy()
+
+        replace_indices=numpy.floor(uniforms*(row_indices+1)).astype(numpy.int64)
+
+        accepted=numpy.nonzero(replace_indices<self.max_size)[0]
+
+        ## later rows win if they replace the same reservoir row
+        _, last_occurence=numpy.unique(replace_indices[accepted][::-1], return_index=True)
+        accepted=accepted[::-1][last_occurence]
+
+        if(len(accepted)>0):
+            self.reservoir[torch.from_numpy(replace_indices[accepted]).to(chunk.device)]=chunk[torch.from_numpy(accepted).to(chunk.device)]
+
+        self.num_seen+=num_chunk
+
+    def sample(self):
+
+        if(self.reservoir is not None):
+            return self.reservoir
+
+        return torch.cat(self.chunks, dim=0)
+
+class _column_slice_chunks(object):
+    """
+    Re-iterable view of the columns [start, end) of a re-iterable collection of data chunks.
+    """
+    def __init__(self, chunks, start, end):
+
+        self.chunks=chunks
+        self.start=start
+        self.end=end
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield chunk[:, self.start:self.end]
+
+def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4, reservoir_size=None, generator=None):
+    """
+    Finds initialization parameters of a chain of layers of a Euclidean sub-pdf such that the initial distribution roughly follows *data*. 
+    Layers are processed in the inverse (normalizing) direction. The data is processed in chunks and the statistics of each layer (means, second moments
+    and a subset of the data for the KDE centers) are accumulated in a streaming fashion, so the memory is bounded by the chunk size and *reservoir_size*. 
+    Each layer requires one pass over the data, in which the chunks are propagated through all previously initialized layers. A single data tensor
+    is instead kept in memory and only transformed by each layer once.
+
+    Parameters:
+        layer_list (list): Layers of the sub-pdf.
+        data (None/Tensor/iterable(Tensor)): Initialization data (N,D), or a re-iterable collection of data chunks (e.g. list of tensors or a DataLoader). If None, uses the default initialization of each layer.
+        mvn_min_max_sv_ratio (float): Minimum ratio of the smallest to the largest singular value of the data matrix for multivariate normal blocks.
+        reservoir_size (int/None): Maximum number of data points used to determine the KDE centers of Gaussianization blocks. If None, all data points are used.
+        generator (None/torch.Generator): If given, all random numbers are derived from this generator instead of the global random state, which makes
+                                          the initialization deterministic also if several initializations run in parallel threads.
+
+    Returns: Tensor of all layer parameters
+    """
+    chunks=None
     dim=None
+
+    ## a single data tensor is kept in its transformed state instead of propagating it through all previous layers again
+    in_memory_data=None
+
     if(data is not None):
+        if(torch.is_tensor(data)):
+            in_memory_data=[data, 0]
+
+        chunks=[data] if torch.is_tensor(data) else data
+
+        if(iter(chunks) is chunks):
+            raise Exception("Initialization data chunks must be re-iterable (e.g. a list of tensors or a DataLoader), not a generator, since every layer requires a pass over the data.")
+
+        ## all parameters are created in dtype and device of the first chunk
+        data=next(iter(chunks))
         dim=data.shape[1]
 
+    ## per initialized layer, the transformation of its input data in normalizing direction
+    layer_trafos=[]
+
+    def layer_input_chunks():
+        if(in_memory_data is not None):
+            for trafo in layer_trafos[in_memory_data[1]:]:
+                in_memory_data[0]=trafo(in_memory_data[0])
+            in_memory_data[1]=len(layer_trafos)
+
+            yield in_memory_data[0]
+            return
+
+        for chunk in chunks:
+            chunk=chunk.to(data)
+            for trafo in layer_trafos:
+                chunk=trafo(chunk)
+            yield chunk
+
+    def apply_steps(x, steps):
+        for step in steps:
+            x=step(x)
+        return x
+
     all_layers_params=[]
 
     tot_num_expected_params=0
@@ -197,64 +426,87 @@ def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4
             tot_num_expected_params+=cur_layer.total_param_num
             # normal default layer init if not data present
             if(data is None):
-                all_layers_params.append(cur_layer.get_desired_init_parameters())
+                with _seeded_global_rng(generator):
+                    all_layers_params.append(cur_layer.get_desired_init_parameters())
                 continue
 
             ## param order .. householder / means / width / normaliaztion
             param_list=[]
 
+            ## transformation steps of this layer
+            steps=[]
+
+            is_mvn=type(cur_layer)==multivariate_normal.mvn_block
+            is_gf=type(cur_layer)==gaussianization_flow.gf_block
+
+            ## PCA for first layer to get major correlation out of the way
+            use_pca=is_gf and cur_layer.rotation_mode=="householder" and cur_layer.use_householder and layer_ind==0
+
+            calc_second_moment=(is_mvn and cur_layer.cov_type!="identity") or use_pca
+
+            ## 1 pass over the data .. accumulate moments and a subset for the KDE centers
+            moments=None
+            reservoir=None
+
+            if(cur_layer.model_offset or calc_second_moment or is_gf):
+
+                moments=_moment_accumulator(calc_second_moment=calc_second_moment)
+
+                if(is_gf):
+                    reservoir=_reservoir_sampler(max_size=reservoir_size, generator=generator)
+
+                for chunk in layer_input_chunks():
+                    moments.add(chunk)
+
+                    if(reservoir is not None):
+                        reservoir.add(chunk)
+
             ## mean can exist for all layers
             ## subtract means first if necessary
+            center=torch.zeros(dim, dtype=torch.float64, device=data.device)
+
             if(cur_layer.model_offset):
 
-                means=cur_data.mean(axis=0,keepdim=True)
+                means=moments.mean.to(data)[None,:]
                
                 param_list.append(means.squeeze(0))
                 
-                cur_data=cur_data-means 
+                center=moments.mean
+                steps.append(lambda x, means=means: x-means)
             
             # multivariate normal
-            if(type(cur_layer)==multivariate_normal.mvn_block):
+            if(is_mvn):
 
                 if(cur_layer.cov_type=="identity"):
                     # no more variables in layer.. just continue
                     if(len(param_list)>0):
                         all_layers_params.append(torch.cat(param_list))
+                    layer_trafos.append(lambda x, steps=steps: apply_steps(x, steps))
                     continue
              
-                data_matrix=torch.matmul(cur_data.T, cur_data)/float(data.shape[0])
-
-                # svd to increase small eigenvalues and "fix" the data matrix
-                l, sigma, r=scipy.linalg.svd(data_matrix)
-
-                minimum_allowed_singular_val=mvn_min_max_sv_ratio*max(sigma)
-                new_sigma=numpy.where(sigma<minimum_allowed_singular_val, minimum_allowed_singular_val, sigma)
+                data_matrix=moments.second_moment(center).to(data)
 
-                fixed_data_matrix=(l*new_sigma) @ r
+                # eigen decomposition to increase small eigenvalues and "fix" the data matrix
+                sigma, eigenvectors=torch.linalg.eigh(data_matrix)
 
-                loss_fn=get_loss_fn_mvn(fixed_data_matrix, cur_layer.cov_type)
+                minimum_allowed_singular_val=mvn_min_max_sv_ratio*sigma.max()
+                new_sigma=torch.clamp(sigma, min=minimum_allowed_singular_val)
 
-                num_mat_params=cur_layer.total_param_num
-                if(cur_layer.model_offset):
-                    num_mat_params-=dim
-
-                start_vec=numpy.random.normal(size=num_mat_params)
-                res=minimize(loss_fn, start_vec)
+                fixed_data_matrix=(eigenvectors*new_sigma) @ eigenvectors.T
 
                 #### set mvn params
-                param_list.append(torch.from_numpy(res["x"]).to(data))
-
-                inverse_trafo_matrix=torch.from_numpy(get_trafo_matrix_mvn(dim, res["x"], cur_layer.cov_type)).unsqueeze(0).to(data)
+                mvn_params, lower_trig=mvn_params_from_covariance(cur_layer, fixed_data_matrix)
+                param_list.append(mvn_params)
 
-                batch_rotation_matrix=inverse_trafo_matrix.repeat(cur_data.shape[0], 1,1)
+                ## inverse transformation of the layer
+                inverse_trafo_matrix=torch.linalg.solve_triangular(lower_trig, torch.eye(dim, dtype=lower_trig.dtype, device=lower_trig.device), upper=False)
 
-                cur_data = torch.bmm(batch_rotation_matrix, cur_data.unsqueeze(-1)).squeeze(-1)
+                steps.append(lambda x, mat=inverse_trafo_matrix: torch.matmul(x, mat.T))
 
             # gaussianization flows
-            elif(type(cur_layer)==gaussianization_flow.gf_block):
+            elif(is_gf):
 
                 if(cur_layer.rotation_mode=="triangular_combination"):
-                    cur_data=cur_data
                     param_list.append(torch.zeros(cur_layer.num_triangle_params))
                 elif(cur_layer.rotation_mode=="householder"):
                     if(cur_layer.use_householder):
@@ -262,44 +514,34 @@ def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4
                         ## find householder params that correspond to orthogonal transformation of svd of X^T*X (PCA data matrix) if low dimensionality
                         this_vs=0
 
-                        ## USE PCA for first layer to get major correlation out of the way
-                        if(cur_layer.dimension<30 and layer_ind==0):
-
-                            data_matrix=torch.matmul(cur_data.T, cur_data)
+                        if(use_pca):
 
-                            evalues, evecs=scipy.linalg.eig(data_matrix.cpu().numpy())
+                            ## principal axes, ordered by decreasing variance
+                            _, eigenvectors=torch.linalg.eigh(moments.second_moment(center).to(data))
+                            principal_axes=eigenvectors.flip(-1)
 
-                            l, sigma, r=scipy.linalg.svd(data_matrix.cpu().numpy())
-                            
-                            loss_fn=get_loss_fn(r, num_householder_iter=cur_layer.householder_iter)
-
-                            start_vec=numpy.random.normal(size=dim*dim)
-
-                            ## fit a matrix via householder parametrization such that it fits the target orthogonal matrix V^* from SVD of X^T*X (PCA data Matrix)
-                            res=minimize(loss_fn, start_vec)
-
-                            param_list.append(torch.from_numpy(res["x"]).to(data))
-                            this_vs=torch.from_numpy(res["x"]).to(data)
+                            ## householder params whose orthogonal matrix has the principal axes as columns (up to sign), so the inverse rotation decorrelates the data
+                            this_vs=householder_vectors_from_orthogonal(principal_axes[None], num_reflections=cur_layer.householder_iter).flatten()
+                            param_list.append(this_vs)
                             
                         else:
 
-                            this_vs=torch.randn(cur_layer.dimension*cur_layer.householder_iter).to(data)
+                            this_vs=torch.randn(cur_layer.dimension*cur_layer.householder_iter, generator=generator).to(data)
                             param_list.append(this_vs)
 
-                        gblock=gaussianization_flow.gf_block(dim, num_householder_iter=cur_layer.householder_iter, use_permanent_parameters=True)
+                        with _seeded_global_rng(generator):
+                            gblock=gaussianization_flow.gf_block(dim, num_householder_iter=cur_layer.householder_iter, use_permanent_parameters=True)
 
                         hh_pars=this_vs.reshape(gblock.vs.shape)
                         
-                        rotation_matrix=gblock.compute_householder_matrix(hh_pars)
-                        rotation_matrix=rotation_matrix.repeat(cur_data.shape[0], 1,1)
+                        rotation_matrix=gblock.compute_householder_matrix(hh_pars).squeeze(0)
                        
                         ## inverted matrix
-                        cur_data = torch.bmm(rotation_matrix.permute(0,2,1), cur_data.unsqueeze(-1)).squeeze(-1)
+                        steps.append(lambda x, mat=rotation_matrix: torch.matmul(x, mat))
+
                 elif(cur_layer.rotation_mode=="angles"):
-                    cur_data=cur_data
                     param_list.append(torch.zeros(cur_layer.num_angle_pars))
                 elif(cur_layer.rotation_mode=="cayley"):
-                    cur_data=cur_data
                     param_list.append(torch.zeros(cur_layer.num_cayley_pars))
 
              
@@ -310,10 +552,13 @@ def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4
                 if(cur_layer.nonlinear_stretch_type=="classic"):
 
                     ## TODO: This whole init routine for GFs should probably be reworked at some point.
+
+                    ## data subset after the linear part of the layer
+                    kde_data=apply_steps(reservoir.sample(), steps)
                     
                     ## based on percentiles
                     percentiles_to_use=numpy.linspace(0,100,num_kde)#[1:-1]
-                    percentiles=torch.from_numpy(numpy.percentile(cur_data.cpu().numpy(), percentiles_to_use, axis=0)).to(data)
+                    percentiles=_column_percentiles(kde_data, percentiles_to_use)
 
 
                     ## add means
@@ -332,33 +577,6 @@ def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4
                     bw=torch.ones_like(percentiles[None,:,:])*bw
                    
                     flattened_bw=bw.flatten()
-                    #############
-                    """
-                    fig=pylab.figure()
-
-                    for x in cur_data:
-                        pylab.gca().axvline(x[0],color="black")
-                    log_yvals=cur_layer.logistic_kernel_log_pdf(torch.from_numpy(pts)[:,None], percentiles[None,:,0:1], bw[:,:,0:1], torch.ones_like(percentiles[None,:,0:1]))
-                    yvals=log_yvals.exp().detach().numpy()
-                    pylab.gca().plot(pts, yvals, color="green")
-
-                    pylab.savefig("test_kde_0.png")
-
-
-                    fig=pylab.figure()
-
-                    for x in cur_data:
-                        pylab.gca().axvline(x[1],color="black")
-                    log_yvals=cur_layer.logistic_kernel_log_pdf(torch.from_numpy(pts)[:,None], percentiles[None,:,1:2], bw[:,:,1:2], torch.ones_like(percentiles[None,:,1:2]))
-                    yvals=log_yvals.exp().detach().numpy()
-                    pylab.gca().plot(pts, yvals, color="green")
-
-                    pylab.savefig("test_kde_1.png")
-
-                    print("CUR PARAMS", param_list)
-                    ##########
-
-                    """
                     
                     param_list.append(torch.flatten(bw))
 
@@ -388,9 +606,7 @@ def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4
                         this_skewness_signs=cur_layer.kde_skew_signs
 
                     ## transform params according to CDF_norm^-1(CDF_KDE)
-
-                    #gblock=gf_block(dim, num_householder_iter=cur_layer.householder_iter)
-                    cur_data=cur_layer.sigmoid_inv_error_pass_w_params(cur_data, percentiles[None,:,:], bw, torch.ones_like(bw), this_skewness_exponent, this_skewness_signs)
+                    steps.append(lambda x, cur_layer=cur_layer, kde_args=(percentiles[None,:,:], bw, torch.ones_like(bw), this_skewness_exponent, this_skewness_signs): cur_layer.sigmoid_inv_error_pass_w_params(x, *kde_args))
                 
                 else:
                     raise Exception("Data initilaization only implemented (and probably only makes sense) for classic Gaussianization Flow structure")
@@ -398,10 +614,13 @@ def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4
             else:
 
                 ## default transformation .. importantly WITHOUT mean shift (with the _ in front), since the mean shift was done earlier
-                param_list.append(cur_layer._get_desired_init_parameters())
+                with _seeded_global_rng(generator):
+                    param_list.append(cur_layer._get_desired_init_parameters())
                 
             all_layers_params.append(torch.cat(param_list))
 
+            layer_trafos.append(lambda x, steps=steps: apply_steps(x, steps))
+
     all_layers_params=torch.cat(all_layers_params[::-1])
 
     assert(len(all_layers_params)==tot_num_expected_params), ("Total number of defined params (%d) does not match expected params based on layer definitions (%d)" % (len(all_layers_params), tot_num_expected_params))
@@ -410,25 +629,250 @@ def find_init_pars_of_chained_blocks(layer_list, data, mvn_min_max_sv_ratio=1e-4
 
 def _calculate_coverage(base_evals, dim, expected_coverage_probs):
     """
-    Used by main class to calculate coverage for various scenarios.
+    Used by main class to calculate coverage for various scenarios. Sorts the twice log-probabilities once and counts
+    the values below all chi2 thresholds with a (batched) searchsorted.
 
-    Returns: True coverage probs
-             Twice logprobs
+    Parameters:
+        base_evals (numpy array): Base log-probabilities, shape (N,) or (E,N) for E independent sets.
+        dim (int): Dimension of the base space.
+        expected_coverage_probs (numpy array): Expected coverage probabilities.
+
+    Returns: True coverage probs, shape (len(expected_coverage_probs),) or (E, len(expected_coverage_probs))
+             Twice logprobs, same shape as *base_evals*
     """
 
     gauss_log_eval_at_0=-(dim/2.0)*numpy.log(2*numpy.pi)
-    actual_twice_logprob=2*(gauss_log_eval_at_0-base_evals)
+    ## compared against the chi2 thresholds in float64, independent of the model precision
+    actual_twice_logprob=2*(gauss_log_eval_at_0-numpy.asarray(base_evals, dtype=numpy.float64))
   
-    expected_twice_logprob=stats.chi2.ppf(expected_coverage_probs, df=dim)
+    expected_twice_logprob=numpy.atleast_1d(stats.chi2.ppf(expected_coverage_probs, df=dim))
+
+    batched_twice_logprob=numpy.atleast_2d(actual_twice_logprob)
+
+    ## NaNs are sorted to the end and never count as covered
+    sorted_twice_logprob=torch.from_numpy(numpy.ascontiguousarray(numpy.sort(batched_twice_logprob, axis=1)))
+    thresholds=torch.from_numpy(expected_twice_logprob.astype(sorted_twice_logprob.numpy().dtype)).unsqueeze(0).repeat(sorted_twice_logprob.shape[0], 1).contiguous()
+
+    num_covered=torch.searchsorted(sorted_twice_logprob, thresholds, right=False).numpy()
+    num_covered=numpy.minimum(num_covered, (~numpy.isnan(batched_twice_logprob)).sum(axis=1, keepdims=True))
+
+    actual_coverage_probs=num_covered.astype(float)/float(batched_twice_logprob.shape[1])
+
+    if(actual_twice_logprob.ndim==1):
+        actual_coverage_probs=actual_coverage_probs[0]
+
+    return actual_coverage_probs, actual_twice_logprob 
+
+
+class coverage_accumulator(object):
+    """
+    Streaming version of the coverage calculation (see *pdf.coverage_streaming*). For each sub-manifold key, it keeps a histogram of twice the
+    log-probability difference 2*(log(p(0))-log(p(z_base))) in fixed bins whose edges are the chi2 quantiles of the expected coverage probabilities.
+    The true coverage at every expected probability is therefore exact, memory is constant in the number of events, and accumulators of parallel workers 
+    can be merged.
+    """
+    def __init__(self, sub_manifold_dims, num_percentile_points=100):
+        """
+        Parameters:
+
+            sub_manifold_dims (dict): Base dimension for each key ("total" or sub-manifold index).
+            num_percentile_points (int): At how many points along the chi2 true and expected coverage are compared.
+        """
+        self.num_percentile_points=num_percentile_points
+        self.expected_coverage_probs=numpy.linspace(0,1.0,num_percentile_points)
+
+        self.dims=dict(sub_manifold_dims)
+        self.bin_edges=dict()
+        self.histograms=dict()
+        self.num_events=dict()
+
+        for key, dim in self.dims.items():
+            self.bin_edges[key]=stats.chi2.ppf(self.expected_coverage_probs, df=dim)
+            ## bin i counts edges[i-1] <= value < edges[i], the last bin counts values above the last edge
+            self.histograms[key]=numpy.zeros(num_percentile_points+1, dtype=numpy.int64)
+            self.num_events[key]=0
+
+    def add(self, key, base_log_probs):
+        """
+        Adds base log-probabilities (B,) of a batch for the given key. Non-finite values count as events that are never covered.
+        """
+        if(key not in self.dims):
+            raise Exception("Unknown coverage key ", key, " .. available: ", list(self.dims.keys()))
+
+        if(not torch.is_tensor(base_log_probs)):
+            base_log_probs=torch.from_numpy(numpy.asarray(base_log_probs))
+
+        ## compared against the chi2 bin edges in float64, like in *_calculate_coverage*
+        base_log_probs=base_log_probs.detach().flatten().to(torch.float64)
+
+        gauss_log_eval_at_0=-(self.dims[key]/2.0)*numpy.log(2*numpy.pi)
+        twice_logprob=2*(gauss_log_eval_at_0-base_log_probs)
+
+        valid=twice_logprob[~torch.isnan(twice_logprob)]
+
+        edges=torch.from_numpy(self.bin_edges[key]).to(valid)
+        bin_indices=torch.bucketize(valid, edges, right=True)
+
+        self.histograms[key]+=torch.bincount(bin_indices, minlength=self.num_percentile_points+1).cpu().numpy()
+        self.num_events[key]+=int(base_log_probs.shape[0])
+
+    def merge(self, other):
+        """
+        Adds the counts of another accumulator with the same configuration (e.g. from a parallel worker).
+
+        Returns:
+
+            self
+        """
+        if(self.num_percentile_points!=other.num_percentile_points or self.dims!=other.dims):
+            raise Exception("Can only merge coverage accumulators with identical sub-manifolds and percentile points.")
+
+        for key in self.dims.keys():
+            self.histograms[key]+=other.histograms[key]
+            self.num_events[key]+=other.num_events[key]
+
+        return self
+
+    def result(self):
+        """
+        Returns:
+
+            Dictionary with the expected coverage probabilities ("expected"), the true coverage probabilities for every key ("true"), 
+            the number of accumulated events ("num_events") and the raw histograms and bin edges ("histograms", "bin_edges").
+        """
+        return_dict=dict()
+        return_dict["expected"]=self.expected_coverage_probs
+        return_dict["true"]=dict()
+
+        for key in self.dims.keys():
+            if(self.num_events[key]==0):
+                return_dict["true"][key]=numpy.full(self.num_percentile_points, numpy.nan)
+            else:
+                return_dict["true"][key]=numpy.cumsum(self.histograms[key])[:self.num_percentile_points].astype(float)/float(self.num_events[key])
+
+        return_dict["num_events"]=dict(self.num_events)
+        return_dict["histograms"]=dict([(k, v.copy()) for k,v in self.histograms.items()])
+        return_dict["bin_edges"]=dict(self.bin_edges)
+
+        return return_dict
+
+
+def mises_fisher_mean_resultant_length(kappa, p):
+    """
+    Expected mean resultant length A_p(kappa)=I_{p/2}(kappa)/I_{p/2-1}(kappa) of a von Mises-Fisher distribution, evaluated with exponentially scaled Bessel functions (p=2)
+    or the closed form coth(kappa)-1/kappa (p=3) and its series expansion for small kappa.
+
+    Parameters:
+        kappa (Tensor): Concentration parameters.
+        p (int): Dimension of the Euclidean embedding space. 2 for the circle, 3 for the 2-sphere.
+
+    Returns: Tensor of the same shape as *kappa*
+    """
+    if(p==2):
+        return torch.special.i1e(kappa)/torch.special.i0e(kappa)
+    elif(p==3):
+        small_kappa=kappa<1e-3
+        safe_kappa=torch.where(small_kappa, torch.ones_like(kappa), kappa)
 
-    actual_coverage_probs=[]
-   
-    for ind,true_cov in enumerate(expected_coverage_probs):
+        return torch.where(small_kappa, kappa/3.0-kappa**3/45.0, 1.0/torch.tanh(safe_kappa)-1.0/safe_kappa)
+    else:
+        raise Exception("Von Mises-Fisher functions are only implemented for p=2 and p=3, got p=", p)
 
-        actual_coverage_probs.append(float(sum(actual_twice_logprob<expected_twice_logprob[ind]))/float(len(actual_twice_logprob)))
+def mises_fisher_log_normalization(kappa, p):
+    """
+    Log of the normalization constant C_p(kappa) of a von Mises-Fisher density C_p(kappa)*exp(kappa*mu^T x) with respect to the surface measure.
+
+    Parameters:
+        kappa (Tensor): Concentration parameters.
+        p (int): Dimension of the Euclidean embedding space. 2 for the circle, 3 for the 2-sphere.
+
+    Returns: Tensor of the same shape as *kappa*
+    """
+    if(p==2):
+        return -numpy.log(2*numpy.pi)-torch.log(torch.special.i0e(kappa))-kappa
+    elif(p==3):
+        ## log(kappa/(4*pi*sinh(kappa))), written as log(kappa)-log(2*pi)-kappa-log(1-exp(-2kappa)) to avoid overflows
+        small_kappa=kappa<1e-6
+        safe_kappa=torch.where(small_kappa, torch.ones_like(kappa), kappa)
+
+        return torch.where(small_kappa, -numpy.log(4*numpy.pi)*torch.ones_like(kappa), torch.log(safe_kappa)-numpy.log(2*numpy.pi)-safe_kappa-torch.log(-torch.expm1(-2*safe_kappa)))
+    else:
+        raise Exception("Von Mises-Fisher functions are only implemented for p=2 and p=3, got p=", p)
+
+def estimate_mises_fisher_kappa(mean_resultant_length, p, abs_precision=1e-7, max_iter=20):
+    """
+    Maximum-likelihood concentration parameters of von Mises-Fisher distributions for a batch of mean resultant lengths, i.e. solves A_p(kappa)=R 
+    with batched Newton iterations. Starts from the approximation of Banerjee et al. (2005) R(p-R^2)/(1-R^2).
+
+    Parameters:
+        mean_resultant_length (Tensor): Mean resultant lengths R in (0,1).
+        p (int): Dimension of the Euclidean embedding space. 2 for the circle, 3 for the 2-sphere.
+        abs_precision (float): The iteration stops once all Newton updates are smaller than this value.
+        max_iter (int): Maximum number of Newton iterations.
+
+    Returns: Tensor of concentration parameters, same shape as *mean_resultant_length*
+    """
+    R=mean_resultant_length
+
+    kappa=R*(p-R**2)/(1-R**2)
+
+    for _ in range(max_iter):
 
-    return numpy.array(actual_coverage_probs), actual_twice_logprob 
+        a_p=mises_fisher_mean_resultant_length(kappa, p)
 
+        ## derivative of A_p(kappa)
+        a_p_deriv=1.0-a_p**2-((p-1.0)/kappa)*a_p
+
+        new_kappa=kappa-(a_p-R)/a_p_deriv
+
+        ## keep concentrations positive
+        new_kappa=torch.where(new_kappa>0, new_kappa, kappa/2.0)
+
+        max_update=(new_kappa-kappa).abs().max()
+        kappa=new_kappa
+
+        if(max_update<abs_precision):
+            break
+
+    return kappa
+
+def sample_mises_fisher(mean, kappa, samplesize):
+    """
+    Samples von Mises-Fisher distributions for a batch of mean directions and concentrations at once. On the 2-sphere the component along the mean
+    is sampled with the inverse CDF, on the circle the angle is sampled with *torch.distributions.VonMises*.
+
+    Parameters:
+        mean (Tensor): Unit mean directions, shape (B,p) with p=2 or p=3.
+        kappa (Tensor): Concentrations, shape (B,) or (B,1).
+        samplesize (int): Number of samples per distribution.
+
+    Returns: Tensor of samples in embedding coordinates, shape (B, samplesize, p)
+    """
+    batch_size, p=mean.shape
+    kappa=kappa.reshape(batch_size, 1).to(mean)
+
+    if(p==2):
+        angles=torch.distributions.VonMises(torch.zeros_like(kappa), kappa).sample((samplesize,)).squeeze(-1).transpose(0,1)
+        angles=angles+torch.atan2(mean[:,1:2], mean[:,0:1])
+
+        return torch.cat([torch.cos(angles)[:,:,None], torch.sin(angles)[:,:,None]], dim=2)
+
+    elif(p==3):
+
+        uniform_samples=torch.rand(batch_size, samplesize, dtype=mean.dtype, device=mean.device)
+
+        ## component along the mean direction, w=1+log(u+(1-u)exp(-2kappa))/kappa
+        w=1.0+torch.log(uniform_samples+(1.0-uniform_samples)*torch.exp(-2*kappa))/kappa
+        w=w.clamp(-1.0, 1.0)
+
+        ## uniformly distributed tangent directions perpendicular to the mean
+        tangent=torch.randn(batch_size, samplesize, 3, dtype=mean.dtype, device=mean.device)
+        tangent=tangent-(tangent*mean[:,None,:]).sum(dim=2, keepdims=True)*mean[:,None,:]
+        tangent=tangent/(tangent**2).sum(dim=2, keepdims=True).sqrt()
+
+        return w[:,:,None]*mean[:,None,:]+(1.0-w**2).sqrt()[:,:,None]*tangent
+    else:
+        raise Exception("Von Mises-Fisher sampling is only implemented for p=2 and p=3, got p=", p)
 
 def recheck_sampling(pdf, 
                       old_targets,
@@ -556,3 +1000,71 @@ def recheck_sampling(pdf,
 
     return None, None, None, None
 
+
+def check_fixed_step_inference_accuracy(pdf, 
+                                        validation_data, 
+                                        conditional_input=None, 
+                                        amortization_parameters=None,
+                                        reference_solver="dopri5", 
+                                        reference_atol=1e-7, 
+                                        reference_rtol=1e-7):
+    """
+    Compares the log-probabilities of the fixed-step inference path of all CNF layers (option *fixed_step_inference*) with an adaptive reference solver.
+
+    Parameters:
+
+        pdf (jammy_flows.pdf): The PDF to check. Must contain at least one layer with a *fixed_step_inference* option.
+        validation_data (Tensor): Validation set in the coordinates *pdf* expects.
+        conditional_input (Tensor/None): Conditional input for conditional PDFs.
+        amortization_parameters (Tensor/None): Amortization parameters for amortized PDFs.
+        reference_solver (str): Adaptive solver used as reference.
+        reference_atol (float): Absolute tolerance of the reference solver.
+        reference_rtol (float): Relative tolerance of the reference solver.
+
+    Returns:
+
+        Dictionary with the maximum and mean absolute log-prob error and the evaluation times of both paths in seconds.
+    """
+
+    cnf_layers=[l for ll in pdf.layer_list for l in ll if hasattr(l, "fixed_step_inference")]
+
+    if(len(cnf_layers)==0):
+        raise Exception("PDF does not contain any layer that supports fixed-step inference!")
+
+    previous_settings=[(l.fixed_step_inference, l.solver, l.atol, l.rtol, l.step_size_estimates) for l in cnf_layers]
+
+    try:
+        with torch.no_grad():
+
+            for l in cnf_layers:
+                l.fixed_step_inference=1
+
+            tstart=time.time()
+            fixed_step_log_pdf,_,_=pdf(validation_data, conditional_input=conditional_input, amortization_parameters=amortization_parameters)
+            fixed_step_time=time.time()-tstart
+
+            for l in cnf_layers:
+                l.fixed_step_inference=0
+                l.solver=reference_solver
+                l.atol=reference_atol
+                l.rtol=reference_rtol
+                l.step_size_estimates={True: None, False: None}
+
+            tstart=time.time()
+            reference_log_pdf,_,_=pdf(validation_data, conditional_input=conditional_input, amortization_parameters=amortization_parameters)
+            reference_time=time.time()-tstart
+
+    finally:
+        for l, (fixed_step_inference, solver, atol, rtol, step_size_estimates) in zip(cnf_layers, previous_settings):
+            l.fixed_step_inference=fixed_step_inference
+            l.solver=solver
+            l.atol=atol
+            l.rtol=rtol
+            l.step_size_estimates=step_size_estimates
+
+    abs_errors=(fixed_step_log_pdf-reference_log_pdf).abs()
+
+    return dict(max_abs_logprob_error=abs_errors.max().item(),
+                mean_abs_logprob_error=abs_errors.mean().item(),
+                fixed_step_time=fixed_step_time,
+                reference_time=reference_time)
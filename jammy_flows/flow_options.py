@@ -111,6 +111,7 @@ opts_dict["m"]["kwargs"] = dict()
 opts_dict["m"]["kwargs"]["add_rotation"] = (0, [0,1])
 opts_dict["m"]["kwargs"]["num_basis_functions"] = (5, lambda x: x>0)
 opts_dict["m"]["kwargs"]["natural_direction"] = (0, [0,1])
+opts_dict["m"]["kwargs"]["inverse_mode"] = ("bisection", ["bisection", "tabulated"])
 
 ## Spline-Based 1-d flow
 opts_dict["o"] = dict()
@@ -167,6 +168,8 @@ opts_dict["c"]["kwargs"]["solver"] = ("dopri5", ["rk4", "dopri5", "dopri8", "bos
 opts_dict["c"]["kwargs"]["rtol"] = (1e-7, lambda x: (x>0) & (x<1)) ## 
 opts_dict["c"]["kwargs"]["atol"] = (1e-7, lambda x: (x>0) & (x<1)) ## 
 opts_dict["c"]["kwargs"]["step_size"] = (1.0/32.0, lambda x: (x>0) )  ## 
+opts_dict["c"]["kwargs"]["divergence_mode"] = ("exact", ["exact", "hutchinson"]) ## hutchinson: stochastic trace estimator during training, exact in eval mode
+opts_dict["c"]["kwargs"]["fixed_step_inference"] = (0, [0,1]) ## 1: fixed-step rk4 (with step_size) without adjoint/autograd graph for calls under torch.no_grad()
 
 
 # fisher-von-mises s2 flow
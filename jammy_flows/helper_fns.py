@@ -133,29 +133,64 @@ def obtain_bins_and_visualization_regions(samples, model, percentiles=[3.0,97.0]
     return visualization_bounds, density_eval_bounds, histogram_edges
 
 
-def calculate_contours(pdf_vals, bin_volumes, probs=[0.68, 0.95]):
-    totsum = 0.0
-    flattend_pdf = pdf_vals.flatten()
-    #flattend_volumes = bin_volumes.flatten()
+def calculate_contours_batched(pdf_vals, bin_volumes, probs=[0.68, 0.95]):
+    """
+    Density levels that enclose the probabilities *probs* for many events at once. Sorts each event's densities in descending order,
+    accumulates probability mass with a cumulative sum and finds the levels with a batched searchsorted.
+
+    Parameters:
+
+        pdf_vals (numpy array): Density evaluations with shape (E, ...), where E is the number of events.
+        bin_volumes (float/numpy array): Bin volume. Either a scalar, one volume per event (E,), or per-bin volumes broadcastable to *pdf_vals*.
+        probs (list): Enclosed probabilities.
+
+    Returns:
 
-    sorta = numpy.argsort(flattend_pdf)[::-1]
+        numpy array
+            Contour levels, shape (E, len(probs)). NaN where an event does not reach the probability.
+    """
+    pdf_vals=numpy.asarray(pdf_vals)
+    num_events=pdf_vals.shape[0]
+
+    flattened_pdf=pdf_vals.reshape(num_events, -1)
+
+    bin_volumes=numpy.asarray(bin_volumes, dtype=flattened_pdf.dtype)
+    if(bin_volumes.ndim==1 and bin_volumes.shape[0]==num_events and pdf_vals.ndim>1 and pdf_vals.shape[1:]!=bin_volumes.shape):
+        bin_volumes=bin_volumes.reshape([num_events]+[1]*(pdf_vals.ndim-1))
+    
+    flattened_volumes=numpy.broadcast_to(bin_volumes, pdf_vals.shape).reshape(num_events, -1)
 
-    contour_values = []
+    ## descending sort
+    sorta=numpy.argsort(-flattened_pdf, axis=1, kind="stable")
+    sorted_pdf=numpy.take_along_axis(flattened_pdf, sorta, axis=1)
+    sorted_volumes=numpy.take_along_axis(flattened_volumes, sorta, axis=1)
 
-    cur_prob_index = 0
+    cumulative_probs=torch.from_numpy(numpy.ascontiguousarray(numpy.cumsum(sorted_pdf*sorted_volumes, axis=1)))
+    used_probs=torch.from_numpy(numpy.asarray(probs, dtype=cumulative_probs.numpy().dtype)).unsqueeze(0).repeat(num_events, 1).contiguous()
 
-    for ind, pdf_eval in enumerate(flattend_pdf[sorta]):
-        totsum += pdf_eval*bin_volumes#flattend_volumes[sorta][ind]
+    ## first index where the enclosed probability exceeds the requested probability
+    indices=torch.searchsorted(cumulative_probs, used_probs, right=True).numpy()
 
-        if (totsum > probs[cur_prob_index]):
-            contour_values.append(pdf_eval)
-            cur_prob_index += 1
+    reached=indices<flattened_pdf.shape[1]
 
-        if (cur_prob_index >= len(probs)):
-            break
+    contour_values=numpy.take_along_axis(sorted_pdf, numpy.minimum(indices, flattened_pdf.shape[1]-1), axis=1).astype(float)
+    contour_values[~reached]=numpy.nan
 
     return contour_values
 
+def calculate_contours(pdf_vals, bin_volumes, probs=[0.68, 0.95]):
+    """
+    Density levels that enclose the probabilities *probs* of a single density evaluation (see *calculate_contours_batched*).
+
+    Returns:
+
+        list
+            Contour levels of all reached probabilities.
+    """
+    contour_values=calculate_contours_batched(numpy.asarray(pdf_vals)[None], bin_volumes, probs=probs)[0]
+
+    return [val for val in contour_values if numpy.isfinite(val)]
+
 
 def get_bounds_from_contour(cres, boundary=0.1):
 
@@ -187,15 +222,10 @@ def get_density_eval_minmax_values(samples):
     Obtain a simple estimate of pdf extent based on min/max values of samples.
     Used to determine a region for density evaluation (not plotting).
     """
-    mins_maxs = []
-
-    for ind in range(samples.shape[1]):
-        min_val = float(min(samples[:, ind]).cpu())
-        max_val = float(max(samples[:, ind]).cpu())
-
-        mins_maxs.append((min_val, max_val))
+    min_vals=samples.min(dim=0).values.cpu().tolist()
+    max_vals=samples.max(dim=0).values.cpu().tolist()
 
-    return mins_maxs
+    return list(zip(min_vals, max_vals))
 
 
 def get_pdf_on_grid(mins_maxs, npts, model, conditional_input=None, s2_norm="standard", s2_rotate_to_true_value=False, true_values=None):
@@ -3,10 +3,136 @@ import numpy
 import pylab
 import time
 
+from .. import profiling
+from .. import precision
+
 def close(a, b, rtol=1e-5, atol=1e-4):
     equal = torch.abs(a - b) <= atol + rtol * torch.abs(b)
     return equal
 
+class solver_telemetry(object):
+    """
+    Convergence diagnostics of a single solver call. Returned by the solvers if *return_telemetry* is set, and handed to the active profiler (see *jammy_flows.profiling*).
+    """
+
+    ## lower bin edges of the histogram of absolute final residuals, the last bin is open
+    residual_bin_edges=[0.0, 1e-14, 1e-12, 1e-10, 1e-8, 1e-6, 1e-4, 1e-2, 1.0]
+
+    def __init__(self, solver_name, batch_size, bisection_iterations=0, max_newton_iterations=0, target_precision=None):
+        """
+        Parameters:
+
+            solver_name (str): Name of the solver.
+            batch_size (int): Number of items (rows) the solver was called with.
+            bisection_iterations (int): Number of bisection iterations.
+            max_newton_iterations (int): Maximum number of Newton iterations.
+            target_precision (float): Absolute residual above which an item counts as not converged.
+        """
+        self.solver_name=solver_name
+        self.batch_size=batch_size
+        self.bisection_iterations=bisection_iterations
+        self.max_newton_iterations=max_newton_iterations
+        self.target_precision=target_precision
+
+        ## Newton iterations that were actually used (early termination once all items converged)
+        self.newton_iterations=0
+
+        ## fraction of items below the Newton tolerance after every iteration
+        self.fraction_converged=[]
+
+        self.residual_histogram=None
+        self.max_abs_residual=None
+        self.num_non_finite=0
+        self.num_non_converged=0
+
+    def add_newton_iteration(self, num_converged):
+
+        self.newton_iterations+=1
+        self.fraction_converged.append(float(num_converged)/float(max(self.batch_size,1)))
+
+    def set_residuals(self, residuals, num_non_finite=0):
+        """
+        Fills the residual statistics from the final (absolute) residuals of all items.
+        """
+        abs_residuals=residuals.detach().abs().reshape(residuals.shape[0], -1).max(dim=1)[0]
+
+        finite_mask=torch.isfinite(abs_residuals)
+        finite_residuals=abs_residuals[finite_mask]
+
+        bin_edges=torch.tensor(self.residual_bin_edges[1:], dtype=finite_residuals.dtype, device=finite_residuals.device)
+        bin_indices=torch.bucketize(finite_residuals, bin_edges, right=True)
+
+        self.residual_histogram=torch.bincount(bin_indices, minlength=len(self.residual_bin_edges)).cpu().tolist()
+        self.num_non_finite=int((~finite_mask).sum())+num_non_finite
+        self.max_abs_residual=float(finite_residuals.max()) if finite_residuals.numel()>0 else None
+
+        num_non_converged=self.num_non_finite
+        if(self.target_precision is not None):
+            num_non_converged+=int((finite_residuals>self.target_precision).sum())
+
+        self.num_non_converged=num_non_converged
+
+    @property
+    def converged(self):
+        return (self.num_non_converged==0)
+
+    def to_dict(self):
+
+        return dict(solver_name=self.solver_name,
+                    batch_size=self.batch_size,
+                    bisection_iterations=self.bisection_iterations,
+                    max_newton_iterations=self.max_newton_iterations,
+                    newton_iterations=self.newton_iterations,
+                    fraction_converged=list(self.fraction_converged),
+                    residual_bin_edges=list(self.residual_bin_edges),
+                    residual_histogram=self.residual_histogram,
+                    max_abs_residual=self.max_abs_residual,
+                    target_precision=self.target_precision,
+                    num_non_finite=self.num_non_finite,
+                    num_non_converged=self.num_non_converged)
+
+    def __repr__(self):
+
+        return "solver_telemetry(%s: batch %d, %d bisection / %d of %d Newton iterations, %d non-converged, %d non-finite, max residual %s)" % (self.solver_name, self.batch_size, self.bisection_iterations, self.newton_iterations, self.max_newton_iterations, self.num_non_converged, self.num_non_finite, self.max_abs_residual)
+
+class solver_non_finite_error(Exception):
+    """
+    Raised if a solver produces non-finite values. The telemetry of the failed call is available as *telemetry*.
+    """
+    def __init__(self, telemetry):
+
+        self.telemetry=telemetry
+
+        super().__init__("%d non-finite values in Newton iteration %d of %s" % (telemetry.num_non_finite, telemetry.newton_iterations, telemetry.solver_name))
+
+def _target_precision(dtype):
+
+    return precision.tolerance("target_residual", dtype)
+
+def _newton_tolerances(newton_tolerance, dtype):
+    """
+    Absolute and relative Newton convergence tolerances. A given *newton_tolerance* is used as a pure absolute tolerance,
+    otherwise both are chosen based on *dtype*.
+    """
+    if(newton_tolerance is not None):
+        return newton_tolerance, 0.0
+
+    return precision.tolerance("newton_atol", dtype), precision.tolerance("newton_rtol", dtype)
+
+def _finish_telemetry(telemetry, return_telemetry, result):
+    """
+    Hands the telemetry to the active profiler. Prints a non-convergence note as before if nobody consumes the telemetry.
+    """
+    if(profiling.active_profiler is not None):
+        profiling.record_solver_call(telemetry)
+    elif(return_telemetry==False and telemetry.num_non_converged>0):
+        print(telemetry.num_non_converged, " items did not converge in Newton iterations (%s)" % telemetry.solver_name)
+
+    if(return_telemetry):
+        return result, telemetry
+
+    return result
+
 
 def inverse_bisection_n_newton_joint_func_and_grad(func, 
                                                    joint_func, 
@@ -16,8 +142,9 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
                                                    max_boundary=100000.0, 
                                                    num_bisection_iter=25, 
                                                    num_newton_iter=30, 
-                                                   newton_tolerance=1e-14, 
-                                                   verbose=0):
+                                                   newton_tolerance=None, 
+                                                   verbose=0,
+                                                   return_telemetry=False):
     """
     Performs bisection and Newton iterations simulataneously in each 1-d subdimension in a given batch.
 
@@ -31,11 +158,15 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
         max_boundary (float): Maximum boundary for bisection.
         num_bisection_iter (int): Number of bisection iterations.
         num_newton_iter (int): Number of Newton iterations.
+        newton_tolerance (float): Absolute tolerance on the summed Newton update of each batch item. If None, dtype-aware absolute and relative tolerances are used (see *jammy_flows.precision*).
+        return_telemetry (bool): Also return a *solver_telemetry* object with convergence diagnostics.
 
     Returns:
 
         Tensor
             The inverse of the function *func* in each sub-dimension in each batch item.
+        solver_telemetry
+            Only if *return_telemetry* is set.
 
     """
     new_upper = torch.tensor(max_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
@@ -60,8 +191,15 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
         
     prev=mid
 
-    #print("target arg", target_arg.shape)
+    target_prec=_target_precision(target_arg.dtype)
+    newton_atol, newton_rtol=_newton_tolerances(newton_tolerance, target_arg.dtype)
+
+    ## residual statistics are only collected if somebody consumes them
+    collect_telemetry=return_telemetry or (profiling.active_profiler is not None)
+    telemetry=solver_telemetry("bisection_n_newton_joint", target_arg.shape[0], bisection_iterations=num_bisection_iter, max_newton_iterations=num_newton_iter, target_precision=target_prec)
 
+    if(collect_telemetry):
+        residuals=func(prev, *args)-target_arg
 
     above_tolerance_mask=torch.ones( target_arg.shape[0], dtype=torch.bool, device=target_arg.device)
 
@@ -69,6 +207,8 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
 
     broadcasting_bool_args=[True if (prev.shape[0]>1 and arg.shape[0]>1) else False for arg in args ]
 
+    f_eval=None
+
     for i in range(num_newton_iter):
        
         fn_result, f_prime_eval = joint_func(prev[above_tolerance_mask,:], *[a[above_tolerance_mask] if(broadcasting_bool_args[arg_index] == True) else a for arg_index, a in enumerate(args)])
@@ -81,25 +221,25 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
 
         prev=torch.masked_scatter(input=prev, mask=above_tolerance_mask[:,None], source=newsource)
 
-        non_finite_sum=(torch.isfinite(prev)==False).sum()
-        if(non_finite_sum>0):
-
-
-            print("NONZERO")
-            print((torch.isfinite(prev)==False).nonzero())
+        if(collect_telemetry):
+            residuals=torch.masked_scatter(input=residuals, mask=above_tolerance_mask[:,None], source=f_eval.detach())
 
+        non_finite_sum=(~torch.isfinite(prev)).sum()
+        if(non_finite_sum>0):
 
-            print("prev", prev[torch.isfinite(prev)==False])
-            print("feval ", f_eval[torch.isfinite(prev)==False])
-            print("f grad eval ", f_prime_eval[torch.isfinite(prev)==False])
+            telemetry.add_newton_iteration(int((~above_tolerance_mask).sum()))
+            telemetry.num_non_finite=int(non_finite_sum)
+            telemetry.num_non_converged=int(non_finite_sum)
 
-            raise Exception()
+            raise solver_non_finite_error(telemetry)
 
-        new_tolerance_mask=(torch.abs(update).sum(axis=1))>=newton_tolerance
+        new_tolerance_mask=(torch.abs(update).sum(axis=1))>=(newton_atol+newton_rtol*torch.abs(newsource).sum(axis=1))
     
         above_tolerance_mask=torch.masked_scatter(input=above_tolerance_mask, mask=above_tolerance_mask, source=new_tolerance_mask)
 
-        above_tol=above_tolerance_mask.sum()
+        above_tol=int(above_tolerance_mask.sum())
+
+        telemetry.add_newton_iteration(target_arg.shape[0]-above_tol)
 
         if(verbose):
             print("-- newton iter %d .. %d / %d dims completed" % (i, target_arg.shape[0]-above_tol, target_arg.shape[0]))
@@ -108,20 +248,13 @@ def inverse_bisection_n_newton_joint_func_and_grad(func,
                 print("------ done")
             break
 
-    if(target_arg.dtype==torch.float64):
+    if(collect_telemetry):
+        telemetry.set_residuals(residuals)
+    elif(f_eval is not None):
+        ## items that are still iterated at the end
+        telemetry.num_non_converged=int((torch.abs(f_eval)>target_prec).sum())
 
-        target_prec=1e-7
-    else:
-
-        target_prec=1e-4
-
-    num_non_converged=(torch.abs(f_eval)>target_prec).sum()
-    
-    if( num_non_converged>0):
-        print(num_non_converged, " items did not converge in Newton iterations")
-        print("feval (diff) ",f_eval[torch.abs(f_eval)>target_prec])
-    
-    return prev
+    return _finish_telemetry(telemetry, return_telemetry, prev)
 
 def inverse_bisection_n_newton(func, 
                                grad_func, 
@@ -131,8 +264,9 @@ def inverse_bisection_n_newton(func,
                                max_boundary=100000.0, 
                                num_bisection_iter=25, 
                                num_newton_iter=30, 
-                               newton_tolerance=1e-14, 
-                               verbose=0):
+                               newton_tolerance=None, 
+                               verbose=0,
+                               return_telemetry=False):
     """
     Performs bisection and Newton iterations simulataneously in each 1-d subdimension in a given batch.
 
@@ -146,11 +280,15 @@ def inverse_bisection_n_newton(func,
         max_boundary (float): Maximum boundary for bisection.
         num_bisection_iter (int): Number of bisection iterations.
         num_newton_iter (int): Number of Newton iterations.
+        newton_tolerance (float): Absolute tolerance on the summed Newton update of each batch item. If None, dtype-aware absolute and relative tolerances are used (see *jammy_flows.precision*).
+        return_telemetry (bool): Also return a *solver_telemetry* object with convergence diagnostics.
 
     Returns:
 
         Tensor
             The inverse of the function *func* in each sub-dimension in each batch item.
+        solver_telemetry
+            Only if *return_telemetry* is set.
 
     """
     new_upper = torch.tensor(max_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
@@ -173,18 +311,26 @@ def inverse_bisection_n_newton(func,
         
     prev=mid
 
+    target_prec=_target_precision(target_arg.dtype)
+    newton_atol, newton_rtol=_newton_tolerances(newton_tolerance, target_arg.dtype)
+
+    ## residual statistics are only collected if somebody consumes them
+    collect_telemetry=return_telemetry or (profiling.active_profiler is not None)
+    telemetry=solver_telemetry("bisection_n_newton", target_arg.shape[0], bisection_iterations=num_bisection_iter, max_newton_iterations=num_newton_iter, target_precision=target_prec)
+
+    if(collect_telemetry):
+        residuals=func(prev, *args)-target_arg
+
     above_tolerance_mask=torch.ones( target_arg.shape[0], dtype=torch.bool, device=target_arg.device)
 
+    ## check where we want to broadcast the masking, and wnhere not
+
     broadcasting_bool_args=[True if (prev.shape[0]>1 and arg.shape[0]>1) else False for arg in args ]
 
+    f_eval=None
 
     for i in range(num_newton_iter):
-        #print("tol mask")
-        #print(above_tolerance_mask)
-        #print(prev.shape)
-        #print(prev[above_tolerance_mask,:])
-        #print("target_arg[above_tolerance_mask,:]", target_arg[above_tolerance_mask,:])
-
+       
         masked_args=[a[above_tolerance_mask] if(broadcasting_bool_args[arg_index] == True) else a for arg_index, a in enumerate(args)]
 
         f_eval = func(prev[above_tolerance_mask,:], *masked_args)-target_arg[above_tolerance_mask,:]
@@ -193,31 +339,29 @@ def inverse_bisection_n_newton(func,
 
         update=(f_eval/f_prime_eval)
 
-        #print("UPDATE", update)
-
         newsource=prev[above_tolerance_mask,:]-update
 
         prev=torch.masked_scatter(input=prev, mask=above_tolerance_mask[:,None], source=newsource)
 
-        non_finite_sum=(torch.isfinite(prev)==False).sum()
-        if(non_finite_sum>0):
+        if(collect_telemetry):
+            residuals=torch.masked_scatter(input=residuals, mask=above_tolerance_mask[:,None], source=f_eval.detach())
 
+        non_finite_sum=(~torch.isfinite(prev)).sum()
+        if(non_finite_sum>0):
 
-            print("NONZERO")
-            print((torch.isfinite(prev)==False).nonzero())
+            telemetry.add_newton_iteration(int((~above_tolerance_mask).sum()))
+            telemetry.num_non_finite=int(non_finite_sum)
+            telemetry.num_non_converged=int(non_finite_sum)
 
+            raise solver_non_finite_error(telemetry)
 
-            print("prev", prev[torch.isfinite(prev)==False])
-            print("feval ", f_eval[torch.isfinite(prev)==False])
-            print("f grad eval ", f_prime_eval[torch.isfinite(prev)==False])
+        new_tolerance_mask=(torch.abs(update).sum(axis=1))>=(newton_atol+newton_rtol*torch.abs(newsource).sum(axis=1))
+    
+        above_tolerance_mask=torch.masked_scatter(input=above_tolerance_mask, mask=above_tolerance_mask, source=new_tolerance_mask)
 
-            raise Exception()
+        above_tol=int(above_tolerance_mask.sum())
 
-        new_tolerance_mask=(torch.abs(update).sum(axis=1))>=newton_tolerance
-
-        above_tolerance_mask=torch.masked_scatter(input=above_tolerance_mask, mask=above_tolerance_mask, source=new_tolerance_mask)
-      
-        above_tol=above_tolerance_mask.sum()
+        telemetry.add_newton_iteration(target_arg.shape[0]-above_tol)
 
         if(verbose):
             print("-- newton iter %d .. %d / %d dims completed" % (i, target_arg.shape[0]-above_tol, target_arg.shape[0]))
@@ -226,25 +370,15 @@ def inverse_bisection_n_newton(func,
                 print("------ done")
             break
 
+    if(collect_telemetry):
+        telemetry.set_residuals(residuals)
+    elif(f_eval is not None):
+        ## items that are still iterated at the end
+        telemetry.num_non_converged=int((torch.abs(f_eval)>target_prec).sum())
 
-    num_non_converged=(torch.abs(f_eval)>1e-7).sum()
-
-    if(target_arg.dtype==torch.float64):
-
-        target_prec=1e-7
-    else:
+    return _finish_telemetry(telemetry, return_telemetry, prev)
 
-        target_prec=1e-4
-
-    num_non_converged=(torch.abs(f_eval)>target_prec).sum()
-    
-    if( num_non_converged>0):
-        print(num_non_converged, " items did not converge in Newton iterations")
-        print("feval (diff) ",f_eval[torch.abs(f_eval)>target_prec])
-    
-    return prev
-
-def inverse_bisection_n_newton_slow(func, grad_func, target_arg, *args, min_boundary=-100000.0, max_boundary=100000.0, num_bisection_iter=25, num_newton_iter=30):
+def inverse_bisection_n_newton_slow(func, grad_func, target_arg, *args, min_boundary=-100000.0, max_boundary=100000.0, num_bisection_iter=25, num_newton_iter=30, return_telemetry=False):
    
     new_upper = torch.tensor(max_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
     new_lower = torch.tensor(min_boundary).type(target_arg.dtype).repeat(*target_arg.shape).to(target_arg.device)
@@ -274,6 +408,9 @@ def inverse_bisection_n_newton_slow(func, grad_func, target_arg, *args, min_boun
 
     prev=mid
 
+    telemetry=solver_telemetry("bisection_n_newton_slow", target_arg.shape[0], bisection_iterations=num_bisection_iter, max_newton_iterations=num_newton_iter, target_precision=_target_precision(target_arg.dtype))
+
+    f_eval=None
 
     for i in range(num_newton_iter):
        
@@ -287,41 +424,35 @@ def inverse_bisection_n_newton_slow(func, grad_func, target_arg, *args, min_boun
 
         f_prime_eval=grad_func(prev, *args)
 
-        #print("prime eval ", f_prime_eval)
-        non_finite_sum=(torch.isfinite(prev)==False).sum()
+        non_finite_sum=(~torch.isfinite(prev)).sum()
 
         prev=prev-(f_eval/f_prime_eval)
 
-        if(non_finite_sum>0):
-
-
-            print("NONZERO")
-            print((torch.isfinite(prev)==False).nonzero())
+        telemetry.newton_iterations+=1
 
+        if(non_finite_sum>0):
 
-            print("prev", prev[torch.isfinite(prev)==False])
-            print("feval ", f_eval[torch.isfinite(prev)==False])
-            print("f grad eval ", f_prime_eval[torch.isfinite(prev)==False])
+            telemetry.num_non_finite=int(non_finite_sum)
+            telemetry.num_non_converged=int(non_finite_sum)
 
-            raise Exception()
+            raise solver_non_finite_error(telemetry)
 
-        if(i==(num_newton_iter-1)):
-            num_non_converged=(torch.abs(f_eval)>1e-7).sum()
+    if(f_eval is not None):
+        if(return_telemetry or (profiling.active_profiler is not None)):
+            telemetry.set_residuals(f_eval)
+        else:
+            telemetry.num_non_converged=int((torch.abs(f_eval)>telemetry.target_precision).sum())
 
-            #print(f_eval[torch.abs(f_eval)>1e-5])
-            if( num_non_converged>0):
-                print(num_non_converged, " items did not converge in Newton iterations")
-                print("feval (diff) ",f_eval[torch.abs(f_eval)>1e-7])
-                print("PREV VALUE:", prev[torch.abs(f_eval)>1e-7])
-    
-    return prev
+    return _finish_telemetry(telemetry, return_telemetry, prev)
 
 def inverse_bisection_n_newton_sphere(combined_func, 
                                       find_tangent_func, 
                                       basic_exponential_map_func, 
                                       target_arg, 
                                       *args, 
-                                      num_newton_iter=25):
+                                      num_newton_iter=25,
+                                      newton_tolerance=None,
+                                      return_telemetry=False):
     """
     Performs Newton iterations on the sphere over 1-dimensional potential functions via Exponential maps to find the inverse of a given exponential map on the sphere.
     In initial tests it was found that a very precise application requires at least 40-50 ierations, even though one is already pretty close after 10 iterations.
@@ -336,16 +467,28 @@ def inverse_bisection_n_newton_sphere(combined_func,
         target_arg (float Tensor): The argument at which the inverse functon should be evaluated. Tensor of size (B,D) where B is the batchsize, and D the dimension.
         *args (list): Any extra arguments passed to *func*.
         num_newton_iter (int): Number of Newton iterations.
+        newton_tolerance (float): Step size below which the iteration of a batch item stops. If None, a dtype-aware tolerance is used (see *jammy_flows.precision*).
+        return_telemetry (bool): Also return a *solver_telemetry* object with convergence diagnostics. Residuals are 1-cos of the angle to the target.
 
     Returns:
 
         Tensor
             The inverse of the exponential map.
+        solver_telemetry
+            Only if *return_telemetry* is set.
 
     """
     
     prev=torch.zeros_like(target_arg)
     prev[:,2]=-1.0
+
+    if(newton_tolerance is None):
+        newton_tolerance=precision.tolerance("sphere_newton_tolerance", target_arg.dtype)
+
+    collect_telemetry=return_telemetry or (profiling.active_profiler is not None)
+    telemetry=solver_telemetry("newton_sphere", target_arg.shape[0], max_newton_iterations=num_newton_iter)
+
+    fn_eval=None
   
     for i in range(num_newton_iter):
       
@@ -368,16 +511,22 @@ def inverse_bisection_n_newton_sphere(combined_func,
         projection_2=-projection_2
 
         ## set to 0 once we reach 0
+
+        telemetry.add_newton_iteration(int((projection_2<newton_tolerance).sum()) if collect_telemetry else 0)
         
         ## leave early if possible
-        if( projection_2.max() < 1e-12):
+        if( projection_2.max() < newton_tolerance):
           
             break
 
         #print("proj 2 ", projection_2[19])
         prev=basic_exponential_map_func(prev, new_vs, 0.1*projection_2)
-       
-    return prev
+
+    if(collect_telemetry and fn_eval is not None):
+        telemetry.set_residuals(fn_eval)
+        telemetry.num_non_converged=telemetry.batch_size-int(round(telemetry.fraction_converged[-1]*telemetry.batch_size))
+
+    return _finish_telemetry(telemetry, return_telemetry, prev)
 
 
 def inverse_bisection_n_newton_sphere_fast(combined_func, 
@@ -385,7 +534,9 @@ def inverse_bisection_n_newton_sphere_fast(combined_func,
                                       basic_exponential_map_func, 
                                       target_arg, 
                                       *args, 
-                                      num_newton_iter=25):
+                                      num_newton_iter=25,
+                                      newton_tolerance=None,
+                                      return_telemetry=False):
     """
     Performs Newton iterations on the sphere over 1-dimensional potential functions via Exponential maps to find the inverse of a given exponential map on the sphere.
     In initial tests it was found that a very precise application requires at least 40-50 ierations, even though one is already pretty close after 10 iterations.
@@ -400,21 +551,34 @@ def inverse_bisection_n_newton_sphere_fast(combined_func,
         target_arg (float Tensor): The argument at which the inverse functon should be evaluated. Tensor of size (B,D) where B is the batchsize, and D the dimension.
         *args (list): Any extra arguments passed to *func*.
         num_newton_iter (int): Number of Newton iterations.
+        newton_tolerance (float): Step size below which the iteration of a batch item stops. If None, a dtype-aware tolerance is used (see *jammy_flows.precision*).
+        return_telemetry (bool): Also return a *solver_telemetry* object with convergence diagnostics. Residuals are 1-cos of the angle to the target.
 
     Returns:
 
         Tensor
             The inverse of the exponential map.
+        solver_telemetry
+            Only if *return_telemetry* is set.
 
     """
     
     prev=torch.zeros_like(target_arg)
     prev[:,2]=-1.0
 
+    if(newton_tolerance is None):
+        newton_tolerance=precision.tolerance("sphere_newton_tolerance", target_arg.dtype)
+
     above_tolerance_mask=torch.ones( target_arg.shape[0], dtype=torch.bool, device=target_arg.device)
         
     broadcasting_bool_args=[True if (prev.shape[0]>1 and arg.shape[0]>1) else False for arg in args ]
 
+    collect_telemetry=return_telemetry or (profiling.active_profiler is not None)
+    telemetry=solver_telemetry("newton_sphere_fast", target_arg.shape[0], max_newton_iterations=num_newton_iter)
+
+    if(collect_telemetry):
+        residuals=torch.full((target_arg.shape[0],1), float("nan"), dtype=target_arg.dtype, device=target_arg.device)
+
     for i in range(num_newton_iter):
     
         phi_res, _, jac_phi,_=combined_func(prev[above_tolerance_mask], *[a[above_tolerance_mask] if(broadcasting_bool_args[arg_index] == True) else a for arg_index, a in enumerate(args)])
@@ -422,6 +586,9 @@ def inverse_bisection_n_newton_sphere_fast(combined_func,
         
         fn_eval=-(phi_res*target_arg[above_tolerance_mask]).sum(axis=-1, keepdims=True)+1.0
 
+        if(collect_telemetry):
+            residuals=torch.masked_scatter(input=residuals, mask=above_tolerance_mask[:,None], source=fn_eval.detach())
+
         res_vec=-torch.bmm(jac_phi.permute(0,2,1), target_arg[above_tolerance_mask].unsqueeze(2)).squeeze(-1)#*basic_pot_func.unsqueeze(1).unsqueeze(2)
 
         grad_norm=(res_vec**2).sum(axis=1, keepdims=True).sqrt()
@@ -442,13 +609,20 @@ def inverse_bisection_n_newton_sphere_fast(combined_func,
 
 
         # check if any of the projections are below tolerance so we can switch them off for next iteration
-        new_tolerance_mask=(torch.abs(projection_2[:,0]))>=1e-12
+        new_tolerance_mask=(torch.abs(projection_2[:,0]))>=newton_tolerance
     
         above_tolerance_mask=torch.masked_scatter(input=above_tolerance_mask, mask=above_tolerance_mask, source=new_tolerance_mask)
 
+        above_tol=int(above_tolerance_mask.sum())
+
+        telemetry.add_newton_iteration(target_arg.shape[0]-above_tol)
      
-        if(above_tolerance_mask.sum()==0):
+        if(above_tol==0):
             
             break
        
-    return prev
\ No newline at end of file
+    if(collect_telemetry):
+        telemetry.set_residuals(residuals)
+        telemetry.num_non_converged=int(above_tolerance_mask.sum())
+
+    return _finish_telemetry(telemetry, return_telemetry, prev)
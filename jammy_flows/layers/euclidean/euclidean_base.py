@@ -26,7 +26,8 @@ class euclidean_base(layer_base.layer_base):
             self.offsets = torch.zeros(dimension).type(torch.double).unsqueeze(0)
 
             if(self.use_permanent_parameters):
-                self.offsets = nn.Parameter(torch.randn(dimension).type(torch.double).unsqueeze(0))
+                ## same shape as after *init_params*
+                self.offsets = nn.Parameter(torch.randn(dimension).type(torch.double))
             
             self.total_param_num+=dimension
             
@@ -5,6 +5,7 @@ import numpy
 from .. import bisection_n_newton as bn
 from .. import layer_base
 from ... import extra_functions
+from ... import precision
 from .. import matrix_fns
 from . import euclidean_base
 from .. import spline_fns
@@ -46,6 +47,11 @@ def generate_log_function_bounded_in_logspace(min_val_normal_space=1, max_val_no
 
     return f
 
+def _uses_approximate_icdf(layer):
+    """
+    The normal icdf approximations are evaluated in float64 islands for lower-precision models, the exact isigmoid inverse is not.
+    """
+    return layer.inverse_function_type!="isigmoid"
 
 class gf_block(euclidean_base.euclidean_base):
     def __init__(self,
@@ -470,6 +476,7 @@ class gf_block(euclidean_base.euclidean_base):
         return Q
 
    
+    @precision.float64_island(condition=_uses_approximate_icdf)
     def sigmoid_inv_error_pass_w_params(self, x, datapoints, log_widths, log_norms, skew_exponents, skew_signs):
 
         log_cdf_l, log_sf_l, _=self.logistic_kernel_log_pdf_quantities(x, datapoints,log_widths,log_norms, skew_exponents, skew_signs, calculate_pdf=False)  
@@ -558,6 +565,7 @@ class gf_block(euclidean_base.euclidean_base):
                 return (-1.0*total_factor)*mask_neg+(1.0-mask_neg)*total_factor
 
     
+    @precision.float64_island(condition=_uses_approximate_icdf)
     def sigmoid_inv_error_pass_log_derivative_w_params(self, x, datapoints, log_widths, log_norms, skew_exponents, skew_signs):
 
         log_cdf, log_sf, log_pdf=self.logistic_kernel_log_pdf_quantities(x, datapoints,log_widths,log_norms, skew_exponents, skew_signs, calculate_pdf=True)  
@@ -661,7 +669,7 @@ class gf_block(euclidean_base.euclidean_base):
 
                 log_total=log_numerator-log_denominator
                 
-                mask_neg=(cdf_l<=0.5).double()
+                mask_neg=(cdf_l<=0.5).type(log_cdf_l.dtype)
                 extra_plus_minus_factor=(1.0-2*cdf_l)*mask_neg+(-1.0+2*cdf_l)*(1-mask_neg)
               
                 return_derivs[full_deriv_mask]=(log_total-log_cdf_l-log_sf_l+log_pdf+torch.log(extra_plus_minus_factor))[full_deriv_mask]
@@ -669,6 +677,7 @@ class gf_block(euclidean_base.euclidean_base):
 
                 return return_derivs
 
+    @precision.float64_island(condition=_uses_approximate_icdf)
     def sigmoid_inv_error_pass_combined_val_n_log_derivative(self, x, datapoints, log_widths, log_norms, skew_exponents, skew_signs):
         """
         Used by inverse flow to compactly calculate both quantities.
@@ -681,6 +690,7 @@ class gf_block(euclidean_base.euclidean_base):
 
         return new_val, log_deriv
 
+    @precision.float64_island(condition=_uses_approximate_icdf)
     def sigmoid_inv_error_pass_combined_val_n_normal_derivative(self, x, datapoints, log_widths, log_norms, skew_exponents, skew_signs):
         """
         Used by Newton iterations (requires derivative instead of log-derivative).
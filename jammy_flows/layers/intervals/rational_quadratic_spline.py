@@ -90,6 +90,10 @@ class rational_quadratic_spline(interval_base.interval_base):
             smooth_second_derivative (int): Determines if second derivatives should be smooth. Only works for 2 basis function currently. Ignores *min_derivative* if positive.
             restrict_max_min_width_height_ratio (float): Maximum relative between maximum/miniumum of widths/heights.. negative will not constrain this quantity. 
 
+        Inputs outside of the interval do not raise an Exception by default, since the check would synchronize with the device in every call. They are
+        recorded and raise when calling *pdf.check_spline_violations* (e.g. once per epoch). Until then, their log-probabilities are not meaningful. 
+        *jammy_flows.layers.spline_fns.set_debug_checks(True)* restores the immediate Exception.
+
         """
         super().__init__(dimension=dimension, euclidean_to_interval_as_first=euclidean_to_interval_as_first, use_permanent_parameters=use_permanent_parameters, low_boundary=low_boundary, high_boundary=high_boundary)
         
@@ -146,28 +150,11 @@ class rational_quadratic_spline(interval_base.interval_base):
         self.min_derivative=min_derivative
         self.restrict_max_min_width_height_ratio=restrict_max_min_width_height_ratio
 
-    def _flow_mapping(self, inputs, extra_inputs=None): 
-        
-        [x, log_det]=inputs
-
-        if(self.use_permanent_parameters):
-            widths=self.rel_log_widths.to(x)
-            heights=self.rel_log_heights.to(x)
-            derivatives=None
-            if(self.num_derivative_params>0):
-                derivatives=self.rel_log_derivatives.to(x)
+        ## normalized knot table of fixed parameters, rebuilt only if the parameters change
+        self.knot_table_cache=spline_fns.knot_table_cache()
 
-        else:
-            
-            assert( extra_inputs is not None), "Conditional PDF.. require *extra_inputs*"
-            assert( (extra_inputs.shape[0]==x.shape[0]) or (extra_inputs.shape[0]==1) ), ("Extra inputs must be Tensor of shape B X .. (B=Batch size) or 1 X .. (broadcasting).. got for first dimension instead : ", extra_inputs.shape[0])
+    def _build_knot_table(self, widths, heights, derivatives, x):
 
-            widths=extra_inputs[:,:self.num_basis_functions]#.reshape(extra_inputs.shape[0], self.rel_log_widths.shape[1])
-            heights=extra_inputs[:,self.num_basis_functions:2*self.num_basis_functions]#.reshape(extra_inputs.shape[0], self.rel_log_heights.shape[1])
-            
-            if(self.num_derivative_params>0):
-                derivatives=extra_inputs[:,2*self.num_basis_functions:]#.reshape(extra_inputs.shape[0], self.rel_log_derivatives.shape[1])
-        
         if(self.smooth_second_derivative==0):
 
             if(self.fix_boundary_derivatives>0):
@@ -179,20 +166,18 @@ class rational_quadratic_spline(interval_base.interval_base):
 
                 derivatives=torch.cat([first_and_last, derivatives, first_and_last], dim=-1)
 
-            x, log_det_update=spline_fns.rational_quadratic_spline(x, 
-                                                             widths, 
-                                                             heights, 
-                                                             derivatives, 
-                                                             inverse=False, 
-                                                             left=self.low_boundary, 
-                                                             right=self.high_boundary, 
-                                                             bottom=self.low_boundary, 
-                                                             top=self.high_boundary, 
-                                                             rel_min_bin_width=self.min_width,
-                                                             rel_min_bin_height=self.min_height,
-                                                             min_derivative=self.min_derivative,
-                                                             restrict_max_min_width_height_ratio=self.restrict_max_min_width_height_ratio
-                                                             )
+            return spline_fns.rational_quadratic_knot_table(widths, 
+                                                            heights, 
+                                                            derivatives, 
+                                                            left=self.low_boundary, 
+                                                            right=self.high_boundary, 
+                                                            bottom=self.low_boundary, 
+                                                            top=self.high_boundary, 
+                                                            rel_min_bin_width=self.min_width,
+                                                            rel_min_bin_height=self.min_height,
+                                                            min_derivative=self.min_derivative,
+                                                            restrict_max_min_width_height_ratio=self.restrict_max_min_width_height_ratio
+                                                            )
         else:
 
             if(self.fix_boundary_derivatives>0):
@@ -203,97 +188,88 @@ class rational_quadratic_spline(interval_base.interval_base):
 
                 first_and_last=derivatives
 
-            x, log_det_update=spline_fns.rational_quadratic_spline_smooth(x, 
-                                                             widths, 
-                                                             heights, 
-                                                             unnormalized_boundary_derivatives=first_and_last,
-                                                             inverse=False, 
-                                                             left=self.low_boundary, 
-                                                             right=self.high_boundary, 
-                                                             bottom=self.low_boundary, 
-                                                             top=self.high_boundary, 
-                                                             rel_min_bin_width=self.min_width,
-                                                             rel_min_bin_height=self.min_height,
-                                                             min_derivative=self.min_derivative,
-                                                             restrict_max_min_width_height_ratio=self.restrict_max_min_width_height_ratio
-                                                             )
-       
-        log_det_new=log_det+log_det_update.sum(axis=-1)
-        
-        return x, log_det_new
-
-    def _inv_flow_mapping(self, inputs, extra_inputs=None):
-
-        [x, log_det]=inputs
+            return spline_fns.rational_quadratic_smooth_knot_table(widths, 
+                                                                   heights, 
+                                                                   unnormalized_boundary_derivatives=first_and_last,
+                                                                   left=self.low_boundary, 
+                                                                   right=self.high_boundary, 
+                                                                   bottom=self.low_boundary, 
+                                                                   top=self.high_boundary, 
+                                                                   rel_min_bin_width=self.min_width,
+                                                                   rel_min_bin_height=self.min_height,
+                                                                   min_derivative=self.min_derivative,
+                                                                   restrict_max_min_width_height_ratio=self.restrict_max_min_width_height_ratio
+                                                                   )
+
+    def _get_knot_table(self, x, extra_inputs=None):
+        """
+        Returns the knot table of the spline. Tables of fixed parameters are reused from the knot table cache as long as the parameters do not change.
+        """
 
         if(self.use_permanent_parameters):
-            widths=self.rel_log_widths.to(x)
-            heights=self.rel_log_heights.to(x)
-            derivatives=None
+            
+            cache_sources=[self.rel_log_widths, self.rel_log_heights]
             if(self.num_derivative_params>0):
-                derivatives=self.rel_log_derivatives.to(x)
+                cache_sources.append(self.rel_log_derivatives)
+
+            def build_fn():
+                widths=self.rel_log_widths.to(x)
+                heights=self.rel_log_heights.to(x)
+                derivatives=None
+                if(self.num_derivative_params>0):
+                    derivatives=self.rel_log_derivatives.to(x)
+
+                return self._build_knot_table(widths, heights, derivatives, x)
 
         else:
             
             assert( extra_inputs is not None), "Conditional PDF.. require *extra_inputs*"
             assert( (extra_inputs.shape[0]==x.shape[0]) or (extra_inputs.shape[0]==1) ), ("Extra inputs must be Tensor of shape B X .. (B=Batch size) or 1 X .. (broadcasting).. got for first dimension instead : ", extra_inputs.shape[0])
 
-            widths=extra_inputs[:,:self.num_basis_functions]#.reshape(extra_inputs.shape[0], self.rel_log_widths.shape[1])
-            heights=extra_inputs[:,self.num_basis_functions:2*self.num_basis_functions]#.reshape(extra_inputs.shape[0], self.rel_log_heights.shape[1])
-            
-            if(self.num_derivative_params>0):
-                derivatives=extra_inputs[:,2*self.num_basis_functions:]#.reshape(extra_inputs.shape[0], self.rel_log_derivatives.shape[1])
-        
-        if(self.smooth_second_derivative==0):
+            cache_sources=[extra_inputs]
 
-            if(self.fix_boundary_derivatives>0):
-                ## add fixed log derivatives to first and last of derivatives tensor .. derivatives must exist here
-                
-                assert(self.deriv_num_bd_subtraction==2)
+            def build_fn():
+                widths=extra_inputs[:,:self.num_basis_functions]#.reshape(extra_inputs.shape[0], self.rel_log_widths.shape[1])
+                heights=extra_inputs[:,self.num_basis_functions:2*self.num_basis_functions]#.reshape(extra_inputs.shape[0], self.rel_log_heights.shape[1])
+                derivatives=None
+                if(self.num_derivative_params>0):
+                    derivatives=extra_inputs[:,2*self.num_basis_functions:]#.reshape(extra_inputs.shape[0], self.rel_log_derivatives.shape[1])
 
-                first_and_last=torch.ones(derivatives.shape[:-1]+(1,)).to(x)*self.boundary_log_derivs_fixed_value
+                return self._build_knot_table(widths, heights, derivatives, x)
 
-                derivatives=torch.cat([first_and_last, derivatives, first_and_last], dim=-1)
+        return self.knot_table_cache.get_table(cache_sources, build_fn, x.dtype, x.device)
 
-            x, log_det_update=spline_fns.rational_quadratic_spline(x, 
-                                                             widths, 
-                                                             heights, 
-                                                             derivatives, 
-                                                             inverse=True, 
-                                                             left=self.low_boundary, 
-                                                             right=self.high_boundary, 
-                                                             bottom=self.low_boundary, 
-                                                             top=self.high_boundary, 
-                                                             rel_min_bin_width=self.min_width,
-                                                             rel_min_bin_height=self.min_height,
-                                                             min_derivative=self.min_derivative,
-                                                             restrict_max_min_width_height_ratio=self.restrict_max_min_width_height_ratio
-                                                             )
-        else:
+    def _flow_mapping(self, inputs, extra_inputs=None): 
+        
+        [x, log_det]=inputs
 
-            if(self.fix_boundary_derivatives>0):
+        knot_table=self._get_knot_table(x, extra_inputs=extra_inputs)
 
-                first_and_last=torch.ones(widths.shape[:-1]+(2,)).to(x)*self.boundary_log_derivs_fixed_value
+        x, log_det_update=spline_fns.rational_quadratic_spline_from_knot_table(x, 
+                                                                               knot_table, 
+                                                                               inverse=False, 
+                                                                               left=self.low_boundary, 
+                                                                               right=self.high_boundary, 
+                                                                               bottom=self.low_boundary, 
+                                                                               top=self.high_boundary)
+       
+        log_det_new=log_det+log_det_update.sum(axis=-1)
+        
+        return x, log_det_new
 
-            else:
-                assert(self.num_derivative_params==2 and derivatives is not None)
+    def _inv_flow_mapping(self, inputs, extra_inputs=None):
 
-                first_and_last=derivatives
-                
-            x, log_det_update=spline_fns.rational_quadratic_spline_smooth(x, 
-                                                             widths, 
-                                                             heights, 
-                                                             unnormalized_boundary_derivatives=first_and_last,
-                                                             inverse=True, 
-                                                             left=self.low_boundary, 
-                                                             right=self.high_boundary, 
-                                                             bottom=self.low_boundary, 
-                                                             top=self.high_boundary, 
-                                                             rel_min_bin_width=self.min_width,
-                                                             rel_min_bin_height=self.min_height,
-                                                             min_derivative=self.min_derivative,
-                                                             restrict_max_min_width_height_ratio=self.restrict_max_min_width_height_ratio
-                                                             )
+        [x, log_det]=inputs
+
+        knot_table=self._get_knot_table(x, extra_inputs=extra_inputs)
+
+        x, log_det_update=spline_fns.rational_quadratic_spline_from_knot_table(x, 
+                                                                               knot_table, 
+                                                                               inverse=True, 
+                                                                               left=self.low_boundary, 
+                                                                               right=self.high_boundary, 
+                                                                               bottom=self.low_boundary, 
+                                                                               top=self.high_boundary)
        
         log_det_new=log_det+log_det_update.sum(axis=-1)
       
@@ -325,6 +301,9 @@ class rational_quadratic_spline(interval_base.interval_base):
         if(self.num_derivative_params>0):
             self.rel_log_derivatives.data[0,:]=params[counter:counter+self.num_derivative_params]
 
+        ## writes into .data do not increase the version counter
+        self.knot_table_cache.reset()
+
     def _obtain_layer_param_structure(self, param_dict, extra_inputs=None, previous_x=None, extra_prefix=""): 
 
         extra_input_counter=0
@@ -25,6 +25,13 @@ class layer_base(nn.Module):
     def get_total_param_num(self):
         return self.total_param_num
 
+    def works_in_embedding_space(self):
+        """
+        Returns True if the layer takes and returns embedding coordinates in its (inverse) flow mapping. Manifold layers can override this
+        to work in embedding coordinates within a chain of layers, independent of the default parametrization of the PDF.
+        """
+        return bool(self.always_parametrize_in_embedding_space)
+
     ## return the potentially desired initalization params of this layer
     def get_desired_init_parameters(self):
         """
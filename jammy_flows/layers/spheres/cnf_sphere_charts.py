@@ -37,15 +37,29 @@ def find_parameters(module):
 
 sphere = Sphere()
 
+## number of function evaluations per step of the adaptive solvers, used to obtain step size estimates from the evaluation counters
+ADAPTIVE_SOLVER_EVALS_PER_STEP={"dopri5": 6, "dopri8": 13, "bosh3": 3, "fehlberg2": 3, "adaptive_heun": 2}
+
 def divergence_bf(dx, y, **unused_kwargs):
     sum_diag = 0.
     for i in range(y.shape[1]):
         sum_diag += torch.autograd.grad(dx[:, i].sum(), y, create_graph=True)[0].contiguous()[:, i].contiguous()
     return sum_diag.contiguous()
 
+def divergence_approx(dx, y, e=None, **unused_kwargs):
+    """
+    Hutchinson trace estimator of the divergence, i.e. e^T (d dx/dy) e with a single vector-Jacobian product.
+    """
+    e_dzdx = torch.autograd.grad(dx, y, e, create_graph=True)[0]
+    e_dzdx_e = e_dzdx * e
+    approx_tr_dzdx = e_dzdx_e.view(y.shape[0], -1).sum(dim=1)
+    return approx_tr_dzdx
+
+def sample_rademacher_like(y):
+    return torch.randint(low=0, high=2, size=y.shape, device=y.device).to(y) * 2 - 1
+
 
 def create_network(input_size, output_size, hidden_size, n_hidden):
-    print("creating network with hidden size ", hidden_size, " and num hidden ", n_hidden)
     net = [nn.Linear(input_size, hidden_size)]
     for _ in range(n_hidden):
         net += [nn.Tanh(), nn.Linear(hidden_size, hidden_size)]
@@ -70,23 +84,51 @@ class TimeNetwork(nn.Module):
 
 class ODEfunc(nn.Module):
 
-    def __init__(self, diffeq):
+    def __init__(self, diffeq, divergence_fn="exact"):
         super(ODEfunc, self).__init__()
 
+        assert(divergence_fn in ["exact", "hutchinson"])
+
         self.diffeq = diffeq
+        self.divergence_fn = divergence_fn
         
         self.register_buffer("_num_evals", torch.tensor(0.))
 
+        ## noise vector for the hutchinson estimator - fixed during a solve, so adaptive solvers see a deterministic function
+        self._e = None
+
     def before_odeint(self, e=None):
         self._num_evals.fill_(0)
+        self._e = e
 
     def num_evals(self):
         return self._num_evals.item()
 
     def forward(self, t, states):
+        """
+        *states* holds (y, logp) and optionally constant states (zero derivative) that define the chart: (loc, [hutchinson noise], [extra_inputs]).
+        Passing them as states instead of module attributes keeps the function stateless, so the same module can be reused for all charts and calls,
+        while the adjoint backward pass still sees the correct chart.
+        """
         assert len(states) >= 2
         y = states[0]
 
+        constant_states = states[2:]
+        e = self._e
+
+        if(len(constant_states)>0):
+
+            extra_input_index=1
+            if(self.divergence_fn=="hutchinson"):
+                e = constant_states[1].detach()
+                extra_input_index=2
+
+            extra_inputs=None
+            if(len(constant_states)>extra_input_index):
+                extra_inputs=constant_states[extra_input_index]
+
+            self.diffeq.set_chart(constant_states[0], extra_inputs=extra_inputs)
+
         # increment num evals
         self._num_evals += 1
 
@@ -100,9 +142,15 @@ class ODEfunc(nn.Module):
          
             dy = self.diffeq(t, y)
           
-            divergence = divergence_bf(dy, y).unsqueeze(-1)
+            if(self.divergence_fn=="hutchinson"):
+                if(e is None):
+                    self._e = sample_rademacher_like(y)
+                    e = self._e
+                divergence = divergence_approx(dy, y, e=e).unsqueeze(-1)
+            else:
+                divergence = divergence_bf(dy, y).unsqueeze(-1)
 
-        return tuple([dy, -divergence])
+        return tuple([dy, -divergence]+[torch.zeros_like(cs) for cs in constant_states])
 
 
 def _flip(x, dim):
@@ -112,11 +160,17 @@ def _flip(x, dim):
 
 
 class SphereProj(nn.Module):
-    def __init__(self, func, loc, extra_inputs=None):
+    def __init__(self, func, loc=None, extra_inputs=None):
         super(SphereProj, self).__init__()
         self.base_func = func
         self.man = sphere
-        self.loc = loc.detach()
+        self.set_chart(loc, extra_inputs=extra_inputs)
+
+    def set_chart(self, loc, extra_inputs=None):
+        """
+        Sets the chart location (and the conditional inputs) for the next integration.
+        """
+        self.loc = loc.detach() if loc is not None else None
         self.extra_inputs=extra_inputs
 
     def forward(self, t, x):
@@ -155,7 +209,9 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         solver="rk4", 
         atol=1e-7,
         rtol=1e-7,
-        step_size=1.0/32.0):
+        step_size=1.0/32.0,
+        divergence_mode="exact",
+        fixed_step_inference=0):
 
         """
         Continuous manifold normalizing flow - Symbol: "c"
@@ -173,6 +229,11 @@ class cnf_sphere_charts(sphere_base.sphere_base):
             atol (float): Absolute tolerance. (Used for adaptive solvers like dopri)
             rtol (float): Relative tolerance. (Used for adaptive solvers like dopri)
             step_size (float): Step size for fixed step solvers (like rk4, euler).
+            divergence_mode (str): One of ["exact", "hutchinson"]. *Hutchinson* uses a stochastic Rademacher trace estimator (fixed noise per solve) in training mode, which 
+                                   requires a single vector-Jacobian product per function evaluation. In eval mode the exact divergence is always used.
+            fixed_step_inference (int): If 1, calls without gradient recording (e.g. under *torch.no_grad()*) use a fixed-step RK4 integration with *step_size*, 
+                                        without the adjoint method and with preallocated state buffers, independent of *solver*. 
+                                        Use *check_fixed_step_inference_accuracy* to compare against the adaptive solver.
 
         """
 
@@ -205,161 +266,287 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         self.solver = solver
         self.atol = atol
         self.rtol = rtol
-        self.solver_options = {'step_size': step_size}
         self.man = sphere
         self.num_charts=num_charts
+
+        assert(divergence_mode in ["exact", "hutchinson"])
+        self.divergence_mode=divergence_mode
+
+        self.fixed_step_inference=fixed_step_inference
+        self.step_size=step_size
             
         ## a function
         self.func = AmbientProjNN(TimeNetwork(self.cnf_network))
 
+        ## chart scheduling state that is reused across charts and calls
+        self.integration_time_cache=dict()
+        self.chart_functions=dict()
+        self.step_size_estimates={True: None, False: None}
+
+        self.reset_num_evals()
+
     def set_variables_from_parent(self, parent):
         if(self.use_permanent_parameters == False):
             self.variables=find_parameters(parent)
         else:
             self.variables=None
  
-    def _forward(self, z, reverse=False, charts=4, extra_inputs=None):
-        integration_times = torch.tensor(
-            [[i/charts, (i + 1)/charts] for i in range(charts)]
-        )
-        if reverse:
-            #flip each time steps [s_t, e_t]
-            integration_times = _flip(integration_times, -1)
-            #reorder time steps from 0 -> n to give n -> 0
-            integration_times = _flip(integration_times, 0)
+    def _get_integration_times(self, reverse, dtype, device):
+        """
+        Returns the per-chart integration intervals as a (num_charts, 2) tensor. Cached per direction, dtype and device, so the time grid is only
+        created and moved to the device once.
+        """
+        key=(reverse, dtype, device)
 
-        # initial values
-        loc = z#.detach()
-        tangval = self.man.log(loc, z)
+        if(key not in self.integration_time_cache):
 
-        logpz_t = 0
-            
-        #### Apparently the scale does not have to be reversed .. log-dets are automatically reversed by switching the times
-        #scale = -1 if reverse else 1
-        scale=1
+            time_grid=torch.linspace(0.0, 1.0, self.num_charts+1, dtype=dtype, device=device)
+            integration_times=torch.stack([time_grid[:-1], time_grid[1:]], dim=1)
 
-        for time in integration_times:
-            chartproj = SphereProj(self.func, loc, extra_inputs=extra_inputs)
-            chartfunc = ODEfunc(chartproj)
+            if reverse:
+                #flip each time steps [s_t, e_t]
+                integration_times = _flip(integration_times, -1)
+                #reorder time steps from 0 -> n to give n -> 0
+                integration_times = _flip(integration_times, 0)
 
-            logpz_t -= scale * self.man.logdetexp(loc, tangval)
+            self.integration_time_cache[key]=integration_times
 
-            # integrate as a tangent space operation
-            state_t = odeint(
-                    chartfunc,
-                    (tangval, torch.zeros(tangval.shape[0], 1).to(tangval)),
-                    time.to(z),
-                    atol=self.atol,
-                    rtol=self.rtol,
-                    method=self.solver,
-                    options=self.solver_options,
-                    adjoint_params=self.variables
-                )
-
-            # extract information
-            state_t = tuple(s[1] for s in state_t)
-            y_t, logpy_t = state_t[:2]
-            y_t = self.man.proju(loc, y_t)
+        return self.integration_time_cache[key]
 
-            #print("YT ", y_t)
-            # log p updates
-            logpz_t -= logpy_t.squeeze()
-            logpz_t += scale * self.man.logdetexp(loc, y_t)
+    def _get_fixed_step_times(self, reverse, dtype, device):
+        """
+        Returns the fixed-step RK4 integration grid of every chart as a list of (stage times (num_steps, 4), step sizes) tuples. The grid is constructed 
+        like the fixed grid of torchdiffeq: steps of *step_size* from the start of each chart interval, with the last step truncated at its end 
+        (decreasing times are integrated in negated time). Cached per direction, dtype, device, step size and number of charts.
+        """
+        key=("fixed_step", reverse, dtype, device, self.step_size, self.num_charts)
 
-            # set up next iteration values
-            z_n = self.man.exp(loc, y_t)
-            loc = z_n
-            tangval = self.man.log(loc, z_n)
+        if(key not in self.integration_time_cache):
 
-        return z_n, logpz_t
+            integration_times=self._get_integration_times(reverse, dtype, device)
 
-    """
-    def _forward(self, z, reverse=False, extra_inputs=None):
+            direction=-1.0 if reverse else 1.0
 
-        #print("extra input ")
-        #print(extra_inputs)
-        #print("Z %.20f" % z[0][0],z.shape)
-        integration_times = torch.tensor(
-            [[i/self.num_charts, (i + 1)/self.num_charts] for i in range(self.num_charts)]
-        )
-        if reverse:
-            #flip each time steps [s_t, e_t]
-            integration_times = _flip(integration_times, -1)
-            #reorder time steps from 0 -> n to give n -> 0
-            integration_times = _flip(integration_times, 0)
-
-        #print("integration times ", integration_times)
-        # initial values
+            chart_grids=[]
+
+            for start_time, end_time in integration_times*direction:
+
+                num_points=int(torch.ceil((end_time-start_time)/self.step_size+1).item())
+
+                grid=torch.arange(0, num_points, dtype=dtype, device=device)*self.step_size+start_time
+                grid[-1]=end_time
+
+                grid=grid*direction
+                steps=grid[1:]-grid[:-1]
+
+                ## RK4 3/8-rule stage times, the same scheme torchdiffeq uses for "rk4"
+                stage_times=torch.stack([grid[:-1], grid[:-1]+steps/3.0, grid[:-1]+steps*(2.0/3.0), grid[1:]], dim=1)
+
+                chart_grids.append((stage_times, steps.tolist()))
+
+            self.integration_time_cache[key]=chart_grids
+
+        return self.integration_time_cache[key]
+
+    def _eval_inference_dynamics(self, chartproj, t, y, dy_out, dlogp_out):
+        """
+        Evaluates the vector field and the negative exact divergence into the preallocated buffers *dy_out* and *dlogp_out*.
+        Autograd is only enabled locally for the Jacobian diagonal, no graph survives the call.
+        """
+        with torch.enable_grad():
+            y_grad=y.detach().requires_grad_(True)
+            dy=chartproj(t, y_grad)
+
+            divergence=0.0
+            for i in range(y_grad.shape[1]):
+                divergence=divergence+torch.autograd.grad(dy[:, i].sum(), y_grad, retain_graph=(i<y_grad.shape[1]-1))[0][:, i]
+
+        dy_out.copy_(dy.detach())
+        dlogp_out.copy_(-divergence.detach().unsqueeze(-1))
+
+    def _integrate_chart_fixed_step(self, chartproj, tangval, stage_times, steps, buffers):
+        """
+        Fixed-step RK4 (3/8 rule) integration of one chart for inference. Returns (y, logp) in the preallocated state buffers.
+        """
+        y, logp, y_tmp, k_y, k_logp=buffers
+
+        y.copy_(tangval)
+        logp.zero_()
+
+        for step_times, step in zip(stage_times, steps):
 
-   
-        loc = z.detach()
+            self._eval_inference_dynamics(chartproj, step_times[0], y, k_y[0], k_logp[0])
+
+            torch.add(y, k_y[0], alpha=step/3.0, out=y_tmp)
+            self._eval_inference_dynamics(chartproj, step_times[1], y_tmp, k_y[1], k_logp[1])
+
+            torch.add(y, k_y[1], alpha=step, out=y_tmp)
+            y_tmp.add_(k_y[0], alpha=-step/3.0)
+            self._eval_inference_dynamics(chartproj, step_times[2], y_tmp, k_y[2], k_logp[2])
+
+            torch.add(y, k_y[0], alpha=step, out=y_tmp)
+            y_tmp.add_(k_y[1], alpha=-step).add_(k_y[2], alpha=step)
+            self._eval_inference_dynamics(chartproj, step_times[3], y_tmp, k_y[3], k_logp[3])
+
+            y.add_(k_y[0]+3.0*(k_y[1]+k_y[2])+k_y[3], alpha=step*0.125)
+            logp.add_(k_logp[0]+3.0*(k_logp[1]+k_logp[2])+k_logp[3], alpha=step*0.125)
+
+        return y, logp
+
+    def use_fixed_step_inference(self):
+        """
+        The fixed-step inference path is used if it is activated and no gradients are recorded.
+        """
+        return bool(self.fixed_step_inference) and (torch.is_grad_enabled()==False)
+
+    def _get_chart_functions(self, divergence_fn):
+        """
+        The chart projection and ODE function modules are built once and only receive a new chart location for every chart.
+        They are stored in a plain dict, so they are not registered as submodules (the state dict stays unchanged). The chart itself is handed over
+        via constant ODE states (see *ODEfunc.forward*).
+        """
+        if(divergence_fn not in self.chart_functions):
+            chartproj = SphereProj(self.func)
+            self.chart_functions[divergence_fn]=(chartproj, ODEfunc(chartproj, divergence_fn=divergence_fn))
+
+        return self.chart_functions[divergence_fn]
+
+    def _get_solver_options(self, reverse):
+
+        if(self.solver in ADAPTIVE_SOLVER_EVALS_PER_STEP.keys()):
+            ## reuse the step size estimate of the previous chart/call as the first step
+            if(self.step_size_estimates[reverse] is not None):
+                return {"first_step": self.step_size_estimates[reverse]}
+            
+            return dict()
+
+        ## the current step size, which may have been changed after construction
+        return {'step_size': self.step_size}
+
+    def _update_step_size_estimate(self, reverse, chart_evals, time_interval_length):
+
+        if(self.solver not in ADAPTIVE_SOLVER_EVALS_PER_STEP.keys()):
+            return
+
+        num_steps=max(1.0, chart_evals/float(ADAPTIVE_SOLVER_EVALS_PER_STEP[self.solver]))
+        self.step_size_estimates[reverse]=time_interval_length/num_steps
+
+    def num_evals(self, total=False):
+        """
+        Returns the number of ODE function evaluations of the last forward/inverse pass (summed over all charts), or the number of 
+        all evaluations since the last *reset_num_evals* call if *total* is True. Evaluations of the adjoint backward pass are not included.
+        """
+        if(total):
+            return self.total_num_evals
+
+        return self.last_num_evals
+
+    def reset_num_evals(self):
+
+        self.last_num_evals=0
+        self.total_num_evals=0
+ 
+    def _forward(self, z, reverse=False, extra_inputs=None):
         
+        integration_times=self._get_integration_times(reverse, z.dtype, z.device)
+        time_interval_length=1.0/float(self.num_charts)
 
+        # initial values
+        loc = z#.detach()
         tangval = self.man.log(loc, z)
-        
+
         logpz_t = 0
-        
-        scale = -1 if reverse else 1
 
+        ## the stochastic trace estimator is only used during training, one noise vector for the whole solve
+        divergence_fn="exact"
+        hutchinson_noise=None
+        if(self.divergence_mode=="hutchinson" and self.training):
+            divergence_fn="hutchinson"
+            hutchinson_noise=sample_rademacher_like(tangval)
 
-        for time in integration_times:
+        chartproj, chartfunc=self._get_chart_functions(divergence_fn)
+        chartfunc.before_odeint()
 
-            print("TIME ", time)
-            chartproj = SphereProj(self.func, loc)
-            chartfunc = ODEfunc(chartproj)
+        fixed_step=self.use_fixed_step_inference()
+
+        if(fixed_step):
+            fixed_step_grids=self._get_fixed_step_times(reverse, z.dtype, z.device)
+
+            ## state buffers (y, logp, y_tmp, k_y, k_logp) are allocated once per call and reused for all charts and steps
+            fixed_step_buffers=(torch.empty_like(tangval),
+                                tangval.new_empty(tangval.shape[0], 1),
+                                torch.empty_like(tangval),
+                                tangval.new_empty((4,)+tuple(tangval.shape)),
+                                tangval.new_empty(4, tangval.shape[0], 1))
+
+        ## constant states that are appended to the chart location
+        extra_constant_states=[]
+        if(hutchinson_noise is not None):
+            extra_constant_states.append(hutchinson_noise)
+        if(extra_inputs is not None):
+            extra_constant_states.append(extra_inputs)
+
+        #### Apparently the scale does not have to be reversed .. log-dets are automatically reversed by switching the times
+        #scale = -1 if reverse else 1
+        scale=1
+
+        evals_before_chart=0
+
+        for chart_index, time in enumerate(integration_times):
 
             logpz_t -= scale * self.man.logdetexp(loc, tangval)
-            print("1st logpy", self.man.logdetexp(loc, tangval))
-           
-            # integrate as a tangent space operation
 
-          
-            state_t = odeint(
-                    chartfunc,
-                    (tangval, torch.zeros(tangval.shape[0], 1).to(tangval)),
-                    time.to(z),
-                    atol=self.atol,
-                    rtol=self.rtol,
-                    method=self.solver,
-                    options=self.solver_options,
-                    adjoint_params=extra_inputs
-                )
-
-            # extract information
-            state_t = tuple(s[1] for s in state_t)
+            if(fixed_step):
+
+                chartproj.set_chart(loc, extra_inputs=extra_inputs)
+                stage_times, steps=fixed_step_grids[chart_index]
+                y_t, logpy_t=self._integrate_chart_fixed_step(chartproj, tangval, stage_times, steps, fixed_step_buffers)
+
+                evals_before_chart+=4*len(steps)
+
+            else:
+                # integrate as a tangent space operation
+                state_t = odeint(
+                        chartfunc,
+                        tuple([tangval, torch.zeros(tangval.shape[0], 1, dtype=tangval.dtype, device=tangval.device), loc.detach()]+extra_constant_states),
+                        time,
+                        atol=self.atol,
+                        rtol=self.rtol,
+                        method=self.solver,
+                        options=self._get_solver_options(reverse),
+                        adjoint_params=self.variables
+                    )
+
+                evals_after_chart=chartfunc.num_evals()
+                self._update_step_size_estimate(reverse, evals_after_chart-evals_before_chart, time_interval_length)
+                evals_before_chart=evals_after_chart
+
+                # extract information
+                state_t = tuple(s[1] for s in state_t)
+                y_t, logpy_t = state_t[:2]
 
-            
-            y_t, logpy_t = state_t[:2]
-            
             y_t = self.man.proju(loc, y_t)
-            
+
             # log p updates
             logpz_t -= logpy_t.squeeze()
-            print("2nd logpy", logpy_t.squeeze())
-
             logpz_t += scale * self.man.logdetexp(loc, y_t)
 
-            print("3rd logpy", self.man.logdetexp(loc, y_t))
-
             # set up next iteration values
             z_n = self.man.exp(loc, y_t)
-
-            
-            loc = z_n.detach()
+            loc = z_n
             tangval = self.man.log(loc, z_n)
-          
-        #print("Zn %.20f" % z_n[0][0])
 
+        ## release references to the last chart
+        chartproj.set_chart(None)
+
+        self.last_num_evals=int(evals_before_chart)
+        self.total_num_evals+=self.last_num_evals
 
         return z_n, logpz_t
-    """
-    """    
-    def get_regularization_states(self):
-        return None
 
-    def num_evals(self):
-        return self.odefunc._num_evals.item()
-    """
+    def is_embedding_native(self):
+        return True
+
     def _inv_flow_mapping(self, inputs, extra_inputs=None):
 
         #if(self.higher_order_cylinder_parametrization):
@@ -367,7 +554,7 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         ## input structure: 0-num_amortization_params -> MLP  , num_amortizpation_params-end: -> moebius trafo
         [x,log_det]=inputs
 
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             x, log_det=self.spherical_to_eucl_embedding(x, log_det)
         """
         if(self.natural_direction):
@@ -380,7 +567,7 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         res, log_det_fac=self._forward(x, reverse=False, extra_inputs=extra_inputs)
         log_det=log_det+log_det_fac
 
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             res, log_det=self.eucl_to_spherical_embedding(res, log_det)
 
         return res, log_det, None
@@ -389,7 +576,7 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         
         [x,log_det]=inputs
 
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             x, log_det=self.spherical_to_eucl_embedding(x, log_det)
 
         """
@@ -401,7 +588,7 @@ class cnf_sphere_charts(sphere_base.sphere_base):
         res, log_det_fac=self._forward(x, reverse=True, extra_inputs=extra_inputs)
         log_det=log_det+log_det_fac
 
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             res, log_det=self.eucl_to_spherical_embedding(res, log_det)
 
         return res, log_det
@@ -444,6 +444,9 @@ class exponential_map_s2(sphere_base.sphere_base):
 
    
 
+    def is_embedding_native(self):
+        return True
+
     def _inv_flow_mapping(self, inputs, extra_inputs=None):
 
         [x,log_det]=inputs
@@ -457,7 +460,7 @@ class exponential_map_s2(sphere_base.sphere_base):
         else:
             potential_pars=self.potential_pars.to(x)
 
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             x, log_det=self.spherical_to_eucl_embedding(x, log_det)
            
         if(self.natural_direction):
@@ -481,7 +484,7 @@ class exponential_map_s2(sphere_base.sphere_base):
             log_det=log_det+log_det_update
 
 
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             # embedding to intrinsic
             result, log_det=self.eucl_to_spherical_embedding(result, log_det)
 
@@ -493,7 +496,7 @@ class exponential_map_s2(sphere_base.sphere_base):
 
         assert(x.dtype==torch.float64), "V flow requires float64, otherwise it often will not converge correctly!"
         
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             # s2 flow is defined in embedding space,
             #x, log_det=self.eucl_to_spherical_embedding(x, log_det)
 
@@ -523,7 +526,7 @@ class exponential_map_s2(sphere_base.sphere_base):
             log_det=log_det-0.5*slog_det
 
 
-        if(self.always_parametrize_in_embedding_space==False):
+        if(self.works_in_embedding_space()==False):
             result, log_det=self.eucl_to_spherical_embedding(result, log_det)
 
         return result, log_det
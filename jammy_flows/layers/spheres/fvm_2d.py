@@ -8,6 +8,7 @@ from .. import spline_fns
 from ..bisection_n_newton import inverse_bisection_n_newton_sphere, inverse_bisection_n_newton_sphere_fast
 from ...amortizable_mlp import AmortizableMLP
 from ...extra_functions import list_from_str
+from ... import precision
 
 from ..euclidean.polynomial_stretch_flow import psf_block
 from ..euclidean.euclidean_do_nothing import euclidean_do_nothing
@@ -177,15 +178,167 @@ class fisher_von_mises_2d(sphere_base.sphere_base):
             if(use_permanent_parameters):
                 self.correlated_flow_params = nn.Parameter(torch.randn(1, self.total_num_correlated_params))
 
-        
-           
+        ## without any spline sub-flows the layer is an exact rotated vMF, which allows for a closed-form
+        ## evaluation/sampling path in embedding coordinates (see *vmf_inv_flow_mapping* / *vmf_flow_mapping*)
+        self.analytic_vmf_fast_path=(add_vertical_rq_spline_flow==0 and add_circular_rq_spline_flow==0 and add_correlated_rq_spline_flow==0)
+
+    def is_embedding_native(self):
+
+        ## only the analytic path works natively in embedding coordinates
+        return self.analytic_vmf_fast_path
+
+    def inv_flow_mapping(self, inputs, extra_inputs=None, include_area_element=True):
+
+        if(self.analytic_vmf_fast_path):
+            return self.vmf_inv_flow_mapping(inputs, extra_inputs=extra_inputs)
+
+        return super().inv_flow_mapping(inputs, extra_inputs=extra_inputs, include_area_element=include_area_element)
+
+    def flow_mapping(self, inputs, extra_inputs=None):
+
+        if(self.analytic_vmf_fast_path):
+            return self.vmf_flow_mapping(inputs, extra_inputs=extra_inputs)
+
+        return super().flow_mapping(inputs, extra_inputs=extra_inputs)
+
+    def _get_kappa(self, x, extra_inputs=None):
+        """
+        Returns kappa with shape (B,1) (or (1,1) for permanent parameters). *extra_inputs* do not contain the householder parameters.
+        """
+        if(extra_inputs is not None):
+            return self.kappa_fn(extra_inputs[:,:1])
+        else:
+            return self.kappa_fn(self.loglike_kappa.to(x))
+
+    def _get_small_kappa_mask(self, kappa):
+
+        return kappa<precision.tolerance("small_kappa", kappa.dtype)
+
+    @precision.float64_island
+    def _vmf_z_to_uniform(self, z, kappa):
+        """
+        Maps the vMF-distributed z-coordinate (w) to its uniformly distributed counterpart in [-1,1] (the vMF CDF in w).
+        Written in terms of expm1 to be stable for small and large kappa.
+
+        Returns:
+            Tuple of transformed z-coordinate and log-det update (shape (B,)).
+        """
+        w=self.z_scaling_factor*z
+
+        ret=self.z_scaling_factor*(2.0*torch.exp(kappa*(w-1.0))*torch.expm1(-kappa*(w+1.0))/torch.expm1(-2.0*kappa)-1.0)
+        ret=torch.where(self._get_small_kappa_mask(kappa), z, ret)
+
+        log_det_update=(torch.log(2.0*kappa)+kappa*(w-1.0)-torch.log(-torch.expm1(-2.0*kappa)))[:,0]
+
+        return ret, log_det_update
+
+    @precision.float64_island
+    def _vmf_uniform_to_z(self, z, kappa):
+        """
+        Inverse CDF in w of the vMF distribution. Uses logaddexp to be stable for large kappa.
+
+        Returns:
+            Tuple of transformed z-coordinate and log-det update (shape (B,)).
+        """
+        w=self.z_scaling_factor*z
+
+        ret=self.z_scaling_factor*(1.0+torch.logaddexp(torch.log(0.5*(1.0+w)), torch.log(0.5*(1.0-w))-2.0*kappa)/kappa)
+        ret=torch.where(self._get_small_kappa_mask(kappa), z, ret)
+
+        log_det_update=-torch.log(kappa*w+kappa/torch.tanh(kappa))[:,0]
+
+        return ret, log_det_update
+
+    def _replace_z_in_embedding(self, x, new_z):
+        """
+        Replaces the z-coordinate of unit vectors *x* with *new_z* while keeping the azimuthal direction.
+        """
+        xy=x[:,:2]
+        xy_norm=(xy**2).sum(dim=1, keepdims=True).sqrt().clamp(min=torch.finfo(x.dtype).tiny)
+
+        return torch.cat([xy*(torch.sqrt(1.0-new_z**2)/xy_norm), new_z], dim=1)
+
+    def vmf_inv_flow_mapping(self, inputs, extra_inputs=None):
+        """
+        Closed-form replacement of *sphere_base.inv_flow_mapping* when no spline sub-flows are defined.
+        Works directly on the embedding coordinates and only leaves them if intrinsic coordinates are requested or a plane projection follows.
+        The resulting log-det is identical to the generic path.
+        """
+        [x, log_det] = inputs
+
+        if(self.works_in_embedding_space()==False):
+            x, log_det=self.spherical_to_eucl_embedding(x, log_det)
+
+        mat=self.compute_rotation_matrix(x, extra_inputs=extra_inputs, mode=self.rotation_mode, device=x.device)
+        x = torch.einsum("...ij, ...j -> ...i", mat.permute(0,2,1), x)
+
+        kappa=self._get_kappa(x, extra_inputs=None if extra_inputs is None else extra_inputs[:,self.num_householder_params:])
+
+        new_z, log_det_update=self._vmf_z_to_uniform(x[:,2:3], kappa)
+        log_det=log_det+log_det_update
+
+        new_z=torch.where(new_z<=-1.0, -1.0+1e-7, new_z)
+        new_z=torch.where(new_z>=1.0, 1.0-1e-7, new_z)
+
+        if(self.euclidean_to_sphere_as_first):
+
+            ## direct stereographic-type projection from z (see *sphere_to_plane*) - the sin(theta) factors cancel
+            log_det=log_det-torch.log(1.0-new_z[:,0])
+            r_g=torch.sqrt(-torch.log( (1.0-new_z)/2.0 )*2.0)
+
+            xy=x[:,:2]
+            xy_norm=(xy**2).sum(dim=1, keepdims=True).sqrt().clamp(min=torch.finfo(x.dtype).tiny)
+
+            return r_g*xy/xy_norm, log_det
+
+        x=self._replace_z_in_embedding(x, new_z)
+
+        if(self.works_in_embedding_space()==False):
+            x, log_det=self.eucl_to_spherical_embedding(x, log_det)
+
+        return x, log_det
+
+    def vmf_flow_mapping(self, inputs, extra_inputs=None):
+        """
+        Closed-form replacement of *sphere_base.flow_mapping* when no spline sub-flows are defined. Samples are generated
+        by the inverse CDF in w and a householder rotation, all in embedding coordinates.
+        """
+        [x, log_det] = inputs
+
+        if(self.euclidean_to_sphere_as_first):
+
+            ## plane to sphere (see *plane_to_sphere*) - the sin(theta) factors cancel
+            r_g=(x**2).sum(dim=1, keepdims=True).sqrt()
+            z=1.0-2.0*torch.exp(-(r_g**2)/2.0)
+            log_det=log_det+torch.log(1.0-z[:,0])
+
+            x=torch.cat([torch.sqrt(1.0-z**2)*x/r_g, z], dim=1)
+
+        elif(self.works_in_embedding_space()==False):
+            x, log_det=self.spherical_to_eucl_embedding(x, log_det)
+
+        kappa=self._get_kappa(x, extra_inputs=None if extra_inputs is None else extra_inputs[:,self.num_householder_params:])
+
+        new_z, log_det_update=self._vmf_uniform_to_z(x[:,2:3], kappa)
+        log_det=log_det+log_det_update
+
+        x=self._replace_z_in_embedding(x, new_z)
+
+        mat=self.compute_rotation_matrix(x, extra_inputs=extra_inputs, mode=self.rotation_mode, device=x.device)
+        x = torch.einsum("...ij, ...j -> ...i", mat, x)
+
+        if(self.works_in_embedding_space()==False):
+            x, log_det=self.eucl_to_spherical_embedding(x, log_det)
+
+        return x, log_det
+
     def _inv_flow_mapping(self, inputs, extra_inputs=None):
         
         [x,log_det]=inputs
             
         sf_extra=None
         
-        if(self.always_parametrize_in_embedding_space):
+        if(self.works_in_embedding_space()):
            
             x, log_det=self.eucl_to_spherical_embedding(x, log_det)
 
@@ -237,12 +390,7 @@ class fisher_von_mises_2d(sphere_base.sphere_base):
         ret= self.z_scaling_factor*((1.0+torch.exp(-2*kappa)-2*torch.exp(kappa*(self.z_scaling_factor*prev_ret-1)))/(-1+torch.exp(-2*kappa)))
 
         #approx_result=ret # nothing happens for k->0
-        if(x.dtype==torch.float32):
-            kappa_mask=kappa<1e-4
-        elif(x.dtype==torch.float64):
-            kappa_mask=kappa<1e-8
-        else:
-            raise Exception("Require 32 or 64 bit float")
+        kappa_mask=kappa<precision.tolerance("small_kappa", x.dtype)
 
            
         ret=torch.where(kappa_mask, prev_ret, ret)  
@@ -314,7 +462,7 @@ class fisher_von_mises_2d(sphere_base.sphere_base):
 
         ret=torch.cat([ret, angle], dim=1)
         
-        if(self.always_parametrize_in_embedding_space):
+        if(self.works_in_embedding_space()):
 
             ret, log_det=self.spherical_to_eucl_embedding(ret, log_det)
 
@@ -324,7 +472,7 @@ class fisher_von_mises_2d(sphere_base.sphere_base):
        
         [x,log_det]=inputs
 
-        if(self.always_parametrize_in_embedding_space):
+        if(self.works_in_embedding_space()):
             x, log_det=self.eucl_to_spherical_embedding(x, log_det)
         
         vertical_params=None
@@ -435,12 +583,7 @@ class fisher_von_mises_2d(sphere_base.sphere_base):
         log_det=log_det-torch.log(kappa*self.z_scaling_factor*prev_ret+kappa/torch.tanh(kappa))[:,0]
         ret=self.z_scaling_factor*(1.0+(1.0/kappa)*torch.log( 0.5*(1.0+self.z_scaling_factor*prev_ret) + (0.5-0.5*self.z_scaling_factor*prev_ret)*torch.exp(-2.0*kappa) ))
 
-        if(x.dtype==torch.float32):
-            kappa_mask=kappa<1e-4
-        elif(x.dtype==torch.float64):
-            kappa_mask=kappa<1e-8
-        else:
-            raise Exception("Require 32 or 64 bit float")
+        kappa_mask=kappa<precision.tolerance("small_kappa", x.dtype)
 
         ret=torch.where(kappa_mask, prev_ret, ret)  
         
@@ -451,7 +594,7 @@ class fisher_von_mises_2d(sphere_base.sphere_base):
 
         ret=torch.cat([ret, angle], dim=1)
 
-        if(self.always_parametrize_in_embedding_space):
+        if(self.works_in_embedding_space()):
             ret, log_det=self.spherical_to_eucl_embedding(ret, log_det)
         
         return ret, log_det
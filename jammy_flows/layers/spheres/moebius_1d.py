@@ -3,10 +3,20 @@ from torch import nn
 import numpy
 
 from . import sphere_base
-from ..bisection_n_newton import inverse_bisection_n_newton
-from ..spline_fns import rational_quadratic_spline
+from ..bisection_n_newton import inverse_bisection_n_newton_joint_func_and_grad, solver_telemetry
+from .. import spline_fns
+from ... import profiling
+from ... import precision
 
+## allowed length of the omega vector of every single Moebius transformation
+MIN_OMEGA_RADIUS=0.001
+MAX_OMEGA_RADIUS=0.999
 
+## the derivative of a single Moebius transformation is bounded by (1+|omega|)/(1-|omega|)
+MAX_COMPONENT_DERIVATIVE=(1.0+MAX_OMEGA_RADIUS)/(1.0-MAX_OMEGA_RADIUS)
+
+## inputs closer to -pi/pi than this map within pi/10 of 0/2pi for every single transformation, so outputs on the other side of the atan2 branch cut can be wrapped unambiguously
+BRANCH_CUT_WINDOW=0.1*numpy.pi/MAX_COMPONENT_DERIVATIVE
 
 class moebius(sphere_base.sphere_base):
     def __init__(self, dimension=1, 
@@ -15,7 +25,10 @@ class moebius(sphere_base.sphere_base):
                        natural_direction=0, 
                        use_permanent_parameters=False, 
                        use_moebius_xyz_parametrization=True, 
-                       num_basis_functions=5):
+                       num_basis_functions=5,
+                       inverse_mode="bisection",
+                       num_inverse_newton_iter=3,
+                       inverse_table_size=256):
         """
         Moebius transformations on the circle. Symbol "m"
 
@@ -26,6 +39,11 @@ class moebius(sphere_base.sphere_base):
             natural_direction (int): If set to 0, log-probability is faster than sampling. Otherwise reversed.
             use_moebius_xyz_parametreization (bool): Two different paramerizations.
             num_basis_functions (int): Number of moebius basis functions.
+            inverse_mode (str): "bisection" (bisection followed by Newton iterations) or "tabulated". The latter uses the closed-form inverse for a single basis function. 
+                                For mixtures it starts from a tabulated inverse of the current parameter set, or from the bracket of the inverses of the single basis functions if parameters differ per batch item, and takes a few safeguarded Newton steps. 
+                                Items that do not converge fall back to bisection.
+            num_inverse_newton_iter (int): Number of Newton steps in the "tabulated" inverse mode. Twice as many are used if parameters differ per batch item, since the bracket is wider than a table bin.
+            inverse_table_size (int): Number of grid points of the tabulated inverse.
 
         """
         super().__init__(dimension=1, euclidean_to_sphere_as_first=euclidean_to_sphere_as_first, add_rotation=add_rotation, use_permanent_parameters=use_permanent_parameters)
@@ -54,6 +72,16 @@ class moebius(sphere_base.sphere_base):
         ## natural direction means no bisection in the forward pass, but in the backward pass
         self.natural_direction=natural_direction
 
+        if(inverse_mode not in ["bisection", "tabulated"]):
+            raise Exception("Unknown inverse mode %s for moebius flow" % inverse_mode)
+
+        self.inverse_mode=inverse_mode
+        self.num_inverse_newton_iter=num_inverse_newton_iter
+        self.inverse_table_size=inverse_table_size
+
+        ## tabulated inverse for fixed parameters
+        self.inverse_table_cache=spline_fns.knot_table_cache()
+
     def _inv_flow_mapping(self, inputs, extra_inputs=None, sf_extra=None):
 
         [x,log_det]=inputs
@@ -73,15 +101,18 @@ class moebius(sphere_base.sphere_base):
         xmask=x>numpy.pi
         x=(xmask)*(x-2*numpy.pi)+(~xmask)*x
 
+        ## x-independent quantities are calculated once for all evaluations
+        moebius_constants=self.moebius_constants(moebius_pars)
+
         if(self.natural_direction):
             ## do inverse in -pi/pi
-            x=inverse_bisection_n_newton(self.simple_moebius_trafo, self.simple_moebius_trafo_deriv, x, moebius_pars, min_boundary=-numpy.pi, max_boundary=numpy.pi, num_bisection_iter=20, num_newton_iter=20)
+            x=self.moebius_trafo_inverse(x, moebius_constants, table_sources=[self.moebius_pars, extra_inputs])
             
-            log_deriv=-torch.log(self.simple_moebius_trafo_deriv(x,moebius_pars)).sum(axis=-1)
+            log_deriv=-torch.log(self.moebius_trafo_deriv(x, *moebius_constants)).sum(axis=-1)
             
         else:
-            log_deriv=torch.log(self.simple_moebius_trafo_deriv(x,moebius_pars)).sum(axis=-1)
-            x=self.simple_moebius_trafo(x, moebius_pars) 
+            x, deriv=self.moebius_trafo_and_deriv(x, *moebius_constants)
+            log_deriv=torch.log(deriv).sum(axis=-1)
         ## switch back to 0-2pi
         smaller_mask=x<0
         x=(smaller_mask)*(2*numpy.pi+x)+(~smaller_mask)*x
@@ -118,13 +149,16 @@ class moebius(sphere_base.sphere_base):
         xmask=x>numpy.pi
         x=(xmask)*(x-2*numpy.pi)+(~xmask)*x
 
+        ## x-independent quantities are calculated once for all evaluations
+        moebius_constants=self.moebius_constants(moebius_pars)
+
         if(self.natural_direction):
-            log_deriv=torch.log(self.simple_moebius_trafo_deriv(x,moebius_pars)).sum(axis=-1)
-            x=self.simple_moebius_trafo(x, moebius_pars)  
+            x, deriv=self.moebius_trafo_and_deriv(x, *moebius_constants)
+            log_deriv=torch.log(deriv).sum(axis=-1)
         else:
-            x=inverse_bisection_n_newton(self.simple_moebius_trafo, self.simple_moebius_trafo_deriv, x, moebius_pars, min_boundary=-numpy.pi, max_boundary=numpy.pi, num_bisection_iter=20, num_newton_iter=20)
+            x=self.moebius_trafo_inverse(x, moebius_constants, table_sources=[self.moebius_pars, extra_inputs])
             
-            log_deriv=-torch.log(self.simple_moebius_trafo_deriv(x,moebius_pars)).sum(axis=-1)
+            log_deriv=-torch.log(self.moebius_trafo_deriv(x, *moebius_constants)).sum(axis=-1)
         ## switch back to 0/2pi
         smaller_mask=x<0
         x=(smaller_mask)*(2*numpy.pi+x)+(~smaller_mask)*x
@@ -137,27 +171,23 @@ class moebius(sphere_base.sphere_base):
 
         return x, log_det
 
-    def simple_moebius_trafo(self, x, omega_pars):
+    def moebius_constants(self, omega_pars):
+        """
+        Calculates all quantities of the Moebius transformation that do not depend on x (omega vectors, normalization weights and the 
+        rotation that fixes -pi). They are passed to *moebius_trafo*, *moebius_trafo_deriv* and *moebius_trafo_and_deriv*.
 
-        ## 
-        
-        cos_x=torch.cos(x)[:,None,:]
-        sin_x=torch.sin(x)[:,None,:]
-        
-        #sin_x=torch.cos(x)[:,None,:]
-        #cos_x=torch.sin(x)[:,None,:]
+        Parameters:
 
-        cos_minus_pi=numpy.cos(-numpy.pi)
-        sin_minus_pi=numpy.sin(-numpy.pi)
+            omega_pars (Tensor): Parameters of shape (B, K, P) with K the number of basis functions.
+
+        Returns:
 
-        MIN_OMEGA_RADIUS=0.001
-        MAX_OMEGA_RADIUS=0.999
+            Tuple of tensors of shape (B, K, 1): omega x/y components, 1-|omega|^2, 1+|omega|^2, cos/sin of the rotation angle, normalized log weights.
+        """
         ## omega_pars = x,y,radius (overaparametrized), normalization
 
         log_length_par=omega_pars[:,:,-2:-1]
 
-        #print("shape log_length", log_length_par.shape)
-
         lse_cat=torch.cat( (torch.zeros_like(log_length_par), -log_length_par),dim=2)
 
         denom=torch.logsumexp(lse_cat, dim=2, keepdims=True)
@@ -165,103 +195,257 @@ class moebius(sphere_base.sphere_base):
         ## sigmoid between min and max omega radius
         omega_length=MIN_OMEGA_RADIUS+torch.exp(numpy.log(MAX_OMEGA_RADIUS-MIN_OMEGA_RADIUS)-denom)
 
-
-        """
-        omega_vec_normed=omega_pars[:,:,:2]/((omega_pars[:,:,:2]**2).sum(axis=2,keepdims=True)).sqrt()
-        omega_vec=omega_vec_normed*omega_length
-
-        """
-
         if(self.use_moebius_xyz_parametrization):
             omega_vec_normed=omega_pars[:,:,:2]/((omega_pars[:,:,:2]**2).sum(axis=2,keepdims=True)).sqrt()
             omega_vec=omega_vec_normed*omega_length
         else:
             omega_vec=torch.cat( (torch.cos(omega_pars[:,:,0:1])*omega_length, torch.sin(omega_pars[:,:,0:1])*omega_length)  , dim=2)
 
-          
-        #single_omegas=torch.sqrt(squared_omegas)
+        omega_x=omega_vec[:,:,0:1]
+        omega_y=omega_vec[:,:,1:2]
 
         o_m_o_sq=1.0-omega_length**2
-        o_p_o_twice=1.0+omega_length**2-2*(cos_x*omega_vec[:,:,0:1]+sin_x*omega_vec[:,:,1:2])
+        o_p_o_sq=1.0+omega_length**2
 
-        o_p_o_twice_m_pi=1.0+omega_length**2-2*(cos_minus_pi*omega_vec[:,:,0:1]+sin_minus_pi*omega_vec[:,:,1:2])
+        ## rotation angle that maps -pi to -pi
+        cos_minus_pi=numpy.cos(-numpy.pi)
+        sin_minus_pi=numpy.sin(-numpy.pi)
+
+        o_p_o_twice_m_pi=o_p_o_sq-2*(cos_minus_pi*omega_x+sin_minus_pi*omega_y)
 
-        y_val_m_pi=o_m_o_sq*(sin_minus_pi-omega_vec[:,:,1:2])-omega_vec[:,:,1:2]*o_p_o_twice_m_pi
-        x_val_m_pi=o_m_o_sq*(cos_minus_pi-omega_vec[:,:,0:1])-omega_vec[:,:,0:1]*o_p_o_twice_m_pi
+        y_val_m_pi=o_m_o_sq*(sin_minus_pi-omega_y)-omega_y*o_p_o_twice_m_pi
+        x_val_m_pi=o_m_o_sq*(cos_minus_pi-omega_x)-omega_x*o_p_o_twice_m_pi
 
         phi_m_pi=torch.atan2(y_val_m_pi,x_val_m_pi)
         rotation_angle=-numpy.pi-phi_m_pi
 
-        y_val=o_m_o_sq*(sin_x-omega_vec[:,:,1:2])-omega_vec[:,:,1:2]*o_p_o_twice
-        x_val=o_m_o_sq*(cos_x-omega_vec[:,:,0:1])-omega_vec[:,:,0:1]*o_p_o_twice
+        log_norms=omega_pars[:,:,-1:]
+        log_weights=log_norms-torch.logsumexp(log_norms, dim=1,keepdim=True)
+
+        return omega_x, omega_y, o_m_o_sq, o_p_o_sq, torch.cos(rotation_angle), torch.sin(rotation_angle), log_weights
+
+    def _moebius_arctan(self, x, cos_x, sin_x, o_p_o_twice, omega_x, omega_y, o_m_o_sq, cos_rot, sin_rot, log_weights):
+
+        y_val=o_m_o_sq*(sin_x-omega_y)-omega_y*o_p_o_twice
+        x_val=o_m_o_sq*(cos_x-omega_x)-omega_x*o_p_o_twice
 
         ### now rotate x xval by rotation_angle
 
-        x_prime=torch.cos(rotation_angle)*x_val-torch.sin(rotation_angle)*y_val
-        y_prime=torch.sin(rotation_angle)*x_val+torch.cos(rotation_angle)*y_val
+        x_prime=cos_rot*x_val-sin_rot*y_val
+        y_prime=sin_rot*x_val+cos_rot*y_val
 
-        arc_tans=torch.atan2(y_prime,x_prime)[:,:,-1:]+numpy.pi
         ## atan (-pi/2, pi/2) -> (pi/2, pi*3/2)
+        arc_tans=torch.atan2(y_prime,x_prime)[:,:,-1:]+numpy.pi
+
+        ## every single transformation maps -pi/pi to 0/2pi, which lies on the branch cut of atan2 .. close to the boundaries (or slightly beyond them after rounding
+        ## in lower precision) a component can end up on the wrong side of the cut, which is undone here
+        near_lower=(x<(-numpy.pi+BRANCH_CUT_WINDOW))[:,None,:]
+        near_upper=(x>(numpy.pi-BRANCH_CUT_WINDOW))[:,None,:]
+
+        arc_tans=torch.where(near_lower & (arc_tans>numpy.pi), arc_tans-2*numpy.pi, arc_tans)
+        arc_tans=torch.where(near_upper & (arc_tans<numpy.pi), arc_tans+2*numpy.pi, arc_tans)
        
-        log_norms=omega_pars[:,:,-1:]
-        weighted_arctan=arc_tans*torch.exp(log_norms-torch.logsumexp(log_norms, dim=1,keepdim=True))
-        #weighted_arctan=weighted_arctan.squeeze(-1)
+        weighted_arctan=arc_tans*torch.exp(log_weights)
       
         ## between -pi to pi
-        res=torch.sum(weighted_arctan, dim=1)-numpy.pi
-        
-        #smaller_mask=(res<0).double()
-        #return_val=smaller_mask*(2*numpy.pi+res)+(1-smaller_mask)*res
-        
-        return res ## transform back to -pi/pi
+        return torch.sum(weighted_arctan, dim=1)-numpy.pi
 
+    def _moebius_deriv(self, o_p_o_twice, o_m_o_sq, log_weights):
 
-    def simple_moebius_trafo_deriv(self, x, omega_pars):
-        
+        weighted_deriv=torch.log(o_m_o_sq/o_p_o_twice)+log_weights
+
+        return torch.exp(torch.logsumexp(weighted_deriv, dim=1))
+
+    def moebius_trafo(self, x, omega_x, omega_y, o_m_o_sq, o_p_o_sq, cos_rot, sin_rot, log_weights):
+        """
+        Moebius transformation in -pi/pi, given the x-independent quantities from *moebius_constants*.
+        """
         cos_x=torch.cos(x)[:,None,:]
         sin_x=torch.sin(x)[:,None,:]
-        
-        #sin_x=torch.cos(x)[:,None,:]
-        #cos_x=torch.sin(x)[:,None,:]
 
-        MIN_OMEGA_RADIUS=0.001
-        MAX_OMEGA_RADIUS=0.999
-        ## omega_pars = x,y,radius (overaparametrized), normalization
+        o_p_o_twice=o_p_o_sq-2*(cos_x*omega_x+sin_x*omega_y)
 
-        log_length_par=omega_pars[:,:,-2:-1]
+        return self._moebius_arctan(x, cos_x, sin_x, o_p_o_twice, omega_x, omega_y, o_m_o_sq, cos_rot, sin_rot, log_weights)
 
-        #print("shape log_length", log_length_par.shape)
+    def moebius_trafo_deriv(self, x, omega_x, omega_y, o_m_o_sq, o_p_o_sq, cos_rot, sin_rot, log_weights):
+        """
+        Derivative of the Moebius transformation, given the x-independent quantities from *moebius_constants*.
+        """
+        cos_x=torch.cos(x)[:,None,:]
+        sin_x=torch.sin(x)[:,None,:]
 
-        lse_cat=torch.cat( (torch.zeros_like(log_length_par), -log_length_par),dim=2)
+        o_p_o_twice=o_p_o_sq-2*(cos_x*omega_x+sin_x*omega_y)
 
-        #print(lse_cat.shape)
+        return self._moebius_deriv(o_p_o_twice, o_m_o_sq, log_weights)
 
-        denom=torch.logsumexp(lse_cat, dim=2, keepdims=True)
-        
-        ## sigmoid between min and max omega radius
-        omega_length=MIN_OMEGA_RADIUS+torch.exp(numpy.log(MAX_OMEGA_RADIUS-MIN_OMEGA_RADIUS)-denom)
+    def moebius_trafo_and_deriv(self, x, omega_x, omega_y, o_m_o_sq, o_p_o_sq, cos_rot, sin_rot, log_weights):
+        """
+        Value and derivative of the Moebius transformation in one pass (shared cos/sin of x). Used as the joint function in Newton iterations.
+        """
+        cos_x=torch.cos(x)[:,None,:]
+        sin_x=torch.sin(x)[:,None,:]
+
+        o_p_o_twice=o_p_o_sq-2*(cos_x*omega_x+sin_x*omega_y)
+
+        return self._moebius_arctan(x, cos_x, sin_x, o_p_o_twice, omega_x, omega_y, o_m_o_sq, cos_rot, sin_rot, log_weights), self._moebius_deriv(o_p_o_twice, o_m_o_sq, log_weights)
+
+    def moebius_trafo_component_inverse(self, y, omega_x, omega_y, o_m_o_sq, o_p_o_sq, cos_rot, sin_rot, log_weights):
+        """
+        Closed-form inverse of every single Moebius transformation (before the convex combination), given the x-independent quantities from *moebius_constants*.
+        The inverse of a Moebius transformation with parameter omega is the transformation with parameter -omega, applied after undoing the rotation.
+
+        Returns:
+
+            Tensor of shape (B, K, 1) in -pi/pi.
+        """
+        cos_y=torch.cos(y)[:,None,:]
+        sin_y=torch.sin(y)[:,None,:]
+
+        ## undo the rotation that fixes -pi
+        cos_w=cos_rot*cos_y+sin_rot*sin_y
+        sin_w=-sin_rot*cos_y+cos_rot*sin_y
+
+        o_p_o_twice=o_p_o_sq+2*(cos_w*omega_x+sin_w*omega_y)
+
+        y_val=o_m_o_sq*(sin_w+omega_y)+omega_y*o_p_o_twice
+        x_val=o_m_o_sq*(cos_w+omega_x)+omega_x*o_p_o_twice
+
+        return torch.atan2(y_val, x_val)
+
+    def moebius_trafo_inverse(self, y, moebius_constants, table_sources=None):
+        """
+        Inverse of the Moebius transformation in -pi/pi.
+
+        Parameters:
+
+            y (Tensor): Target values of shape (B,1) in -pi/pi.
+            moebius_constants (tuple): Output of *moebius_constants*.
+            table_sources (list(Tensor/None)/None): Raw parameter tensors the constants are calculated from. Used to cache the tabulated inverse. If None, the table is not cached.
+
+        Returns:
+
+            Tensor of shape (B,1).
+        """
+        if(self.inverse_mode=="bisection"):
+            return self._bisection_inverse(y, moebius_constants)
+
+        if(self.num_basis_functions==1):
+            return self.moebius_trafo_component_inverse(y, *moebius_constants)[:,0,:]
+
+        if(moebius_constants[0].shape[0]==1):
+            ## one parameter set for the whole batch -> start from the tabulated inverse
+            num_newton_iter=self.num_inverse_newton_iter
+
+            if(table_sources is None):
+                ## the constants can not be identified without their sources
+                grid, table=self._build_inverse_table(moebius_constants, y.dtype, y.device)
+            else:
+                grid, table=self.inverse_table_cache.get_table(table_sources, lambda: self._build_inverse_table(moebius_constants, y.dtype, y.device), y.dtype, y.device)
+
+            upper_index=torch.searchsorted(table, y.contiguous()).clamp(1, self.inverse_table_size-1)
+            lower=grid[upper_index-1]
+            upper=grid[upper_index]
+            lower_val=table[upper_index-1]
+            upper_val=table[upper_index]
 
-        if(self.use_moebius_xyz_parametrization):
-            
-            omega_vec_normed=omega_pars[:,:,:2]/((omega_pars[:,:,:2]**2).sum(axis=2,keepdims=True)).sqrt()
-            omega_vec=omega_vec_normed*omega_length
         else:
-            omega_vec=torch.cat( (torch.cos(omega_pars[:,:,0:1])*omega_length, torch.sin(omega_pars[:,:,0:1])*omega_length)  , dim=2)
+            ## per-item parameters -> the closed-form inverses of the single transformations bracket the inverse of the mixture
+            component_inverses=self.moebius_trafo_component_inverse(y, *moebius_constants)[:,:,0]
 
-        o_m_o_sq=1.0-omega_length**2
-        o_p_o_twice=1.0+omega_length**2-2*(cos_x*omega_vec[:,:,0:1]+sin_x*omega_vec[:,:,1:2])
+            num_newton_iter=2*self.num_inverse_newton_iter
 
-        log_norms=omega_pars[:,:,-1:]
-        weighted_deriv=(torch.log(o_m_o_sq/o_p_o_twice)+log_norms)-torch.logsumexp(log_norms, dim=1,keepdim=True)
+            lower=component_inverses.min(dim=1, keepdim=True)[0]
+            upper=component_inverses.max(dim=1, keepdim=True)[0]
+            lower_val=self.moebius_trafo(lower, *moebius_constants)
+            upper_val=self.moebius_trafo(upper, *moebius_constants)
+
+        ## linear interpolation in the table bin as the starting point
+        rel_pos=(y-lower_val)/(upper_val-lower_val).clamp(min=torch.finfo(y.dtype).tiny)
+        x=lower+rel_pos.clamp(0.0,1.0)*(upper-lower)
+
+        x, converged=self._safeguarded_newton(y, x, lower, upper, moebius_constants, num_newton_iter)
+
+        not_converged=~converged[:,0]
 
-        res=torch.logsumexp(weighted_deriv, dim=1)
+        if(profiling.active_profiler is not None):
+            telemetry=solver_telemetry("moebius_tabulated_newton", y.shape[0], max_newton_iterations=num_newton_iter)
+            telemetry.newton_iterations=num_newton_iter
+            telemetry.num_non_converged=int(not_converged.sum())
+            profiling.record_solver_call(telemetry)
 
-        return torch.exp(res)
+        if(not_converged.sum()>0):
+            ## fall back to bisection for items with very sharp transformations
+            fallback_constants=[c[not_converged] if c.shape[0]>1 else c for c in moebius_constants]
+
+            x=x.clone()
+            x[not_converged]=self._bisection_inverse(y[not_converged], fallback_constants)
+
+        return x
+
+    def _bisection_inverse(self, y, moebius_constants):
+
+        return inverse_bisection_n_newton_joint_func_and_grad(self.moebius_trafo, self.moebius_trafo_and_deriv, y, *moebius_constants, min_boundary=-numpy.pi, max_boundary=numpy.pi, num_bisection_iter=20, num_newton_iter=20)
+
+    def _build_inverse_table(self, moebius_constants, dtype, device):
+        """
+        Tabulates the transformation on an equidistant grid in -pi/pi for a single parameter set. The table is monotonic and spans one full period.
+        """
+        grid=torch.linspace(-numpy.pi, numpy.pi, self.inverse_table_size, dtype=dtype, device=device)
+
+        table=self.moebius_trafo(grid[:,None], *moebius_constants)[:,0]
+
+        ## the transformation fixes -pi/pi, the exact endpoints guarantee that every target lies in a table bin
+        table=torch.cat([grid[:1], table[1:-1], grid[-1:]])
+
+        return grid, table
+
+    def _safeguarded_newton(self, y, x, lower, upper, moebius_constants, num_newton_iter):
+        """
+        Newton steps that stay inside the bracket [lower, upper] around the inverse. Steps leaving the bracket are replaced by bisection steps.
+
+        Returns:
+
+            The improved inverse, and a boolean tensor indicating convergence of every item.
+        """
+        tolerance=precision.tolerance("target_residual", y.dtype)
+
+        converged=torch.zeros_like(y, dtype=torch.bool)
+
+        for _ in range(num_newton_iter):
+
+            f_eval, f_prime_eval=self.moebius_trafo_and_deriv(x, *moebius_constants)
+            residual=f_eval-y
+
+            ## shrink bracket
+            lower=torch.where(residual<0, x, lower)
+            upper=torch.where(residual>0, x, upper)
+
+            update=residual/f_prime_eval
+            new_x=x-update
+
+            outside=(new_x<lower) | (new_x>upper) | (~torch.isfinite(new_x))
+            x=torch.where(outside, 0.5*(lower+upper), new_x)
+
+            ## a collapsed bracket can flag converged steps as outside due to rounding
+            converged=(update.abs()<tolerance) | ((upper-lower)<tolerance)
+
+        return x, converged
+
+    def simple_moebius_trafo(self, x, omega_pars):
+
+        return self.moebius_trafo(x, *self.moebius_constants(omega_pars))
+
+    def simple_moebius_trafo_deriv(self, x, omega_pars):
+        
+        return self.moebius_trafo_deriv(x, *self.moebius_constants(omega_pars))
 
     def _init_params(self, params):
 
         self.moebius_pars.data=params.reshape(1, self.num_basis_functions, self.num_omega_pars)
 
+        ## writes into .data bypass the version counter
+        self.inverse_table_cache.reset()
+
     def _get_desired_init_parameters(self):
 
         ## gaussian init data
@@ -3,6 +3,7 @@ from torch import nn
 import numpy
 import collections
 from .. import layer_base
+from ... import precision
 import itertools
 
 def return_safe_angle_within_pi(x, safety_margin=1e-10):
@@ -52,6 +53,9 @@ class sphere_base(layer_base.layer_base):
         self.rotation_mode=rotation_mode
         self.add_rotation=add_rotation
 
+        ## set by the parent pdf if this layer is part of a chain of layers that can pass embedding coordinates to each other
+        self.embedding_chain_coordinates=False
+
         self.num_householder_params=0
 
         if(self.add_rotation):
@@ -79,8 +83,9 @@ class sphere_base(layer_base.layer_base):
           
                 if(self.use_permanent_parameters):
 
+                    ## same shape as after *init_params*
                     self.householder_params=nn.Parameter(
-                        torch.randn(self.num_householder_params)
+                        torch.randn((1, self.num_householder_params))
                     )
 
                 #else:
@@ -355,9 +360,7 @@ class sphere_base(layer_base.layer_base):
             sign=(x>numpy.pi)*-1.0+(x<=numpy.pi)*1.0
             new_x=(sign>0)*x+(sign<0)*(2*numpy.pi-x)
 
-            used_eps=1e-8
-            if(x.dtype==torch.float32):
-                used_eps=1e-5
+            used_eps=precision.tolerance("boundary_eps", x.dtype)
             ## make sure we dont get any infs
             new_x=torch.where(new_x<=0.0, used_eps, new_x)
             new_x=torch.where(new_x>=2*numpy.pi, 2*numpy.pi-used_eps, new_x)
@@ -506,7 +509,7 @@ class sphere_base(layer_base.layer_base):
         if(self.add_rotation):
             
 
-            if(self.always_parametrize_in_embedding_space==False):
+            if(self.works_in_embedding_space()==False):
                 x, log_det=self.spherical_to_eucl_embedding(x, log_det)
 
             ## householder dimension is one higher than sphere dimension (we rotate in embedding space)
@@ -519,7 +522,7 @@ class sphere_base(layer_base.layer_base):
             #x = torch.bmm(mat.permute(0,2,1), x.unsqueeze(-1)).squeeze(-1)
             x = torch.einsum("...ij, ...j -> ...i", mat.permute(0,2,1), x)
 
-            if(self.always_parametrize_in_embedding_space==False):
+            if(self.works_in_embedding_space()==False):
                 x, log_det=self.eucl_to_spherical_embedding(x, log_det)
 
             
@@ -551,7 +554,7 @@ class sphere_base(layer_base.layer_base):
 
             ## only if sf_extra is None we want to transform
            
-            if(self.always_parametrize_in_embedding_space and sf_extra is None):
+            if(self.works_in_embedding_space() and sf_extra is None):
                 x, log_det=self.eucl_to_spherical_embedding(x, log_det)
 
             #sys.exit(-1)
@@ -570,7 +573,7 @@ class sphere_base(layer_base.layer_base):
         if(self.euclidean_to_sphere_as_first):
             x, log_det, sf_extra=self.plane_to_sphere(x, log_det)
 
-            if(self.always_parametrize_in_embedding_space and sf_extra is None):
+            if(self.works_in_embedding_space() and sf_extra is None):
                 x, log_det=self.spherical_to_eucl_embedding(x, log_det)
       
         ## (2) apply sphere-intrinsic flow
@@ -594,7 +597,7 @@ class sphere_base(layer_base.layer_base):
         #extra_input_counter=0
         if(self.add_rotation):
 
-            if(self.always_parametrize_in_embedding_space==False):
+            if(self.works_in_embedding_space()==False):
                 x, log_det=self.spherical_to_eucl_embedding(x, log_det)
 
             #xy=torch.cat((x, y), dim=1)
@@ -605,7 +608,7 @@ class sphere_base(layer_base.layer_base):
 
             ## use broadcasting
             x = torch.einsum("...ij, ...j -> ...i", mat, x)
-            if(self.always_parametrize_in_embedding_space==False):
+            if(self.works_in_embedding_space()==False):
                 x, log_det=self.eucl_to_spherical_embedding(x, log_det)
 
         return x,log_det
@@ -750,6 +753,17 @@ class sphere_base(layer_base.layer_base):
             else:
                 return x, log_det
 
+    def is_embedding_native(self):
+        """
+        Returns True if the intrinsic flow of this layer is defined in embedding space. Such layers can share embedding coordinates
+        with neighbouring layers of the same kind without intermediate transformations to angles. Overwritten by subclasses.
+        """
+        return False
+
+    def works_in_embedding_space(self):
+
+        return bool(self.always_parametrize_in_embedding_space or self.embedding_chain_coordinates)
+
     def _get_layer_base_dimension(self):
         """ 
         Usually this is just the dimension .. if we work in embedding space and do not project, base space is actually dim+1
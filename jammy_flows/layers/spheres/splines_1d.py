@@ -4,7 +4,7 @@ import numpy
 
 from . import sphere_base
 from ..bisection_n_newton import inverse_bisection_n_newton
-from ..spline_fns import rational_quadratic_spline
+from .. import spline_fns
 
 
 
@@ -37,35 +37,53 @@ class spline_1d(sphere_base.sphere_base):
         ## natural direction means no bisection in the forward pass, but in the backward pass
         self.natural_direction=natural_direction
 
-    def _inv_flow_mapping(self, inputs, extra_inputs=None, sf_extra=None):
+        ## normalized knot table of fixed parameters, rebuilt only if the parameters change
+        self.knot_table_cache=spline_fns.knot_table_cache()
 
-        [x,log_det]=inputs
+    def _get_knot_table(self, x, extra_inputs=None):
 
         if(extra_inputs is not None):
-            spline_pars=torch.reshape(extra_inputs, [-1, self.num_basis_functions, 3])
+            cache_sources=[extra_inputs]
         else:
-            spline_pars=self.spline_pars.to(x)
+            cache_sources=[self.spline_pars]
+
+        def build_fn():
+            if(extra_inputs is not None):
+                spline_pars=torch.reshape(extra_inputs, [-1, self.num_basis_functions, 3])
+            else:
+                spline_pars=self.spline_pars.to(x)
+
+            # mirror derivatives at the endpoints
+            derivs=torch.cat([spline_pars[:,:,2], spline_pars[:,0:1,2]], dim=1)
+
+            return spline_fns.rational_quadratic_knot_table(spline_pars[:,:,0],
+                                                            spline_pars[:,:,1],
+                                                            derivs,
+                                                            left=0, right=2*numpy.pi, bottom=0, top=2*numpy.pi,
+                                                            rel_min_bin_width=1e-3,
+                                                            rel_min_bin_height=1e-3,
+                                                            min_derivative=1e-3)
+
+        return self.knot_table_cache.get_table(cache_sources, build_fn, x.dtype, x.device)
+
+    def _inv_flow_mapping(self, inputs, extra_inputs=None, sf_extra=None):
+
+        [x,log_det]=inputs
 
         if(self.always_parametrize_in_embedding_space):
             # embedding to intrinsic
             x, log_det=self.eucl_to_spherical_embedding(x, log_det)
 
-        # mirror derivatives at the endpoints
-        derivs=torch.cat([spline_pars[:,:,2], spline_pars[:,0:1,2]], dim=1)
+        knot_table=self._get_knot_table(x, extra_inputs=extra_inputs)
 
         use_inverse=True
         if(self.natural_direction==0):
             use_inverse=False
 
-        x, log_deriv=rational_quadratic_spline(x,
-                      spline_pars[:,:,0],
-                      spline_pars[:,:,1],
-                      derivs,
+        x, log_deriv=spline_fns.rational_quadratic_spline_from_knot_table(x,
+                      knot_table,
                       inverse=use_inverse,
-                      left=0, right=2*numpy.pi, bottom=0, top=2*numpy.pi,
-                      rel_min_bin_width=1e-3,
-                      rel_min_bin_height=1e-3,
-                          min_derivative=1e-3)
+                      left=0, right=2*numpy.pi, bottom=0, top=2*numpy.pi)
 
       
         log_deriv=log_deriv.sum(axis=-1)
@@ -86,31 +104,20 @@ class spline_1d(sphere_base.sphere_base):
         [x,log_det]=inputs
 
         
-        if(extra_inputs is not None):
-            spline_pars=torch.reshape(extra_inputs, [-1, self.num_basis_functions, 3])
-        else:
-            spline_pars=self.spline_pars.to(x)
-        
         if(self.always_parametrize_in_embedding_space):
             # embedding to intrinsic
             x, log_det=self.eucl_to_spherical_embedding(x, log_det)
         
-        # mirror derivatives at the endpoints
-        derivs=torch.cat([spline_pars[:,:,2], spline_pars[:,0:1,2]], dim=1)
+        knot_table=self._get_knot_table(x, extra_inputs=extra_inputs)
 
         use_inverse=False
         if(self.natural_direction==0):
             use_inverse=True
 
-        x, log_deriv=rational_quadratic_spline(x,
-                      spline_pars[:,:,0],
-                      spline_pars[:,:,1],
-                      derivs,
+        x, log_deriv=spline_fns.rational_quadratic_spline_from_knot_table(x,
+                      knot_table,
                       inverse=use_inverse,
-                      left=0, right=2*numpy.pi, bottom=0, top=2*numpy.pi,
-                      rel_min_bin_width=1e-3,
-                      rel_min_bin_height=1e-3,
-                          min_derivative=1e-3)
+                      left=0, right=2*numpy.pi, bottom=0, top=2*numpy.pi)
 
         log_deriv=log_deriv.sum(axis=-1)
 
@@ -126,6 +133,9 @@ class spline_1d(sphere_base.sphere_base):
 
         self.spline_pars.data=params.reshape(1, self.num_basis_functions, 3)
 
+        ## writes into .data bypass the version counter
+        self.knot_table_cache.reset()
+
     def _get_desired_init_parameters(self):
 
         ## fixed params for the spline
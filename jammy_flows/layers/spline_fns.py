@@ -3,6 +3,8 @@ from torch import nn
 from torch.nn import functional as F
 
 import numpy
+import threading
+import contextvars
 
 sympy=None
 try:
@@ -10,32 +12,218 @@ try:
 except:
     print("Sympy not installed!")
 
-def searchsorted(bin_locations, inputs, eps=1e-6):
-    bin_locations[..., -1] += eps
-    return torch.sum(
-        inputs >= bin_locations,
-        dim=-1,
-        keepdims=True
-    ) - 1
+## if True, the boundary checks of the splines synchronize with the device and raise immediately (debug mode)
+_debug_checks=False
 
+class violation_record(object):
+    """
+    Boolean tensors of deferred spline checks that have not been checked yet, keyed on (check name, device) so no cross-device copies are needed.
+    Every pdf holds its own record (see *pdf.check_spline_violations*). Updates are guarded by a lock, since layers may be evaluated in parallel threads 
+    (e.g. in *pdf.init_params*).
+    """
+    def __init__(self):
+        self.flags=dict()
+        self.lock=threading.Lock()
 
+    def __getstate__(self):
+        return dict(flags=self.flags)
 
+    def __setstate__(self, state):
+        self.flags=state["flags"]
+        self.lock=threading.Lock()
 
-def rational_quadratic_spline(inputs,
-                              unnormalized_widths,
-                              unnormalized_heights,
-                              unnormalized_derivatives,
-                              inverse=False,
-                              left=0., right=1., bottom=0., top=1.,
-                              rel_min_bin_width=1e-3,
-                              rel_min_bin_height=1e-3,
-                              min_derivative=1e-3,
-                              restrict_max_min_width_height_ratio=-1.0):
+    def add(self, name, violation):
+        """
+        Records the boolean 0-d tensor *violation* without device synchronization.
+        """
+        key=(name, violation.device)
 
-        
-        if torch.min(inputs) < left or torch.max(inputs) > right:
-           
-            raise Exception("outside boundaries in rational-spline flow! (min/max (%.2f/%.2f), allowed: (%.2f/%.2f)" % (torch.min(inputs), torch.max(inputs), left, right))
+        with self.lock:
+            if(key in self.flags):
+                violation=self.flags[key] | violation
+
+            self.flags[key]=violation
+
+    def check(self, reset=True):
+        """
+        Synchronizes with the devices and raises an Exception if any check was violated since the last reset.
+
+        Parameters:
+
+            reset (bool): Clear the recorded violations.
+        """
+        with self.lock:
+            flags=list(self.flags.items())
+
+            if(reset):
+                self.flags.clear()
+
+        violated=[]
+        for (name, _), violation in flags:
+            if(violation.item() and name not in violated):
+                violated.append(name)
+
+        if(len(violated)>0):
+            raise Exception("Deferred spline checks violated: %s" % (", ".join(violated)))
+
+## record of spline evaluations outside of any pdf (e.g. direct calls of the spline functions)
+_global_violation_record=violation_record()
+
+## record of the pdf whose layers are currently evaluated in this thread (see *recording_violations*)
+_active_violation_record=contextvars.ContextVar("active_violation_record", default=None)
+
+class recording_violations(object):
+    """
+    Context in which deferred spline checks are recorded in *record* instead of the global record. Used by pdfs around every layer call.
+    """
+    def __init__(self, record):
+        self.record=record
+
+    def __enter__(self):
+        self.token=_active_violation_record.set(self.record)
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _active_violation_record.reset(self.token)
+
+        return False
+
+def set_debug_checks(flag):
+    """
+    Switches debug mode of the spline checks on or off. In debug mode violations raise immediately (requires a device synchronization in each call).
+    Otherwise they are only recorded tensor-side and can be checked with *pdf.check_spline_violations* (or *check_deferred_violations* outside of pdfs).
+    """
+    global _debug_checks
+    _debug_checks=bool(flag)
+
+def _deferred_check(violation, name, message_fn):
+    """
+    Records the boolean 0-d tensor *violation* without device synchronization in the record of the pdf that is evaluated, or in the global record. 
+    In debug mode raises an Exception with the message of *message_fn* right away.
+    """
+    if(_debug_checks):
+        if(violation.item()):
+            raise Exception(message_fn())
+
+        return
+
+    record=_active_violation_record.get()
+
+    if(record is None):
+        record=_global_violation_record
+
+    record.add(name, violation.detach())
+
+def check_deferred_violations(reset=True):
+    """
+    Synchronizes with the devices and raises an Exception if any deferred spline check outside of a pdf was violated since the last reset.
+    Checks of the layers of a pdf are recorded per pdf, see *pdf.check_spline_violations*.
+
+    Parameters:
+
+        reset (bool): Clear the recorded violations.
+    """
+    _global_violation_record.check(reset=reset)
+
+def _check_bounds(inputs, left, right):
+
+    _deferred_check((inputs < left).any() | (inputs > right).any(), 
+                    "outside boundaries in rational-spline flow", 
+                    lambda: "outside boundaries in rational-spline flow! (min/max (%.20e/%.20e), allowed: (%.6e/%.6e)" % (torch.min(inputs), torch.max(inputs), left, right))
+
+class knot_table_cache(object):
+    """
+    Holds the knot table of a spline whose parameters do not change between calls (permanent parameters, or fixed amortization parameters
+    handed to a passthrough flow). The table is rebuilt if the parameter tensors are replaced, modified in-place (version counter) or
+    requested for another dtype/device. Tables are only cached if no gradient has to flow back into the parameters,
+    otherwise the table is rebuilt as part of the autograd graph in every call.
+    """
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        """
+        Invalidates the cached table. Required after modifications that bypass the version counter (e.g. writes into *param.data*).
+        """
+        self.sources=None
+        self.pinned=None
+        self.key=None
+        self.table=None
+
+    def get_table(self, params, build_fn, dtype, device):
+        """
+        Parameters:
+
+            params (list(Tensor/None)): Raw parameter tensors (or views of them) the table is built from.
+            build_fn (function): Builds the table. Called without arguments.
+            dtype (torch.dtype): Dtype of the table.
+            device (torch.device): Device of the table.
+
+        Returns:
+
+            The knot table.
+        """
+        params=[p for p in params if p is not None]
+
+        cacheable=all([p.shape[0]==1 for p in params])
+        if(torch.is_grad_enabled() and any([p.requires_grad for p in params])):
+            cacheable=False
+
+        if(cacheable==False):
+            return build_fn()
+
+        ## views (e.g. slices of an amortization parameter tensor) are identified via their base tensor, which shares the version counter
+        sources=[p._base if p._base is not None else p for p in params]
+        key=tuple([(p.data_ptr(), p._version, p.storage_offset(), tuple(p.shape), tuple(p.stride()), p.dtype) for p in params])+(dtype, device)
+
+        if(self.sources is None or len(self.sources)!=len(sources) or any([a is not b for a,b in zip(self.sources, sources)]) or self.key!=key):
+
+            with torch.no_grad():
+                self.table=build_fn()
+
+            ## holding references to the sources guarantees their identity can not be reused by other tensors, holding detached aliases keeps their 
+            ## storages alive, which guarantees that the memory addresses in the key can not be reused after a replacement of *param.data*
+            self.sources=sources
+            self.pinned=[p.detach() for p in params]
+            self.key=key
+
+        return self.table
+
+def searchsorted(bin_locations, inputs, eps=1e-6):
+    """
+    Binary search for the bin index of *inputs* in the sorted *bin_locations* (last dimension). Leading dimensions of *bin_locations* 
+    may be broadcast over the batch dimension. Indices are clamped to valid bins, so inputs at (or numerically above) the last bin location map to the last bin,
+    and inputs below the first location map to the first bin. *bin_locations* is not modified.
+    
+    *eps* is only kept for backwards compatibility, the clamping replaces the shift of the last bin location.
+    """
+    num_bins=bin_locations.shape[-1]-1
+
+    if(bin_locations.shape[:-1]==inputs.shape[:-1]):
+        bin_idx=torch.searchsorted(bin_locations.contiguous(), inputs.contiguous(), right=True)
+    elif(bin_locations.shape[0]==1 and inputs.shape[-1]==1 and bin_locations.shape[1:-1]==inputs.shape[1:-1]):
+        ## shared bin locations for the whole batch -> search the batch as values of a single sorted sequence
+        bin_idx=torch.searchsorted(bin_locations.contiguous(), inputs.transpose(0,-1).contiguous(), right=True).transpose(0,-1)
+    else:
+        bin_locations=bin_locations.expand(torch.broadcast_shapes(bin_locations.shape[:-1], inputs.shape[:-1])+bin_locations.shape[-1:])
+        bin_idx=torch.searchsorted(bin_locations.contiguous(), inputs.expand(bin_locations.shape[:-1]+inputs.shape[-1:]).contiguous(), right=True)
+    
+    return (bin_idx-1).clamp(0, num_bins-1)
+
+
+
+
+def rational_quadratic_knot_table(unnormalized_widths,
+                                  unnormalized_heights,
+                                  unnormalized_derivatives,
+                                  left=0., right=1., bottom=0., top=1.,
+                                  rel_min_bin_width=1e-3,
+                                  rel_min_bin_height=1e-3,
+                                  min_derivative=1e-3,
+                                  restrict_max_min_width_height_ratio=-1.0):
+        """
+        Normalizes the raw spline parameters into the knot table (cumwidths, widths, cumheights, heights, derivatives, delta) that is used by
+        *rational_quadratic_spline_from_knot_table*. The table only depends on the parameters, so it can be reused for many evaluations (see *knot_table_cache*).
+        """
 
         num_bins = unnormalized_widths.shape[-1]
 
@@ -87,21 +275,40 @@ def rational_quadratic_spline(inputs,
         cumheights[..., -1] = top
         heights = cumheights[..., 1:] - cumheights[..., :-1]
 
+        ## slopes of the bins
+        delta = heights / widths
+
+        return cumwidths, widths, cumheights, heights, derivatives, delta
+
+def rational_quadratic_spline_from_knot_table(inputs,
+                                              knot_table,
+                                              inverse=False,
+                                              left=0., right=1., bottom=0., top=1.):
+        """
+        Evaluates (or inverts) a rational-quadratic spline defined by a knot table from *rational_quadratic_knot_table* or *rational_quadratic_smooth_knot_table*.
+        """
+
+        if inverse:
+            _check_bounds(inputs, bottom, top)
+        else:
+            _check_bounds(inputs, left, right)
+
+        cumwidths, widths, cumheights, heights, derivatives, delta = knot_table
 
-        
         if inverse:
             bin_idx = searchsorted(cumheights, inputs)#[..., None]
         else:
             bin_idx = searchsorted(cumwidths, inputs)#[..., None]
         
         if(cumwidths.shape[0]==1 and bin_idx.shape[0]>1):
-          repeats=[bin_idx.shape[0]]+(len(cumwidths.shape)-1)*[1]
+          expanded_shape=bin_idx.shape[:1]+cumwidths.shape[1:]
           
-          cumwidths=cumwidths.repeat(repeats)
-          widths=widths.repeat(repeats)
-          heights=heights.repeat(repeats)
-          cumheights=cumheights.repeat(repeats)
-          derivatives=derivatives.repeat(repeats)
+          cumwidths=cumwidths.expand(expanded_shape)
+          widths=widths.expand(bin_idx.shape[:1]+widths.shape[1:])
+          heights=heights.expand(bin_idx.shape[:1]+heights.shape[1:])
+          cumheights=cumheights.expand(expanded_shape)
+          derivatives=derivatives.expand(bin_idx.shape[:1]+derivatives.shape[1:])
+          delta=delta.expand(bin_idx.shape[:1]+delta.shape[1:])
         
         input_cumwidths = cumwidths.gather(-1, bin_idx)#[..., 0]
 
@@ -110,7 +317,6 @@ def rational_quadratic_spline(inputs,
         input_bin_widths = widths.gather(-1, bin_idx)#[..., 0]
 
         input_cumheights = cumheights.gather(-1, bin_idx)#[..., 0]
-        delta = heights / widths
         input_delta = delta.gather(-1, bin_idx)#[..., 0]
 
         input_derivatives = derivatives.gather(-1, bin_idx)#[..., 0]
@@ -133,7 +339,7 @@ def rational_quadratic_spline(inputs,
             c = - input_delta * (inputs - input_cumheights)
 
             discriminant = b.pow(2) - 4 * a * c
-            assert (discriminant >= 0).all()
+            _deferred_check((discriminant < 0).any(), "negative discriminant in rational-spline flow", lambda: "negative discriminant in rational-spline flow!")
 
             root = (2 * c) / (-b - torch.sqrt(discriminant))
             outputs = root * input_bin_widths + input_cumwidths
@@ -164,6 +370,28 @@ def rational_quadratic_spline(inputs,
            
             return outputs, logabsdet
 
+def rational_quadratic_spline(inputs,
+                              unnormalized_widths,
+                              unnormalized_heights,
+                              unnormalized_derivatives,
+                              inverse=False,
+                              left=0., right=1., bottom=0., top=1.,
+                              rel_min_bin_width=1e-3,
+                              rel_min_bin_height=1e-3,
+                              min_derivative=1e-3,
+                              restrict_max_min_width_height_ratio=-1.0):
+
+        knot_table=rational_quadratic_knot_table(unnormalized_widths,
+                                                 unnormalized_heights,
+                                                 unnormalized_derivatives,
+                                                 left=left, right=right, bottom=bottom, top=top,
+                                                 rel_min_bin_width=rel_min_bin_width,
+                                                 rel_min_bin_height=rel_min_bin_height,
+                                                 min_derivative=min_derivative,
+                                                 restrict_max_min_width_height_ratio=restrict_max_min_width_height_ratio)
+
+        return rational_quadratic_spline_from_knot_table(inputs, knot_table, inverse=inverse, left=left, right=right, bottom=bottom, top=top)
+
 def rational_quadratic_spline_with_linear_extension(inputs,
                               unnormalized_widths,
                               unnormalized_heights,
@@ -232,26 +460,17 @@ def rational_quadratic_spline_with_linear_extension(inputs,
         else:
             bin_idx = searchsorted(cumwidths, inputs,eps=0.0)#[..., None]
 
-        ## keep bin idx sane
-        bin_idx=torch.where(bin_idx<0, 0, bin_idx)
-        bin_idx=torch.where(bin_idx>=heights.shape[-1], heights.shape[-1]-1, bin_idx)
-
         if(cumwidths.shape[0]==1 and bin_idx.shape[0]>1):
 
-          repeats=[bin_idx.shape[0]]+(len(cumwidths.shape)-1)*[1]
+          expanded_shape=bin_idx.shape[:1]+cumwidths.shape[1:]
           
-          cumwidths=cumwidths.repeat(repeats)
-          widths=widths.repeat(repeats)
-          heights=heights.repeat(repeats)
-          cumheights=cumheights.repeat(repeats)
-          derivatives=derivatives.repeat(repeats)
+          cumwidths=cumwidths.expand(expanded_shape)
+          widths=widths.expand(bin_idx.shape[:1]+widths.shape[1:])
+          heights=heights.expand(bin_idx.shape[:1]+heights.shape[1:])
+          cumheights=cumheights.expand(expanded_shape)
+          derivatives=derivatives.expand(bin_idx.shape[:1]+derivatives.shape[1:])
 
-          repeats=[bin_idx.shape[0]]+(len(left.shape)-1)*[1]
-
-          left=left.repeat(repeats)
-          right=right.repeat(repeats)
-          top=top.repeat(repeats)
-          bottom=bottom.repeat(repeats)
+          ## boundaries are only used in broadcasting operations
 
         
         input_cumwidths = cumwidths.gather(-1, bin_idx)#[..., 0]
@@ -336,23 +555,18 @@ def rational_quadratic_spline_with_linear_extension(inputs,
 
             return outputs, logabsdet
 
-
-def rational_quadratic_spline_smooth(inputs,
-                              unnormalized_widths,
-                              unnormalized_heights,
-                              unnormalized_boundary_derivatives,
-                              inverse=False,
-                              left=0., right=1., bottom=0., top=1.,
-                              rel_min_bin_width=1e-3,
-                              rel_min_bin_height=1e-3,
-                              min_derivative=1e-3,
-                              restrict_max_min_width_height_ratio=-1.0,
-                              solution_index=0):
-
-        
-        if torch.min(inputs) < left or torch.max(inputs) > right:
-           
-            raise Exception("outside boundaries in rational-spline flow! (min/max (%.20e/%.20e), allowed: (%.6e/%.6e)" % (torch.min(inputs), torch.max(inputs), left, right))
+def rational_quadratic_smooth_knot_table(unnormalized_widths,
+                                         unnormalized_heights,
+                                         unnormalized_boundary_derivatives,
+                                         left=0., right=1., bottom=0., top=1.,
+                                         rel_min_bin_width=1e-3,
+                                         rel_min_bin_height=1e-3,
+                                         min_derivative=1e-3,
+                                         restrict_max_min_width_height_ratio=-1.0,
+                                         solution_index=0):
+        """
+        Knot table of a spline with continuous second derivative. The inner derivatives are solved for given the boundary derivatives.
+        """
 
         num_bins = unnormalized_widths.shape[-1]
 
@@ -524,77 +738,32 @@ def rational_quadratic_spline_smooth(inputs,
                 raise NotImplementedError()
         else:
             derivatives=boundary_derivatives
-        if inverse:
-            bin_idx = searchsorted(cumheights, inputs)#[..., None]
-        else:
-            bin_idx = searchsorted(cumwidths, inputs)#[..., None]
-        
-        if(cumwidths.shape[0]==1 and bin_idx.shape[0]>1):
-          repeats=[bin_idx.shape[0]]+(len(cumwidths.shape)-1)*[1]
-          
-          cumwidths=cumwidths.repeat(repeats)
-          widths=widths.repeat(repeats)
-          heights=heights.repeat(repeats)
-          cumheights=cumheights.repeat(repeats)
-          derivatives=derivatives.repeat(repeats)
-        
-        input_cumwidths = cumwidths.gather(-1, bin_idx)#[..., 0]
-
 
-        
-        input_bin_widths = widths.gather(-1, bin_idx)#[..., 0]
-
-        input_cumheights = cumheights.gather(-1, bin_idx)#[..., 0]
+        ## slopes of the bins
         delta = heights / widths
-        input_delta = delta.gather(-1, bin_idx)#[..., 0]
-
-        input_derivatives = derivatives.gather(-1, bin_idx)#[..., 0]
-        
-
-        input_derivatives_plus_one = derivatives[..., 1:].gather(-1, bin_idx)#[..., 0]
-       
-        input_heights = heights.gather(-1, bin_idx)#[..., 0]
-
-      
-        if inverse:
-            a = (((inputs - input_cumheights) * (input_derivatives
-                                                 + input_derivatives_plus_one
-                                                 - 2 * input_delta)
-                  + input_heights * (input_delta - input_derivatives)))
-            b = (input_heights * input_derivatives
-                 - (inputs - input_cumheights) * (input_derivatives
-                                                  + input_derivatives_plus_one
-                                                  - 2 * input_delta))
-            c = - input_delta * (inputs - input_cumheights)
 
-            discriminant = b.pow(2) - 4 * a * c
-            assert (discriminant >= 0).all()
+        return cumwidths, widths, cumheights, heights, derivatives, delta
 
-            root = (2 * c) / (-b - torch.sqrt(discriminant))
-            outputs = root * input_bin_widths + input_cumwidths
-
-            theta_one_minus_theta = root * (1 - root)
-            denominator = input_delta + ((input_derivatives + input_derivatives_plus_one - 2 * input_delta)
-                                         * theta_one_minus_theta)
-            derivative_numerator = input_delta.pow(2) * (input_derivatives_plus_one * root.pow(2)
-                                                         + 2 * input_delta * theta_one_minus_theta
-                                                         + input_derivatives * (1 - root).pow(2))
-            logabsdet = torch.log(derivative_numerator) - 2 * torch.log(denominator)
-
-            return outputs, -logabsdet#, (widths, heights, None)
-        else:
-            theta = (inputs - input_cumwidths) / input_bin_widths
-            theta_one_minus_theta = theta * (1 - theta)
-
-            numerator = input_heights * (input_delta * theta.pow(2)
-                                         + input_derivatives * theta_one_minus_theta)
-            denominator = input_delta + ((input_derivatives + input_derivatives_plus_one - 2 * input_delta)
-                                         * theta_one_minus_theta)
-            outputs = input_cumheights + numerator / denominator
+def rational_quadratic_spline_smooth(inputs,
+                              unnormalized_widths,
+                              unnormalized_heights,
+                              unnormalized_boundary_derivatives,
+                              inverse=False,
+                              left=0., right=1., bottom=0., top=1.,
+                              rel_min_bin_width=1e-3,
+                              rel_min_bin_height=1e-3,
+                              min_derivative=1e-3,
+                              restrict_max_min_width_height_ratio=-1.0,
+                              solution_index=0):
 
-            derivative_numerator = input_delta.pow(2) * (input_derivatives_plus_one * theta.pow(2)
-                                                         + 2 * input_delta * theta_one_minus_theta
-                                                         + input_derivatives * (1 - theta).pow(2))
-            logabsdet = torch.log(derivative_numerator) - 2 * torch.log(denominator)
-           
-            return outputs, logabsdet#, (widths, heights,None)
\ No newline at end of file
+        knot_table=rational_quadratic_smooth_knot_table(unnormalized_widths,
+                                                        unnormalized_heights,
+                                                        unnormalized_boundary_derivatives,
+                                                        left=left, right=right, bottom=bottom, top=top,
+                                                        rel_min_bin_width=rel_min_bin_width,
+                                                        rel_min_bin_height=rel_min_bin_height,
+                                                        min_derivative=min_derivative,
+                                                        restrict_max_min_width_height_ratio=restrict_max_min_width_height_ratio,
+                                                        solution_index=solution_index)
+
+        return rational_quadratic_spline_from_knot_table(inputs, knot_table, inverse=inverse, left=left, right=right, bottom=bottom, top=top)
@@ -2,11 +2,17 @@ import torch
 from torch import nn
 
 from ..flow_options import check_flow_option, obtain_default_options, obtain_overall_flow_info
-from ..extra_functions import list_from_str, NONLINEARITIES, recheck_sampling, find_init_pars_of_chained_blocks, _calculate_coverage
+from ..extra_functions import list_from_str, NONLINEARITIES, recheck_sampling, find_init_pars_of_chained_blocks, _column_slice_chunks, _calculate_coverage, coverage_accumulator, estimate_mises_fisher_kappa, mises_fisher_mean_resultant_length, mises_fisher_log_normalization, sample_mises_fisher
 from ..amortizable_mlp import AmortizableMLP
+from ..profiling import pdf_profiler
+from .. import precision
+from ..export import pdf_inference_module, trace_inference_module
+from .. import checkpoint
+from ..layers import spline_fns
 
 
 import collections
+import concurrent.futures
 import numpy
 import copy
 import sys
@@ -19,8 +25,6 @@ try:
 except:
     print("Cannot use healpy functionality. Install healpy, if you need to do entropy scanning!")
 
-from scipy.special import iv, i0, i1
-import scipy.linalg
 
 from typing import Union
 
@@ -32,6 +36,196 @@ def peek(iterable):
         return None
     return first
 
+## structure descriptors of previously constructed pdfs (see *_structure_descriptor*), least recently used first
+_structure_descriptor_cache=collections.OrderedDict()
+_max_num_cached_structure_descriptors=1000
+
+def _frozen(obj):
+    """
+    Canonical, hashable form of (nested) options, independent of the insertion order of dictionaries. Types are kept, so e.g. 1 and 1.0 differ.
+    """
+    if(isinstance(obj, dict)):
+        return ("dict", tuple(sorted([(_frozen(k), _frozen(v)) for k,v in obj.items()], key=repr)))
+    if(type(obj)==list or type(obj)==tuple):
+        return (type(obj).__name__, tuple([_frozen(item) for item in obj]))
+
+    try:
+        hash(obj)
+    except TypeError:
+        return (type(obj).__name__, repr(obj))
+
+    return (type(obj).__name__, obj)
+
+def _structure_descriptor(pdf_defs, flow_defs, options_overwrite):
+    """
+    Static structure of a pdf definition: the sub-pdf and layer definitions and the resolved options of all layers. The per-layer constructor 
+    arguments are added by *pdf.init_flow_structure*. Descriptors are cached on (pdf_defs, flow_defs, frozen options_overwrite), so option resolution 
+    (and its printout) happens once per definition. The descriptor is shared between pdfs and must not be modified. Pdfs hold their own copies
+    of the definitions and options (see *pdf.read_model_definition*), and the descriptor does not reference *options_overwrite*.
+
+    Parameters:
+        pdf_defs (str): PDF definition, e.g. "e2+s2".
+        flow_defs (str): Flow definition, e.g. "gg+n".
+        options_overwrite (dict): Options that overwrite the default layer options.
+
+    Returns: Dictionary with "pdf_defs_list", "flow_defs_list", "flow_opts" and "layer_kwargs".
+    """
+    key=(pdf_defs, flow_defs, _frozen(options_overwrite))
+
+    if(key in _structure_descriptor_cache):
+        _structure_descriptor_cache.move_to_end(key)
+        return _structure_descriptor_cache[key]
+
+    pdf_defs_list, flow_defs_list, flow_opts=copy.deepcopy(_resolve_flow_options(pdf_defs, flow_defs, options_overwrite))
+
+    ## per-layer constructor arguments, keyed on the pdf settings that modify them
+    descriptor=dict(pdf_defs_list=pdf_defs_list, flow_defs_list=flow_defs_list, flow_opts=flow_opts, layer_kwargs=dict())
+
+    _structure_descriptor_cache[key]=descriptor
+
+    if(len(_structure_descriptor_cache)>_max_num_cached_structure_descriptors):
+        _structure_descriptor_cache.popitem(last=False)
+
+    return descriptor
+
+def _options_overwrite_from_flow_opts(flow_defs, flow_opts):
+    """
+    Options overwrite that sets every option of every layer to the given resolved options, independent of the default options.
+
+    Parameters:
+        flow_defs (str): Flow definition, e.g. "gg+n".
+        flow_opts (list/dict): Resolved options per sub-pdf (indexed by the sub-pdf index) and layer.
+
+    Returns: Dictionary keyed on (sub-pdf index, layer index).
+    """
+    options_overwrite=dict()
+
+    for pdf_index, layer_types in enumerate(flow_defs.split("+")):
+        for layer_index, layer_type in enumerate(layer_types):
+            options_overwrite[(pdf_index, layer_index)]={layer_type: flow_opts[pdf_index][layer_index]}
+
+    return options_overwrite
+
+def _resolve_flow_options(pdf_defs, flow_defs, options_overwrite):
+    """
+    Resolves the options of all layers from the defaults and *options_overwrite*.
+    """
+    # list of the pdf defs (e.g. e2 for 2-d Euclidean) for each subpdf
+    # i.e. e2+s2 will yield 2 entries, one for each manifold
+    pdf_defs_list = pdf_defs.split("+")
+
+    # respective flow functions for each submanifold
+    flow_defs_list = flow_defs.split("+")
+
+    ## dictionary holding the options used by the flows of this pdf
+    flow_opts = dict()
+
+    #top_flow_def_keys=[k for k in options_overwrite.keys()]
+
+    ## loop through flow defs and initialize sub-manifold specific options
+    for ind, cur_flow_defs in enumerate(flow_defs_list):
+
+        this_iter_flow_abbrvs=cur_flow_defs
+
+        flow_opts[ind]=[]
+
+        cur_flow_index=0
+
+        for flow_abbrv in this_iter_flow_abbrvs:
+
+            ## first copy default options
+            flow_opts[ind].append(obtain_default_options(flow_abbrv))
+
+            assert(len(flow_opts[ind])==(cur_flow_index+1))
+            ## make sure default options are consistent
+            for opt in flow_opts[ind][-1].keys():
+                check_flow_option(flow_abbrv, opt, flow_opts[ind][-1][opt])
+
+            ## refine a specific flow within a specific sub-manifold if necessary 
+            found_specific=False
+            overwrote_default=False     
+            for k in options_overwrite.keys():
+
+                if(type(k)==tuple):
+
+                    assert(type(k[0])==int and type(k[1])==int), "Require 2 ints for tuple-based flow definition! The first indexes the sub-manifold, the second the flow within the manifold."
+
+                    assert( (k[0]>=0) and (k[0]<len(flow_defs_list))), "Index of detailed options is outside allowed range of defined autoregressive structure."
+                    
+                    if(k[0] != ind):
+                        continue
+
+                    if(k[1] != cur_flow_index):
+                        continue
+
+                    assert(len(options_overwrite[k])==1), "We have detailed flow definition per item, require length of 1 here."
+                    
+                    found_specific=True
+
+                    for detail_abbrv in options_overwrite[k].keys():
+
+                        assert(detail_abbrv==flow_abbrv)
+
+                        for detail_opt in options_overwrite[k][detail_abbrv].keys():
+
+                            print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) options overwrite " % (ind, pdf_defs_list[ind], cur_flow_defs, cur_flow_index,flow_abbrv ), detail_opt, " with ", options_overwrite[k][detail_abbrv][detail_opt])
+                            overwrote_default=True
+
+                            check_flow_option(flow_abbrv, detail_opt, options_overwrite[k][detail_abbrv][detail_opt])
+
+                            flow_opts[ind][-1][detail_opt]=options_overwrite[k][detail_abbrv][detail_opt]
+            
+            if(found_specific==False):
+                ## refine specific sub manifold defs if necessary
+                for k in options_overwrite.keys():
+
+                    if(type(k)==int):
+
+                        assert( (k>=0) and (k<len(flow_defs_list))), "Index of detailed options is outside allowed range of defined autoregressive structure."
+                        
+                        if(k != ind):
+                            continue
+
+                        for detail_abbrv in options_overwrite[k].keys():
+
+                            if(detail_abbrv == flow_abbrv):
+                                found_specific=True
+                                
+                                for detail_opt in options_overwrite[k][detail_abbrv].keys():
+
+                                    print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) options overwrite " % (ind, pdf_defs_list[ind],cur_flow_defs, cur_flow_index,flow_abbrv ), detail_opt, " with ", options_overwrite[k][detail_abbrv][detail_opt])
+                                    overwrote_default=True
+
+                                    check_flow_option(flow_abbrv, detail_opt, options_overwrite[k][detail_abbrv][detail_opt])
+
+                                    flow_opts[ind][-1][detail_opt]=options_overwrite[k][detail_abbrv][detail_opt]
+                
+            if(found_specific==False):
+
+                ## first check general flow defs
+                for k in options_overwrite.keys():
+
+                    if(k==flow_abbrv):
+
+                        for detail_opt in options_overwrite[k].keys():
+                            print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) options overwrite " % (ind, pdf_defs_list[ind], cur_flow_defs, cur_flow_index,flow_abbrv ), detail_opt, " with ", options_overwrite[k][detail_opt])
+                            overwrote_default=True
+
+                            check_flow_option(flow_abbrv, detail_opt, options_overwrite[k][detail_opt])
+
+                            flow_opts[ind][-1][detail_opt]=options_overwrite[k][detail_opt]
+
+
+            if(overwrote_default==False):
+                print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) - using *default* options" % (ind, pdf_defs_list[ind], cur_flow_defs, cur_flow_index,flow_abbrv ))
+
+            cur_flow_index+=1
+
+    if(len(pdf_defs_list)!=len(flow_defs_list)):
+        raise Exception("PDF defs list has to be same length as flow defs list, but ... ", pdf_defs_list, flow_defs_list)
+
+    return pdf_defs_list, flow_defs_list, flow_opts
+
 class pdf(nn.Module):
 
     def __init__(
@@ -50,7 +244,8 @@ class pdf(nn.Module):
         amortization_mlp_highway_mode=0,
         amortize_everything=False,
         use_as_passthrough_instead_of_pdf=False,
-        skip_mlp_initialization=False
+        skip_mlp_initialization=False,
+        skip_param_initialization=False
     ):  
         """
         The main class of the project that defines a pytorch normalizing-flow PDF.
@@ -87,11 +282,33 @@ class pdf(nn.Module):
             use_as_passthrough_instead_of_pdf (bool): Indicates, whether the class acts as a PDF, or only as a flow mapping function of the overall autoregressive flow.
             
             skip_mlp_initialization (bool): Indicates, whether to skip MLP inits entirely. Can be used for custom MLP initialization.
+
+            skip_param_initialization (bool): Lazy construction. Skips *init_params* and the default initialization of the MLP weights, for example when a state dict is loaded
+                                              right after construction. Parameters that are not loaded are undefined until *init_params* is called.
     
 
         """
         super().__init__()
 
+        ## deferred spline checks of the layers of this pdf (see *check_spline_violations*)
+        self.spline_violations=spline_fns.violation_record()
+
+        ## constructor arguments that define the structure, stored in checkpoints (see *save_checkpoint*)
+        self.model_definition=dict(pdf_defs=pdf_defs,
+                                   flow_defs=flow_defs,
+                                   conditional_input_dim=conditional_input_dim,
+                                   amortization_mlp_dims=amortization_mlp_dims,
+                                   predict_log_normalization=predict_log_normalization,
+                                   join_poisson_and_pdf_description=join_poisson_and_pdf_description,
+                                   hidden_mlp_dims_poisson=hidden_mlp_dims_poisson,
+                                   rank_of_mlp_mappings_poisson=rank_of_mlp_mappings_poisson,
+                                   amortization_mlp_use_custom_mode=amortization_mlp_use_custom_mode,
+                                   amortization_mlp_ranks=amortization_mlp_ranks,
+                                   amortization_mlp_highway_mode=amortization_mlp_highway_mode,
+                                   amortize_everything=amortize_everything,
+                                   use_as_passthrough_instead_of_pdf=use_as_passthrough_instead_of_pdf,
+                                   skip_mlp_initialization=skip_mlp_initialization)
+
         self.amortization_mlp_use_custom_mode=amortization_mlp_use_custom_mode
         self.predict_log_normalization=predict_log_normalization
         self.join_poisson_and_pdf_description=join_poisson_and_pdf_description
@@ -103,6 +320,7 @@ class pdf(nn.Module):
         
         self.use_as_passthrough_instead_of_pdf=use_as_passthrough_instead_of_pdf
         self.skip_mlp_initialization=skip_mlp_initialization
+        self.skip_param_initialization=skip_param_initialization
 
         ## holds total number of params for amortization - only used if "amortize_everything" set to True
         self.total_number_amortizable_params=None
@@ -139,7 +357,8 @@ class pdf(nn.Module):
 
         
         ## initialize params
-        self.init_params()
+        if(self.skip_param_initialization==False):
+            self.init_params()
 
     def read_model_definition(self, 
                               pdf_defs, 
@@ -149,120 +368,14 @@ class pdf(nn.Module):
                               amortization_mlp_dims,
                               amortization_mlp_ranks):
         
-        # list of the pdf defs (e.g. e2 for 2-d Euclidean) for each subpdf
-        # i.e. e2+s2 will yield 2 entries, one for each manifold
-        self.pdf_defs_list = pdf_defs.split("+")
-
-        # respective flow functions for each submanifold
-        self.flow_defs_list = flow_defs.split("+")
-
-        ## dictionary holding the options used by the flows of this pdf
-        self.flow_opts = dict()
-
-        #top_flow_def_keys=[k for k in options_overwrite.keys()]
-
-        ## loop through flow defs and initialize sub-manifold specific options
-        for ind, cur_flow_defs in enumerate(self.flow_defs_list):
-
-            this_iter_flow_abbrvs=cur_flow_defs
-
-            self.flow_opts[ind]=[]
-
-            cur_flow_index=0
-
-            for flow_abbrv in this_iter_flow_abbrvs:
-
-                ## first copy default options
-                self.flow_opts[ind].append(obtain_default_options(flow_abbrv))
-
-                assert(len(self.flow_opts[ind])==(cur_flow_index+1))
-                ## make sure default options are consistent
-                for opt in self.flow_opts[ind][-1].keys():
-                    check_flow_option(flow_abbrv, opt, self.flow_opts[ind][-1][opt])
-
-                ## refine a specific flow within a specific sub-manifold if necessary 
-                found_specific=False
-                overwrote_default=False     
-                for k in options_overwrite.keys():
-
-                    if(type(k)==tuple):
-
-                        assert(type(k[0])==int and type(k[1])==int), "Require 2 ints for tuple-based flow definition! The first indexes the sub-manifold, the second the flow within the manifold."
-
-                        assert( (k[0]>=0) and (k[0]<len(self.flow_defs_list))), "Index of detailed options is outside allowed range of defined autoregressive structure."
-                        
-                        if(k[0] != ind):
-                            continue
-
-                        if(k[1] != cur_flow_index):
-                            continue
-
-                        assert(len(options_overwrite[k])==1), "We have detailed flow definition per item, require length of 1 here."
-                        
-                        found_specific=True
-
-                        for detail_abbrv in options_overwrite[k].keys():
+        ## sub-pdf definitions, layer definitions and resolved layer options are part of the cached structure descriptor, 
+        ## which is shared between pdfs with the same definition .. every pdf works on its own copies
+        self.structure_descriptor=_structure_descriptor(pdf_defs, flow_defs, options_overwrite)
 
-                            assert(detail_abbrv==flow_abbrv)
+        self.pdf_defs_list=list(self.structure_descriptor["pdf_defs_list"])
+        self.flow_defs_list=list(self.structure_descriptor["flow_defs_list"])
+        self.flow_opts=copy.deepcopy(self.structure_descriptor["flow_opts"])
 
-                            for detail_opt in options_overwrite[k][detail_abbrv].keys():
-
-                                print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) options overwrite " % (ind, self.pdf_defs_list[ind], cur_flow_defs, cur_flow_index,flow_abbrv ), detail_opt, " with ", options_overwrite[k][detail_abbrv][detail_opt])
-                                overwrote_default=True
-
-                                check_flow_option(flow_abbrv, detail_opt, options_overwrite[k][detail_abbrv][detail_opt])
-
-                                self.flow_opts[ind][-1][detail_opt]=options_overwrite[k][detail_abbrv][detail_opt]
-                
-                if(found_specific==False):
-                    ## refine specific sub manifold defs if necessary
-                    for k in options_overwrite.keys():
-
-                        if(type(k)==int):
-
-                            assert( (k>=0) and (k<len(self.flow_defs_list))), "Index of detailed options is outside allowed range of defined autoregressive structure."
-                            
-                            if(k != ind):
-                                continue
-
-                            for detail_abbrv in options_overwrite[k].keys():
-
-                                if(detail_abbrv == flow_abbrv):
-                                    found_specific=True
-                                    
-                                    for detail_opt in options_overwrite[k][detail_abbrv].keys():
-
-                                        print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) options overwrite " % (ind, self.pdf_defs_list[ind],cur_flow_defs, cur_flow_index,flow_abbrv ), detail_opt, " with ", options_overwrite[k][detail_abbrv][detail_opt])
-                                        overwrote_default=True
-
-                                        check_flow_option(flow_abbrv, detail_opt, options_overwrite[k][detail_abbrv][detail_opt])
-
-                                        self.flow_opts[ind][-1][detail_opt]=options_overwrite[k][detail_abbrv][detail_opt]
-                    
-                if(found_specific==False):
-
-                    ## first check general flow defs
-                    for k in options_overwrite.keys():
-
-                        if(k==flow_abbrv):
-
-                            for detail_opt in options_overwrite[k].keys():
-                                print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) options overwrite " % (ind, self.pdf_defs_list[ind], cur_flow_defs, cur_flow_index,flow_abbrv ), detail_opt, " with ", options_overwrite[k][detail_opt])
-                                overwrote_default=True
-
-                                check_flow_option(flow_abbrv, detail_opt, options_overwrite[k][detail_opt])
-
-                                self.flow_opts[ind][-1][detail_opt]=options_overwrite[k][detail_opt]
-
-
-                if(overwrote_default==False):
-                    print("sub-manifold (%d - %s - %s) and intra-manifold flow (%d - %s) - using *default* options" % (ind, self.pdf_defs_list[ind], cur_flow_defs, cur_flow_index,flow_abbrv ))
-
-                cur_flow_index+=1
-
-        if(len(self.pdf_defs_list)!=len(self.flow_defs_list)):
-            raise Exception("PDF defs list has to be same length as flow defs list, but ... ", self.pdf_defs_list, self.flow_defs_list)
-        
         ### now define input stuff
         self.conditional_input_dim=conditional_input_dim
 
@@ -344,6 +457,14 @@ class pdf(nn.Module):
 
         flow_info=obtain_overall_flow_info()
 
+        ## the constructor arguments of all layers only depend on the definition and the following settings, so they are resolved once and cached in the structure descriptor
+        layer_kwargs_key=(self.use_as_passthrough_instead_of_pdf, self.force_permanent_parameters_in_first_subpdf)
+
+        if(layer_kwargs_key not in self.structure_descriptor["layer_kwargs"]):
+            self.structure_descriptor["layer_kwargs"][layer_kwargs_key]=self._resolve_layer_kwargs(flow_info)
+
+        layer_kwargs=self.structure_descriptor["layer_kwargs"][layer_kwargs_key]
+
         for subflow_index, subflow_description in enumerate(self.pdf_defs_list):
 
             ## append a collection for this subflow which will hold the number of parameters of each layer in the sub-flow
@@ -351,6 +472,43 @@ class pdf(nn.Module):
 
             self.layer_list.append(nn.ModuleList())
 
+            this_dim=int(subflow_description.split("_")[0][1:])
+
+            for layer_ind, layer_type in enumerate(self.flow_defs_list[subflow_index]):
+                 
+                self.layer_list[subflow_index].append(
+                    flow_info[layer_type]["module"](this_dim, **copy.deepcopy(layer_kwargs[subflow_index][layer_ind]))
+                )
+
+                # add parameters for the very first layer to total amortizable_params
+
+                self.num_parameter_list[subflow_index].append(self.layer_list[subflow_index][-1].get_total_param_num())
+
+        ## add log-normalization prediction
+        self.log_normalization=None
+
+        if(self.predict_log_normalization):
+
+            assert(len(self.pdf_defs_list)==1), "You chose to predict log-lambda, which is only allowed with a single sub-pdf (no autoregressive structure). \
+                                                 For autoregressive PDFs with log-lambda prediction, use fully amortized PDFs."
+
+            if self.force_permanent_parameters_in_first_subpdf:
+                self.log_normalization=nn.Parameter(torch.randn(1).unsqueeze(0))
+            else:
+                self.log_normalization=torch.zeros(1).unsqueeze(0)
+
+        self.update_embedding_structure()
+
+    def _resolve_layer_kwargs(self, flow_info):
+        """
+        Constructor arguments of all layers, derived from the resolved layer options and the position of each layer in its sub-pdf.
+        """
+        all_layer_kwargs=[]
+
+        for subflow_index, subflow_description in enumerate(self.pdf_defs_list):
+
+            all_layer_kwargs.append([])
+
             this_num_layers=len(self.flow_defs_list[subflow_index])
           
             for layer_ind, layer_type in enumerate(self.flow_defs_list[subflow_index]):
@@ -414,29 +572,9 @@ class pdf(nn.Module):
                 if(layer_type=="g" or layer_type=="h"):
                     del this_kwargs["replace_first_sigmoid_with_icdf"]
 
-                    
-                self.layer_list[subflow_index].append(
-                    flow_info[layer_type]["module"](int(subflow_description.split("_")[0][1:]), **this_kwargs)
-                )
-
-                # add parameters for the very first layer to total amortizable_params
-
-                self.num_parameter_list[subflow_index].append(self.layer_list[subflow_index][-1].get_total_param_num())
-
-        ## add log-normalization prediction
-        self.log_normalization=None
-
-        if(self.predict_log_normalization):
-
-            assert(len(self.pdf_defs_list)==1), "You chose to predict log-lambda, which is only allowed with a single sub-pdf (no autoregressive structure). \
-                                                 For autoregressive PDFs with log-lambda prediction, use fully amortized PDFs."
-
-            if self.force_permanent_parameters_in_first_subpdf:
-                self.log_normalization=nn.Parameter(torch.randn(1).unsqueeze(0))
-            else:
-                self.log_normalization=torch.zeros(1).unsqueeze(0)
+                all_layer_kwargs[subflow_index].append(this_kwargs)
 
-        self.update_embedding_structure()
+        return all_layer_kwargs
 
     def update_embedding_structure(self):
 
@@ -525,6 +663,73 @@ class pdf(nn.Module):
 
         # base dim
         self.total_base_dim=total_base_dim
+
+        self.update_embedding_chains()
+
+    def update_embedding_chains(self):
+        """
+        Analyzes the layer chain of each sub-manifold. Consecutive manifold layers that are natively defined in embedding space (see *is_embedding_native*)
+        pass embedding coordinates to each other, even if the default parametrization of the sub-manifold is intrinsic. Coordinates are then only transformed
+        at the boundaries of such a chain, which avoids repeated acos/sin conversions (and the associated pole clamping) between the layers.
+        Fills *layer_embedding_modes* and *default_embedding_modes*, which are used in the layer loops.
+        """
+
+        self.layer_embedding_modes=[]
+        self.default_embedding_modes=[]
+
+        for pdf_index, ll in enumerate(self.layer_list):
+
+            default_embedding_mode=bool(ll[-1].always_parametrize_in_embedding_space)
+            self.default_embedding_modes.append(default_embedding_mode)
+
+            native_flags=[]
+            for layer in ll:
+                is_native=False
+                if(hasattr(layer, "embedding_chain_coordinates")):
+                    layer.embedding_chain_coordinates=False
+                    
+                    ## passthrough flows do not project to the plane, so their base dimension must not change
+                    if(default_embedding_mode==False and self.use_as_passthrough_instead_of_pdf==False):
+                        is_native=layer.is_embedding_native()
+
+                native_flags.append(is_native)
+
+            ## only chains of at least 2 layers save transformations
+            chain_start=None
+            for layer_ind in range(len(ll)+1):
+                if(layer_ind<len(ll) and native_flags[layer_ind]):
+                    if(chain_start is None):
+                        chain_start=layer_ind
+                else:
+                    if(chain_start is not None):
+                        if((layer_ind-chain_start)>1):
+                            for chain_ind in range(chain_start, layer_ind):
+                                ll[chain_ind].embedding_chain_coordinates=True
+                        chain_start=None
+
+            self.layer_embedding_modes.append([layer.works_in_embedding_space() for layer in ll])
+
+    def _transform_between_layer_coordinates(self, pdf_index, x, log_det, from_embedding, to_embedding):
+        """
+        Transforms *x* between intrinsic and embedding coordinates of the given sub-manifold, if the coordinate modes of two neighbouring layers differ.
+        """
+        if(from_embedding==to_embedding):
+            return x, log_det
+
+        return self.layer_list[pdf_index][-1].transform_target_space(x, 
+                                                                   log_det=log_det, 
+                                                                   transform_from="embedding" if from_embedding else "intrinsic", 
+                                                                   transform_to="embedding" if to_embedding else "intrinsic")
+
+    def _get_layer_input_embedding_mode(self, pdf_index, layer_index):
+        """
+        Returns the coordinate mode (True for embedding coordinates) of the tensor between layer *layer_index* and the following layer in the chain.
+        For the last layer this is the default parametrization of the sub-manifold target.
+        """
+        if(layer_index==(len(self.layer_list[pdf_index])-1)):
+            return self.default_embedding_modes[pdf_index]
+        
+        return self.layer_embedding_modes[pdf_index][layer_index+1]
       
 
 
@@ -533,6 +738,11 @@ class pdf(nn.Module):
         self.mlp_predictors=nn.ModuleList()
         self.log_normalization_mlp=None
 
+        ## reduced precision of the mlp predictors (see set_mlp_precision), None means the flow dtype is used
+        self.mlp_precision=None
+        self.mlp_full_precision_state=None
+        self.mlp_flow_dtype=None
+
         if(self.skip_mlp_initialization==False):
 
             prev_extra_input_num=0
@@ -619,7 +829,11 @@ class pdf(nn.Module):
                     nn_list = []
                     for i in range(len(mlp_in_dims)):
                        
-                        l = torch.nn.Linear(mlp_in_dims[i], mlp_out_dims[i])
+                        ## the weights are overwritten by *init_params* or a loaded state dict anyway
+                        if(self.skip_param_initialization):
+                            l = torch.nn.utils.skip_init(torch.nn.Linear, mlp_in_dims[i], mlp_out_dims[i])
+                        else:
+                            l = torch.nn.Linear(mlp_in_dims[i], mlp_out_dims[i])
 
                         nn_list.append(l)
                         
@@ -827,11 +1041,11 @@ class pdf(nn.Module):
 
                     extra_mlp_inputs=amortization_parameters[:,:num_mlp_params]
 
-                    return self.mlp_predictors[0](conditional_input, extra_inputs=extra_mlp_inputs)[:,-1:]
+                    return self._apply_mlp_predictor(self.mlp_predictors[0], conditional_input, extra_inputs=extra_mlp_inputs)[:,-1:]
 
                 else:
                     ## the last parameter of the first MLP is predicting log-lambda (convention)
-                    return self.mlp_predictors[0](conditional_input)[:,-1:]
+                    return self._apply_mlp_predictor(self.mlp_predictors[0], conditional_input)[:,-1:]
             else:
                 raise NotImplementedError("This way of independenly predicting the normalization (from all other parameters) is outdated!")
                 return self.log_normalization_mlp(conditional_input)
@@ -908,11 +1122,11 @@ class pdf(nn.Module):
                     if(amortization_parameters is not None):
                         num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                        extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                        extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                         amort_param_counter+=num_amortization_params
 
                     else:
-                        extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                        extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
                    
                 else:
 
@@ -923,11 +1137,11 @@ class pdf(nn.Module):
                         if(amortization_parameters is not None):
                             num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                            extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                            extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                             amort_param_counter+=num_amortization_params
 
                         else:
-                            extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                            extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
                         
                     else:
                         raise Exception("FORWARD: extra conditional input is empty but required for encoding!")
@@ -971,11 +1185,10 @@ class pdf(nn.Module):
                         ]
 
                 
-                if(l==(len(pdf_layers)-1)):
-                    # force embedding or intrinsic coordinates in the layer that defines the target dimension
-                    this_target, log_det = layer.inv_flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
-                else:
+                ## only transforms at the boundary of embedding-native layer chains
+                this_target, log_det = self._transform_between_layer_coordinates(pdf_index, this_target, log_det, self._get_layer_input_embedding_mode(pdf_index, l), self.layer_embedding_modes[pdf_index][l])
 
+                with spline_fns.recording_violations(self.spline_violations):
                     this_target, log_det = layer.inv_flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
                 
                 extra_param_counter += layer.total_param_num
@@ -1051,10 +1264,13 @@ class pdf(nn.Module):
                 assert(x.shape[0]==conditional_input.shape[0]), "Evaluating input x and condititional input shape must be similar!"
                 assert(x.is_cuda==conditional_input.is_cuda), ("input tensor *x* and *conditional_input* are on different devices .. resp. cuda flags: 1) x, 2) conditional_input, 3) pdf model", x.is_cuda, conditional_input.is_cuda, next(self.parameters()).is_cuda)
 
-        tot_log_det = torch.zeros(x.shape[0]).type_as(x)
+        ## log-determinants of float32 models are accumulated in float64 (see jammy_flows.precision)
+        tot_log_det = torch.zeros(x.shape[0], dtype=precision.accumulation_dtype(x.dtype), device=x.device)
 
         base_pos, tot_log_det=self.all_layer_inverse(x, tot_log_det, conditional_input, amortization_parameters=amortization_parameters, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
 
+        tot_log_det=tot_log_det.to(x.dtype)
+
         ## must faster calculation based on std normal
         other=torch.distributions.Normal(
             0.0,
@@ -1191,7 +1407,7 @@ class pdf(nn.Module):
                 if(len(extra_conditional_input)>0):
                     this_data_summary=torch.cat([this_data_summary]+extra_conditional_input, dim=1)
 
-                extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
 
             else:
 
@@ -1199,7 +1415,7 @@ class pdf(nn.Module):
                     if(len(extra_conditional_input)>0):
                         this_data_summary=torch.cat(extra_conditional_input, dim=1)
                         
-                        extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                        extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
                     else:
                         raise Exception("SAMPLE: extra conditional input is empty but required for encoding!")
      
@@ -1229,7 +1445,9 @@ class pdf(nn.Module):
                 this_layer_param_structure[("%.3d" % pdf_index)+"_"+this_flow_def+".%.3d" % l]=this_param_dict
                 #################
 
-                this_target, log_det = layer.flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
+                with spline_fns.recording_violations(self.spline_violations):
+                    this_target, log_det = layer.flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
+                this_target, log_det = self._transform_between_layer_coordinates(pdf_index, this_target, log_det, self.layer_embedding_modes[pdf_index][l], self._get_layer_input_embedding_mode(pdf_index, l))
 
                 extra_param_counter += layer.total_param_num 
            
@@ -1376,11 +1594,11 @@ class pdf(nn.Module):
                     if(amortization_parameters is not None):
                         num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                        extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                        extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                         amort_param_counter+=num_amortization_params
 
                     else:
-                        extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                        extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
 
                
                 else:
@@ -1393,11 +1611,11 @@ class pdf(nn.Module):
                         if(amortization_parameters is not None):
                             num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                            extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                            extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                             amort_param_counter+=num_amortization_params
 
                         else:
-                            extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                            extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
 
                     else:
                         raise Exception("SAMPLE: extra conditional input is empty but required for encoding!")
@@ -1432,10 +1650,11 @@ class pdf(nn.Module):
                     
                     this_extra_params = extra_params[:, extra_param_counter : extra_param_counter + layer.total_param_num]
               
-                if(l==(len(pdf_layers)-1)):
-                    this_target, log_det = layer.flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
-                else:
+                with spline_fns.recording_violations(self.spline_violations):
                     this_target, log_det = layer.flow_mapping([this_target, log_det], extra_inputs=this_extra_params)
+
+                ## only transforms at the boundary of embedding-native layer chains
+                this_target, log_det = self._transform_between_layer_coordinates(pdf_index, this_target, log_det, self.layer_embedding_modes[pdf_index][l], self._get_layer_input_embedding_mode(pdf_index, l))
                 
                 extra_param_counter += layer.total_param_num
 
@@ -1525,6 +1744,7 @@ class pdf(nn.Module):
             assert(amortization_parameters is not None)
             used_device=amortization_parameters.device
             used_sample_size=amortization_parameters.shape[0]
+            data_type=amortization_parameters.dtype if dtype is None else dtype
 
             if(conditional_input is not None):
                 ## TODO - maybe allow for more flexible shape combinations
@@ -1597,10 +1817,12 @@ class pdf(nn.Module):
             
             x = std_normal_samples
 
-        log_det = torch.zeros(used_sample_size).type(data_type).to(used_device)
+        log_det = torch.zeros(used_sample_size, dtype=precision.accumulation_dtype(data_type), device=used_device)
         
         new_targets, log_det=self.all_layer_forward(x, log_det, conditional_input, amortization_parameters=amortization_parameters, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
 
+        log_det=log_det.to(data_type)
+
         ## failsafe crosscheck?
 
         return_log_pdf=-log_det + log_gauss_evals
@@ -1733,14 +1955,20 @@ class pdf(nn.Module):
 
     ########
 
-    def init_params(self, data=None, damping_factor=1000.0, mvn_min_max_sv_ratio=1e-4):
+    def init_params(self, data=None, damping_factor=1000.0, mvn_min_max_sv_ratio=1e-4, reservoir_size=100000, num_workers=1):
         """
         Initialize params of the normalizing flow such that the different sub flows play nice with each other and the starting distribution is a reasonable one.
         For the Gaussianization flow, data can be used to initilialize the starting distribution such that it roughly follows the data.
             
         Parameters:
-            data (None/Tensor): If given a Tensor with target data, Gaussianization Flow subflows can make use of the distribution and initialize such that they follow the distribution.
+            data (None/Tensor/iterable(Tensor)): If given a Tensor with target data, Gaussianization Flow subflows can make use of the distribution and initialize such that they follow the distribution.
+                                                 Large datasets can be passed as a re-iterable collection of chunks (e.g. a list of tensors or a DataLoader yielding tensors), which are streamed through the layers in bounded memory.
             damping_factor (float): Weights in final matrices of amortization MLPs are divided by this factor (after already having been initialized) to dampen the impact of previous flow layers and conditional input in the autoregressive amortization structure.
+            mvn_min_max_sv_ratio (float): Minimum ratio of the smallest to the largest singular value of the data matrix for multivariate normal blocks.
+            reservoir_size (int): If *data* is given as chunks, the KDE centers of Gaussianization blocks are determined from a random subset of at most this many data points. A single data tensor is always used completely.
+            num_workers (int): Number of threads that initialize Euclidean sub-pdfs with data in parallel. Each of these sub-pdfs draws its random numbers from its own generator, 
+                               seeded in sub-pdf order from the global torch random state, so the result is reproducible and independent of *num_workers*. 
+                               With more than one worker, data chunk collections should not draw from the global random state themselves (e.g. shuffling DataLoaders without their own generator).
 
         """
 
@@ -1752,12 +1980,25 @@ class pdf(nn.Module):
 
         with torch.no_grad():
             ## 0) check data
+            used_reservoir_size=None
+
             if(data is not None):
+                if(not torch.is_tensor(data)):
+                    if(iter(data) is data):
+                        raise Exception("Initialization data chunks must be re-iterable (e.g. a list of tensors or a DataLoader), not a generator, since every layer requires a pass over the data.")
+
+                    used_reservoir_size=reservoir_size
+
                 ## initialization data has to match pdf dimenions
-                assert(data.shape[1]==self.total_target_dim), "Initialization with data must match the target dimension of the PDF!"
+                first_chunk=data if torch.is_tensor(data) else next(iter(data))
+                assert(first_chunk.shape[1]==self.total_target_dim), "Initialization with data must match the target dimension of the PDF!"
 
             ## 1) Find initialization params of all layers - each index corresponds to all flows from a given sub manifold
-            params_list=[]
+            params_list=[None]*len(self.pdf_defs_list)
+
+            ## data-driven initializations of Euclidean sub-pdfs are independent of each other and are collected as (sub-pdf index, layers, data, generator)
+            data_init_tasks=[]
+
             ## loop through all the layers and get the initializing parameters
 
             this_dim_index=0
@@ -1770,9 +2011,20 @@ class pdf(nn.Module):
 
                 if("e" in subflow_description):
                     
-                    params=find_init_pars_of_chained_blocks(this_layer_list, data[:, this_dim_index:this_dim_index+this_dim] if data is not None else None, mvn_min_max_sv_ratio=mvn_min_max_sv_ratio)
+                    if(data is not None):
+                        if(torch.is_tensor(data)):
+                            this_data=data[:, this_dim_index:this_dim_index+this_dim]
+                        else:
+                            this_data=_column_slice_chunks(data, this_dim_index, this_dim_index+this_dim)
 
-                    params_list.append(params)
+                        ## seeds are drawn in sub-pdf order, so the result does not depend on the number of workers
+                        generator=torch.Generator()
+                        generator.manual_seed(int(torch.randint(0, 2**62, (1,))))
+
+                        data_init_tasks.append((subflow_index, this_layer_list, this_data, generator))
+
+                    else:
+                        params_list[subflow_index]=find_init_pars_of_chained_blocks(this_layer_list, None)
 
                 else:
                     
@@ -1780,10 +2032,27 @@ class pdf(nn.Module):
                     for l in this_layer_list:
                         this_list.append(l.get_desired_init_parameters())
 
-                    params_list.append(torch.cat(this_list))
+                    params_list[subflow_index]=torch.cat(this_list)
 
                 this_dim_index+=this_dim
 
+            def data_init(task):
+                _, this_layer_list, this_data, generator=task
+
+                ## worker threads do not inherit the context of the calling thread
+                with spline_fns.recording_violations(self.spline_violations):
+                    return find_init_pars_of_chained_blocks(this_layer_list, this_data, mvn_min_max_sv_ratio=mvn_min_max_sv_ratio, reservoir_size=used_reservoir_size, generator=generator)
+
+            ## torch releases the GIL in its tensor operations, so threads initialize the sub-pdfs in parallel
+            if(num_workers>1 and len(data_init_tasks)>1):
+                with concurrent.futures.ThreadPoolExecutor(max_workers=num_workers) as executor:
+                    data_init_params=list(executor.map(data_init, data_init_tasks))
+            else:
+                data_init_params=[data_init(task) for task in data_init_tasks]
+
+            for task, params in zip(data_init_tasks, data_init_params):
+                params_list[task[0]]=params
+
             ## 2) Depending on encoding structure, use the init params at appropriate places
        
 
@@ -1906,6 +2175,54 @@ class pdf(nn.Module):
         expected_coverage_probs=numpy.linspace(0,1.0,num_percentile_points)
         return_dict["expected"]=expected_coverage_probs
 
+        base_log_probs=self._coverage_base_log_probs(target_x, 
+                                                     conditional_input=conditional_input, 
+                                                     amortization_parameters=amortization_parameters, 
+                                                     force_embedding_coordinates=force_embedding_coordinates, 
+                                                     force_intrinsic_coordinates=force_intrinsic_coordinates, 
+                                                     sub_manifolds=sub_manifolds)
+
+        coverage_dims=self._coverage_dims(sub_manifolds)
+
+        for key, logp_base in base_log_probs.items():
+            true_cov, logprob_diffs=_calculate_coverage(logp_base.cpu().numpy(), coverage_dims[key], expected_coverage_probs)
+            
+            return_dict["true"][key]=true_cov
+            return_dict["logprob_diffs"][key]=logprob_diffs
+
+        return return_dict
+
+    def _coverage_dims(self, sub_manifolds):
+        """
+        Base dimension for each coverage key ("total" for the whole PDF, otherwise the sub-manifold index).
+        """
+        coverage_dims=collections.OrderedDict()
+
+        if(-1 in sub_manifolds):
+            coverage_dims["total"]=self.total_base_dim
+
+        for sm in sub_manifolds:
+            if(sm==-1):
+                continue
+
+            assert(sm>=0 and sm<len(self.pdf_defs_list)), ("Sub manifold index %d is invalid" % sm)
+
+            coverage_dims[int(sm)]=self.target_dims_intrinsic[sm]
+
+        return coverage_dims
+
+    def _coverage_base_log_probs(self, 
+                                 target_x, 
+                                 conditional_input=None, 
+                                 amortization_parameters=None, 
+                                 force_embedding_coordinates=False, 
+                                 force_intrinsic_coordinates=False, 
+                                 sub_manifolds=[-1]):
+        """
+        Base log-probabilities of *target_x* for each coverage key (see *_coverage_dims*).
+        """
+        base_log_probs=collections.OrderedDict()
+
         with torch.no_grad():
 
             _, logp_base, base_points=self.forward(target_x, 
@@ -1914,38 +2231,105 @@ class pdf(nn.Module):
                     force_embedding_coordinates=force_embedding_coordinates, 
                     force_intrinsic_coordinates=force_intrinsic_coordinates)
 
-            ## overall coverage
-            if(-1 in sub_manifolds):
-                true_cov, logprob_diffs=_calculate_coverage(logp_base.cpu().numpy(), self.total_base_dim, expected_coverage_probs)
-                
-                return_dict["true"]["total"]=true_cov
-                return_dict["logprob_diffs"]["total"]=logprob_diffs
+            for key in self._coverage_dims(sub_manifolds).keys():
 
-            for sm in sub_manifolds:
-                if(sm==-1):
-                    continue
+                if(key=="total"):
+                    base_log_probs[key]=logp_base
+                else:
+                    base_log_probs[key]=torch.distributions.Normal(0.0,1.0).log_prob(base_points[:,self.target_dim_indices_intrinsic[key][0]:self.target_dim_indices_intrinsic[key][1]]).sum(axis=-1)
 
-                if(sm!=-1):
-                    assert(sm>=0 and sm<len(self.pdf_defs_list)), ("Sub manifold index %d is invalid" % sm)
-             
-                sub_logp_base=torch.distributions.Normal(0.0,1.0).log_prob(base_points[:,self.target_dim_indices_intrinsic[sm][0]:self.target_dim_indices_intrinsic[sm][1]]).sum(axis=-1)
-               
-                true_cov, logprob_diffs=_calculate_coverage(sub_logp_base.cpu().numpy(), self.target_dims_intrinsic[sm], expected_coverage_probs)
-            
-                return_dict["true"][int(sm)]=true_cov
-                return_dict["logprob_diffs"][int(sm)]=logprob_diffs
+        return base_log_probs
 
-        return return_dict
+    def new_coverage_accumulator(self, num_percentile_points=100, sub_manifolds=[-1]):
+        """
+        Creates an empty streaming coverage accumulator for this PDF (see *coverage_streaming*). Accumulators of parallel workers can be combined with *merge*.
 
-       
+        Returns:
 
-#### Experimental functions
-#### Some of these functions generalize existing functions and will replace them in future release.
+            jammy_flows.extra_functions.coverage_accumulator
+        """
+        return coverage_accumulator(self._coverage_dims(sub_manifolds), num_percentile_points=num_percentile_points)
+
+    def coverage_streaming(self, 
+                           batches,
+                           num_percentile_points=100,
+                           sub_manifolds=[-1],
+                           accumulator=None,
+                           force_embedding_coordinates=False, 
+                           force_intrinsic_coordinates=False,
+                           device=None,
+                           return_accumulator=False):
+        """
+        Streaming version of *coverage* for datasets that do not fit into memory. Consumes batches from an iterator or DataLoader and keeps 
+        fixed-size histograms of 2*(log(p(0))-log(p_(z_base))) per sub-manifold, so memory is constant in the number of events. 
+        The true coverage at every expected coverage probability is identical to *coverage* on the concatenated data.
 
-    def entropy(self, 
-                sub_manifolds=[-1], 
-                conditional_input=None,
-                force_embedding_coordinates=True, 
+        Parameters:
+
+            batches (iterable): Yields target tensors, or tuples/lists of (target, conditional_input) or (target, conditional_input, amortization_parameters).
+            num_percentile_points (int): At how many points along the chi2 do we want to compare true vs expected coverage?
+            sub_manifolds (list(int)): Contains indices of sub-manifolds. *-1* stands for the total PDF and is the default.
+            accumulator (coverage_accumulator/None): Continue accumulating into an existing accumulator (e.g. a partial result of a worker).
+            force_embedding_coordinates (bool): Enforces embedding coordinates in the targets.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the targets.
+            device (torch.device/None): If given, batches are moved to this device.
+            return_accumulator (bool): Return the accumulator instead of the result dictionary, e.g. to merge partial results of parallel workers.
+
+        Returns:
+
+            Dictionary with "expected" coverage probabilities and "true" coverage probabilities for every key as in *coverage*, plus "num_events", 
+            or the accumulator if *return_accumulator* is set.
+        """
+        if(accumulator is None):
+            accumulator=self.new_coverage_accumulator(num_percentile_points=num_percentile_points, sub_manifolds=sub_manifolds)
+
+        used_sub_manifolds=[-1 if key=="total" else key for key in accumulator.dims.keys()]
+
+        for batch in batches:
+
+            conditional_input=None
+            amortization_parameters=None
+
+            if(type(batch)==tuple or type(batch)==list):
+                target_x=batch[0]
+                if(len(batch)>1):
+                    conditional_input=batch[1]
+                if(len(batch)>2):
+                    amortization_parameters=batch[2]
+            else:
+                target_x=batch
+
+            if(device is not None):
+                target_x=target_x.to(device)
+                if(conditional_input is not None):
+                    conditional_input=[ci.to(device) for ci in conditional_input] if type(conditional_input)==list else conditional_input.to(device)
+                if(amortization_parameters is not None):
+                    amortization_parameters=amortization_parameters.to(device)
+
+            base_log_probs=self._coverage_base_log_probs(target_x, 
+                                                         conditional_input=conditional_input, 
+                                                         amortization_parameters=amortization_parameters, 
+                                                         force_embedding_coordinates=force_embedding_coordinates, 
+                                                         force_intrinsic_coordinates=force_intrinsic_coordinates, 
+                                                         sub_manifolds=used_sub_manifolds)
+
+            for key, logp_base in base_log_probs.items():
+                accumulator.add(key, logp_base)
+
+        if(return_accumulator):
+            return accumulator
+
+        return accumulator.result()
+
+       
+
+#### Experimental functions
+#### Some of these functions generalize existing functions and will replace them in future release.
+
+    def entropy(self, 
+                sub_manifolds=[-1], 
+                conditional_input=None,
+                force_embedding_coordinates=True, 
                 force_intrinsic_coordinates=False,
                 samplesize=100,
                 failsafe_crosscheck_tolerance=None,
@@ -2484,11 +2868,11 @@ class pdf(nn.Module):
                 if(amortization_parameters is not None):
                     num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                    extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                    extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                     amort_param_counter+=num_amortization_params
 
                 else:
-                    extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                    extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
                
             else:
 
@@ -2499,11 +2883,11 @@ class pdf(nn.Module):
                         if(amortization_parameters is not None):
                             num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                            extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                            extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                             amort_param_counter+=num_amortization_params
 
                         else:
-                            extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                            extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
                         
                     else:
                         raise Exception("FORWARD: extra conditional input is empty but required for encoding!")
@@ -2552,11 +2936,9 @@ class pdf(nn.Module):
                         ]
 
  
-                if(l==(len(pdf_layers)-1)):
-                    # force embedding or intrinsic coordinates in the layer that defines the target dimension
-                    this_target, this_layer_log_det = layer.inv_flow_mapping([this_target, 0.0], extra_inputs=this_extra_params)
-                else:
+                this_target, this_subpdf_log_det = self._transform_between_layer_coordinates(pdf_index, this_target, this_subpdf_log_det, self._get_layer_input_embedding_mode(pdf_index, l), self.layer_embedding_modes[pdf_index][l])
 
+                with spline_fns.recording_violations(self.spline_violations):
                     this_target, this_layer_log_det = layer.inv_flow_mapping([this_target, 0.0], extra_inputs=this_extra_params)
                 
                 this_subpdf_log_det=this_subpdf_log_det+this_layer_log_det
@@ -2720,11 +3102,11 @@ class pdf(nn.Module):
                     if(amortization_parameters is not None):
                         num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                        extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                        extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                         amort_param_counter+=num_amortization_params
 
                     else:
-                        extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                        extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
                    
 
                 else:
@@ -2736,11 +3118,11 @@ class pdf(nn.Module):
                             if(amortization_parameters is not None):
                                 num_amortization_params=self.mlp_predictors[pdf_index].num_amortization_params
 
-                                extra_params=self.mlp_predictors[pdf_index](this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
+                                extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary, extra_inputs=amortization_parameters[:,amort_param_counter:amort_param_counter+num_amortization_params])
                                 amort_param_counter+=num_amortization_params
 
                             else:
-                                extra_params=self.mlp_predictors[pdf_index](this_data_summary)
+                                extra_params=self._apply_mlp_predictor(self.mlp_predictors[pdf_index], this_data_summary)
 
                         else:
                             raise Exception("SAMPLE: extra conditional input is empty but required for encoding!")
@@ -2787,12 +3169,15 @@ class pdf(nn.Module):
                         
                         this_extra_params = extra_params[:, extra_param_counter : extra_param_counter + layer.total_param_num]
                   
-                    this_target, this_log_det = layer.flow_mapping([this_target, 0.0], extra_inputs=this_extra_params)
+                    with spline_fns.recording_violations(self.spline_violations):
+                        this_target, this_log_det = layer.flow_mapping([this_target, 0.0], extra_inputs=this_extra_params)
                     
                     extra_param_counter += layer.total_param_num
 
                     logdet_this_manifold = logdet_this_manifold+this_log_det
 
+                    this_target, logdet_this_manifold = self._transform_between_layer_coordinates(pdf_index, this_target, logdet_this_manifold, self.layer_embedding_modes[pdf_index][l], self._get_layer_input_embedding_mode(pdf_index, l))
+
                 # default joint logdet
                 if(-1 in sub_manifolds):
                     tot_log_det=tot_log_det+logdet_this_manifold
@@ -2954,8 +3339,252 @@ class pdf(nn.Module):
 
         return potentially_transformed_vals, individual_logdets
 
+    def _apply_mlp_predictor(self, mlp_predictor, data_summary, extra_inputs=None):
+        """
+        Evaluates an mlp predictor. If the mlps run in reduced precision (see *set_mlp_precision*), the inputs are cast to the mlp dtype and the 
+        predicted flow parameters are cast back to the dtype of *data_summary*, so flow layers and log-det accumulation keep their precision.
+        """
+        output_dtype=data_summary.dtype
+
+        if(self.mlp_precision is not None):
+            data_summary=data_summary.to(self.mlp_precision)
+            if(extra_inputs is not None):
+                extra_inputs=extra_inputs.to(self.mlp_precision)
+
+        if(extra_inputs is not None):
+            return mlp_predictor(data_summary, extra_inputs=extra_inputs).to(output_dtype)
+
+        return mlp_predictor(data_summary).to(output_dtype)
+
+    def set_mlp_precision(self, dtype=None):
+        """
+        Runs the amortization MLPs (*mlp_predictors*) in reduced precision, e.g. torch.bfloat16 for cheaper CPU inference of large conditional models. 
+        Flow layers and log-det accumulation keep their dtype. The casts happen automatically at the *all_layer_inverse*/*all_layer_forward* boundary.
+        A full-precision copy of the MLP weights is kept, so switching back is lossless. Meant for inference, call it after the model has its final dtype and device.
+
+        Parameters:
+
+            dtype (torch.dtype/None): torch.bfloat16 or torch.float16. None switches back to the flow dtype.
+        """
+        if(dtype is not None and dtype not in [torch.bfloat16, torch.float16]):
+            raise Exception("Reduced MLP precision requires torch.bfloat16 or torch.float16, got ", dtype)
+
+        if(self.mlp_precision is None):
+            if(dtype is None):
+                return
+
+            flow_dtype, _=self.obtain_current_dtype_n_device()
+
+            self.mlp_flow_dtype=flow_dtype
+            self.mlp_full_precision_state=dict([(k, v.detach().clone()) for k,v in self.mlp_predictors.state_dict().items()])
+
+        if(dtype is None):
+            self.mlp_predictors.to(self.mlp_flow_dtype)
+            self.mlp_predictors.load_state_dict(self.mlp_full_precision_state)
+
+            self.mlp_full_precision_state=None
+            self.mlp_flow_dtype=None
+        else:
+            self.mlp_predictors.to(dtype)
+
+        self.mlp_precision=dtype
+
+    def validate_mlp_precision(self, 
+                               x, 
+                               conditional_input=None, 
+                               mlp_dtype=torch.bfloat16, 
+                               amortization_parameters=None, 
+                               force_embedding_coordinates=False, 
+                               force_intrinsic_coordinates=False):
+        """
+        Compares log-probabilities with MLPs in reduced precision (see *set_mlp_precision*) to full-precision log-probabilities. 
+        The MLP precision setting of the model is restored afterwards.
+
+        Parameters:
+
+            x (Tensor): Target input, shape = (B,D).
+            conditional_input (Tensor/list/None): Conditional input.
+            mlp_dtype (torch.dtype): Reduced MLP precision to validate.
+            amortization_parameters (Tensor/None): Amortization parameters.
+            force_embedding_coordinates (bool): Input *x* is given in embedding coordinates.
+            force_intrinsic_coordinates (bool): Input *x* is given in intrinsic coordinates.
+
+        Returns:
+
+            Dictionary with the maximum, mean and rms absolute log-prob deviation ("max_abs_deviation", "mean_abs_deviation", "rms_deviation"), 
+            the maximum deviation relative to the spread of the full-precision log-probabilities ("max_relative_deviation") and the number of 
+            non-finite reduced-precision log-probabilities ("num_non_finite").
+        """
+        previous_precision=self.mlp_precision
+
+        try:
+            with torch.no_grad():
+                self.set_mlp_precision(None)
+                log_pdf_full,_,_=self(x, conditional_input=conditional_input, amortization_parameters=amortization_parameters, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
+
+                self.set_mlp_precision(mlp_dtype)
+                log_pdf_reduced,_,_=self(x, conditional_input=conditional_input, amortization_parameters=amortization_parameters, force_embedding_coordinates=force_embedding_coordinates, force_intrinsic_coordinates=force_intrinsic_coordinates)
+        finally:
+            self.set_mlp_precision(None)
+            self.set_mlp_precision(previous_precision)
+
+        finite_mask=torch.isfinite(log_pdf_reduced) & torch.isfinite(log_pdf_full)
+        num_non_finite=int((torch.isfinite(log_pdf_reduced)==False).sum())
+
+        if(finite_mask.sum()<2):
+            return dict(max_abs_deviation=float("nan"), mean_abs_deviation=float("nan"), rms_deviation=float("nan"), max_relative_deviation=float("nan"), num_non_finite=num_non_finite)
+
+        deviations=(log_pdf_reduced-log_pdf_full)[finite_mask].abs()
+
+        return dict(max_abs_deviation=deviations.max().item(),
+                    mean_abs_deviation=deviations.mean().item(),
+                    rms_deviation=(deviations**2).mean().sqrt().item(),
+                    max_relative_deviation=(deviations.max()/log_pdf_full[finite_mask].std()).item(),
+                    num_non_finite=num_non_finite)
+
+    def export_inference_module(self, mode="log_prob", example_inputs=None, check_inputs=[], tolerance=1e-5):
+        """
+        Specializes the pdf into a static inference module without Python-side structure handling (see *jammy_flows.export.pdf_inference_module*). Usage:
+
+            module=model.export_inference_module("log_prob")
+            compiled=torch.compile(module)
+
+            traced=model.export_inference_module("log_prob", example_inputs=(x, conditional_input))
+            torch.jit.save(traced, "model.pt")
+
+        The module shares the parameters of the pdf, so it has to be re-exported if the structure changes. Traced modules also freeze cached quantities 
+        (e.g. tabulated inverses) and have to be re-exported after parameter updates.
+
+        Parameters:
+
+            mode (str): "log_prob" (inputs: x, conditional_input) or "sample" (inputs: standard normal base samples, conditional_input).
+            example_inputs (tuple/None): If given, the module is traced into TorchScript with these inputs.
+            check_inputs (list(tuple)): Further inputs to validate the traced module against the eager module.
+            tolerance (float): Maximum absolute deviation between traced and eager results.
+
+        Returns:
+
+            jammy_flows.export.pdf_inference_module, or torch.jit.ScriptModule if *example_inputs* are given.
+        """
+        module=pdf_inference_module(self, mode=mode)
+
+        if(example_inputs is None):
+            return module
+
+        return trace_inference_module(module, example_inputs, check_inputs=check_inputs, tolerance=tolerance)
+
+    def check_spline_violations(self, reset=True):
+        """
+        Raises an Exception if inputs outside of the allowed interval reached a rational-quadratic spline (e.g. in "r" layers) of this pdf since the last check.
+        These checks are deferred by default, so evaluation does not synchronize with the device, and out-of-bounds inputs silently yield meaningless 
+        log-probabilities until this function is called. Call it regularly, e.g. after every epoch. Violations are recorded per pdf.
+
+        Parameters:
+
+            reset (bool): Clear the recorded violations.
+        """
+        self.spline_violations.check(reset=reset)
+
+    def save_checkpoint(self, filename):
+        """
+        Saves the pdf as a self-describing, versioned checkpoint: a JSON header with the model definition, the resolved options of all layers
+        and the embedding flags, followed by all tensors of the state dict in one flat, aligned data section (see *jammy_flows.checkpoint*).
+        Storing the resolved options instead of *options_overwrite* makes the checkpoint independent of changes of default options.
+        If the MLPs run in reduced precision (see *set_mlp_precision*), their full-precision weights are saved and the reduced precision is 
+        reapplied when loading. Load it with *pdf.from_checkpoint*.
+
+        Parameters:
+
+            filename (str): Output file.
+        """
+        header=dict(model_definition=self.model_definition,
+                    flow_opts=[self.flow_opts[ind] for ind in range(len(self.flow_defs_list))],
+                    embedding_flags=[[bool(layer.always_parametrize_in_embedding_space) for layer in ll] for ll in self.layer_list],
+                    mlp_precision=None if self.mlp_precision is None else str(self.mlp_precision).split(".")[-1])
+
+        state_dict=self.state_dict()
+
+        if(self.mlp_full_precision_state is not None):
+            for name, tensor in self.mlp_full_precision_state.items():
+                state_dict["mlp_predictors."+name]=tensor
+
+        checkpoint.write_checkpoint(filename, header, state_dict)
+
+    @classmethod
+    def from_checkpoint(cls, filename, mmap=True):
+        """
+        Restores a pdf saved with *save_checkpoint*. The pdf is constructed lazily (*skip_param_initialization*) and its parameters and buffers
+        are assigned the checkpoint tensors without copies. With *mmap*, these are copy-on-write views into the memory-mapped file, so opening a model
+        reads almost nothing, models opened in forked workers share their pages, and training the loaded model never modifies the file.
+        Parameters keep the dtype they were saved in and are located on the CPU.
+
+        Parameters:
+
+            filename (str): Checkpoint file.
+            mmap (bool): Memory-map the file instead of reading it.
+
+        Returns:
+
+            jammy_flows.pdf
+        """
+        header, tensors=checkpoint.read_checkpoint(filename, mmap=mmap)
+
+        ## the resolved options of every layer overwrite the defaults
+        options_overwrite=_options_overwrite_from_flow_opts(header["model_definition"]["flow_defs"], header["flow_opts"])
+
+        new_pdf=cls(options_overwrite=options_overwrite, skip_param_initialization=True, **header["model_definition"])
+
+        for ll, flags in zip(new_pdf.layer_list, header["embedding_flags"]):
+            for layer, flag in zip(ll, flags):
+                layer.always_parametrize_in_embedding_space=flag
+
+        new_pdf.update_embedding_structure()
+
+        checkpoint.assign_state_dict(new_pdf, tensors)
+
+        ## checkpoints without the entry were saved in full precision
+        if(header.get("mlp_precision", None) is not None):
+            new_pdf.set_mlp_precision(getattr(torch, header["mlp_precision"]))
+
+        return new_pdf
+
+    def profile(self, synchronize_cuda=True, record_cuda_memory=True, record_cpu_memory=False):
+        """
+        Opt-in profiling context. Usage:
+
+            with model.profile() as prof:
+                model(data)
+
+            prof.report()
+            prof.export_chrome_trace("trace.json")
+
+        Records wall time, call counts, batch sizes and output tensor bytes of *forward*, *sample*, every layer's *flow_mapping*/*inv_flow_mapping* and 
+        every *mlp_predictors* call, and the iteration counts of the bisection/Newton solvers. Outside of the context the model runs uninstrumented.
+        Allocated tensor memory is recorded per call on GPUs with *record_cuda_memory*, and on the CPU only with *record_cpu_memory*. Otherwise only the 
+        bytes of the returned tensors are reported.
+
+        Parameters:
+
+            synchronize_cuda (bool): Synchronize CUDA around every wrapped call (only relevant on GPUs).
+            record_cuda_memory (bool): Record changes of allocated CUDA memory (only relevant on GPUs).
+            record_cpu_memory (bool): Record changes of allocated CPU memory via *torch.profiler* memory events. Adds noticeable overhead to every call.
+
+        Returns:
+
+            jammy_flows.profiling.pdf_profiler
+        """
+        return pdf_profiler(self, synchronize_cuda=synchronize_cuda, record_cuda_memory=record_cuda_memory, record_cpu_memory=record_cpu_memory)
+
     def obtain_current_dtype_n_device(self):
 
+        if(self.mlp_precision is not None):
+            ## mlps in reduced precision do not define the dtype of the flow
+            for name, par in self.named_parameters():
+                if(not name.startswith("mlp_predictors.")):
+                    return par.dtype, par.device
+
+            return self.mlp_flow_dtype, next(self.parameters()).device
+
         ## peek into first parameter vector
         try:
             first = next(self.parameters())
@@ -2969,6 +3598,150 @@ class pdf(nn.Module):
         else:
             return first.dtype, first.device
 
+    def _s2_entropy_scan(self, 
+                         conditional_input=None,
+                         samplesize=10000,
+                         nside=32,
+                         max_nside=4096,
+                         tolerance=0.001,
+                         tail_mass=1e-4,
+                         max_batch_size=100000,
+                         dtype=None,
+                         device=None,
+                         verbose=False):
+        """
+        Hierarchical HEALPix scan of an s2 pdf in the NESTED scheme. The sky is evaluated at the coarse resolution *nside*. In every refinement step only
+        the highest-probability pixels that together hold all but *tail_mass* of the current probability mass, and their neighbours, are split into their 4 child pixels (4*p,...,4*p+3 in the NESTED scheme)
+        and evaluated at the next resolution. The remaining pixels keep the evaluation of their parent. The scan stops once normalization and entropy change by less than *tolerance*
+        and the samples cover enough distinct pixels, or at *max_nside*. The cost scales with the support of the pdf instead of the full sky.
+
+        Parameters:
+
+            conditional_input (Tensor/None): Single conditional input of shape (C,).
+            samplesize (int): Number of samples drawn from the scanned pixel pdf (pixel centers).
+            nside (int): Coarse starting resolution.
+            max_nside (int): Maximum resolution.
+            tolerance (float): Tolerance on the normalization and the entropy change between refinement steps.
+            tail_mass (float): Probability mass of the pixels that are not refined further.
+            max_batch_size (int): Maximum number of pixels evaluated in one forward pass.
+            dtype (torch dtype): Dtype of the evaluation.
+            device (torch.device): Device of the evaluation.
+            verbose (bool): Print the progress of the scan.
+
+        Returns:
+
+            float
+                Entropy estimate.
+            Tensor
+                Samples in embedding coordinates, shape = (samplesize, 3).
+        """
+
+        def evaluate_pixels(cur_nside, ipix):
+
+            theta, phi = healpy.pix2ang(nside=cur_nside, ipix=ipix, nest=True)
+
+            target_angles=torch.from_numpy(numpy.concatenate([theta[:,None], phi[:,None]], axis=1)).to(dtype=dtype, device=device)
+            target_xyz,_=self.transform_target_space(target_angles, transform_from="intrinsic", transform_to="embedding")
+
+            all_log_pdfs=[]
+
+            for start in range(0, len(ipix), max_batch_size):
+                next_target=target_xyz[start:start+max_batch_size]
+
+                next_cinput=None
+                if(conditional_input is not None):
+                    next_cinput=conditional_input[None,:].expand(len(next_target), -1)
+
+                log_pdf,_,_=self.forward(next_target, conditional_input=next_cinput, force_embedding_coordinates=True)
+                all_log_pdfs.append(log_pdf.cpu().numpy().astype(numpy.float64))
+
+            return numpy.concatenate(all_log_pdfs)
+
+        def pixel_probs_n_entropy_terms(cur_nside, log_pdf):
+
+            probabilities=numpy.exp(log_pdf)*4*numpy.pi/healpy.nside2npix(cur_nside)
+            entropy_terms=numpy.where(probabilities>0, -probabilities*log_pdf, 0.0)
+
+            return probabilities, entropy_terms
+
+        ## pixels that are not refined further, one entry per resolution: (nside, pixel indices, probabilities)
+        frozen_pixels=[]
+        frozen_mass=0.0
+        frozen_entropy=0.0
+
+        ipix=numpy.arange(healpy.nside2npix(nside))
+        log_pdf=evaluate_pixels(nside, ipix)
+
+        prev_entropy=None
+
+        while(True):
+
+            probabilities, entropy_terms=pixel_probs_n_entropy_terms(nside, log_pdf)
+
+            tot_sum=frozen_mass+probabilities.sum()
+            entropy=frozen_entropy+entropy_terms.sum()
+
+            all_probs=numpy.concatenate([fp[2] for fp in frozen_pixels]+[probabilities])
+            sample_indices=numpy.random.choice(len(all_probs), samplesize, p=all_probs/all_probs.sum())
+
+            num_unique_items=len(numpy.unique(sample_indices))
+
+            converged=(prev_entropy is not None) and (numpy.fabs(entropy-prev_entropy)<=tolerance) and (numpy.fabs(tot_sum-1.0)<=tolerance) and (num_unique_items >= int(samplesize/10))
+
+            if(verbose):
+                print("nside ", nside, " evaluated pixels ", len(ipix), " totsum ", tot_sum, " entropy ", entropy, " num unique ", num_unique_items)
+
+            if(converged or nside>=max_nside):
+                break
+
+            ## refine the smallest set of pixels that holds all but *tail_mass* of the probability mass
+            order=numpy.argsort(-probabilities)
+            cumulative_mass=numpy.cumsum(probabilities[order])
+            num_refined=min(numpy.searchsorted(cumulative_mass, (1.0-tail_mass)*cumulative_mass[-1])+1, len(order))
+
+            ## also refine the neighbours, whose mass can be underestimated by the center evaluation if a peak is not resolved yet
+            refined_mask=numpy.zeros(len(ipix), dtype=bool)
+            refined_mask[order[:num_refined]]=True
+
+            neighbours=healpy.get_all_neighbours(nside, ipix[refined_mask], nest=True).flatten()
+            refined_mask|=numpy.isin(ipix, neighbours[neighbours>=0])
+
+            refined=numpy.nonzero(refined_mask)[0]
+            kept=numpy.nonzero(~refined_mask)[0]
+
+            if(len(kept)>0):
+                frozen_pixels.append((nside, ipix[kept], probabilities[kept]))
+                frozen_mass+=probabilities[kept].sum()
+                frozen_entropy+=entropy_terms[kept].sum()
+
+            prev_entropy=entropy
+
+            ipix=(4*ipix[refined][:,None]+numpy.arange(4)[None,:]).flatten()
+            nside=nside*2
+
+            log_pdf=evaluate_pixels(nside, ipix)
+
+        frozen_pixels.append((nside, ipix, probabilities))
+
+        ## pixel centers of the drawn pixels at their respective resolution
+        sample_angles=numpy.zeros((samplesize, 2))
+        offset=0
+
+        for cur_nside, cur_ipix, cur_probs in frozen_pixels:
+            mask=(sample_indices>=offset) & (sample_indices<offset+len(cur_ipix))
+
+            if(mask.sum()>0):
+                theta, phi = healpy.pix2ang(nside=cur_nside, ipix=cur_ipix[sample_indices[mask]-offset], nest=True)
+                sample_angles[mask,0]=theta
+                sample_angles[mask,1]=phi
+
+            offset+=len(cur_ipix)
+
+        samples=torch.from_numpy(sample_angles).to(dtype=dtype, device=device)
+        samples,_=self.transform_target_space(samples, transform_from="intrinsic", transform_to="embedding")
+
+        return entropy, samples
+
     def marginal_moments(self, 
                          conditional_input=None, 
                          samplesize=50, 
@@ -2981,7 +3754,10 @@ class pdf(nn.Module):
                          device=None,
                          verbose=False,
                          s2_entropy_scanning=False,
-                         s2_entropy_scan_nside=32):
+                         s2_entropy_scan_nside=32,
+                         s2_entropy_scan_max_nside=4096,
+                         s2_entropy_scan_tolerance=0.001,
+                         s2_entropy_scan_tail_mass=1e-4):
         """
         Calculate the first and second central moments of the marginal distributions. For Euclidean manifolds it calculates a Gaussian approximation, for spherical distributions calculates
         a von-Mises approximation. Because these are the respective maximum entropy distributions, their entropy should always be larger than the original distribution.
@@ -2998,7 +3774,11 @@ class pdf(nn.Module):
             dtype (torch dtype): If given, uses this dtype. Otherwise uses dtype from parameters.
             device (torch.device): If given, uses this device. Otherwise uses device from parameters.
             verbose (bool): Some extra print statements on runtime.
-            s2_entropy_scanning (bool): Use a healpix scan to determine entropy .. can be faster for certain s2 distributions.
+            s2_entropy_scanning (bool): Use a hierarchical healpix scan to determine entropy (see *_s2_entropy_scan*) .. can be faster for certain s2 distributions.
+            s2_entropy_scan_nside (int): Coarse starting resolution of the healpix scan.
+            s2_entropy_scan_max_nside (int): Maximum resolution of the healpix scan.
+            s2_entropy_scan_tolerance (float): Tolerance on normalization and entropy change that stops the refinement of the healpix scan.
+            s2_entropy_scan_tail_mass (float): Probability mass of the pixels that are not refined further in each step of the healpix scan.
 
         Returns:
 
@@ -3021,135 +3801,6 @@ class pdf(nn.Module):
            
         """
 
-        def random_VMF(mu , kappa , size = None):
-            """
-            Von Mises - Fisher distribution sampler with
-            mean direction mu and co nc en tr at io n kappa .
-            Source : https :// hal . science /hal - 04004568
-            """
-            # parse input parameters
-            n = 1 if size is None else numpy.product( size )
-            shape = () if size is None else tuple( numpy.ravel( size ))
-            mu = numpy.asarray( mu )
-            mu = mu / numpy.linalg.norm( mu )
-            (d ,) = mu.shape
-            # z component : radial samples pe rp en dic ul ar to mu
-            z = numpy.random.normal(0 , 1 , (n , d) )
-            z /= numpy.linalg.norm(z , axis =1 , keepdims = True )
-            z = z - (z @ mu[:, None ]) * mu[None , :]
-            z /= numpy.linalg.norm(z , axis =1 , keepdims = True )
-            # sample angles ( in cos and sin form )
-            cos = _random_VMF_cos(d , kappa , n )
-            sin = numpy.sqrt(1 - cos ** 2)
-            # combine angles with the z component
-            x = z * sin[:, None ] + cos[:, None ] * mu[None , :]
-            return x.reshape((*shape , d ))
-
-        def _random_VMF_cos(d: int , kappa : float , n: int):
-            """
-            Generate n iid samples t with density function given by
-            p(t) = someConstant * (1-t**2) **((d-2)/2) * exp ( kappa *t)
-            """
-            # b = Eq. 4 of https :// doi . org / 10. 1080 / 0 3 6 1 0 9 1 9 4 0 8 8 1 3 1 6 1
-            b = ( d - 1) / (2 * kappa + (4 * kappa ** 2 + ( d - 1) ** 2) ** 0.5)
-            x0 = (1 - b) / ( 1 + b)
-            c = kappa * x0 + ( d - 1) * numpy.log(1 - x0 ** 2)
-            found = 0
-            out = []
-            while found < n:
-                m = min(n , int((n-found)*1.5))
-                z = numpy.random.beta(( d - 1 ) / 2 , (d - 1) / 2 , size =m )
-                t = ( 1 - (1 + b) * z) / (1 - (1 - b) * z)
-                test = kappa * t + (d - 1) * numpy.log(1 - x0 * t) - c
-                accept = test >= -numpy.random.exponential( size =m)
-                out.append(t[ accept ])
-                found += len( out [-1])
-            return numpy.concatenate( out )[:n]
-
-        def get_rotation_matrix(target_vector):
-            # Normalize the target vector
-            
-            if(target_vector[0]==0 and target_vector[1]==0 and target_vector[2]==1.0):
-                return numpy.eye(3)
-            
-            target_vector = numpy.array(target_vector) / numpy.linalg.norm(target_vector)
-            
-            # Define the initial vector (0, 0, 1)
-            initial_vector = numpy.array([0, 0, 1])
-            
-            # Calculate the cross product between the initial and target vectors
-            cross_product = numpy.cross(initial_vector, target_vector)
-            
-            # Calculate the dot product between the initial and target vectors
-            dot_product = numpy.dot(initial_vector, target_vector)
-            
-            # Construct the skew-symmetric matrix
-            skew_symmetric_matrix = numpy.array([[0, -cross_product[2], cross_product[1]],
-                                              [cross_product[2], 0, -cross_product[0]],
-                                              [-cross_product[1], cross_product[0], 0]])
-            
-            # Construct the rotation matrix using Rodrigues' rotation formula
-            rotation_matrix = numpy.identity(3) + skew_symmetric_matrix + numpy.dot(skew_symmetric_matrix, skew_symmetric_matrix) * (1 - dot_product) / (numpy.linalg.norm(cross_product) ** 2)
-            
-            return rotation_matrix
-
-        def uniform_to_w(samples, kappa=1.0):
-
-            w_samples=1.0+(1.0/kappa)*numpy.log(samples+(1.0-samples)*numpy.exp(-2*kappa))
-            return w_samples
-
-        def obtain_fisher_mises_samples(mu, kappa, samplesize):
-
-            uniform_samples=numpy.random.uniform(size=(samplesize,))
-            uniform_samples_2=numpy.random.uniform(size=(samplesize,))
-
-            w_samples=uniform_to_w(uniform_samples,kappa=kappa)
-            
-            circle_samples_x=numpy.cos(uniform_samples_2*2*numpy.pi)
-            circle_samples_y=numpy.sin(uniform_samples_2*2*numpy.pi)
-            
-            pre_fac=numpy.sqrt(1.0-w_samples**2)
-                
-            assert(type(mu)==numpy.ndarray)
-            assert(len(mu)==3)
-            assert(len(mu.shape)==1)
-            
-            rot_matrix=get_rotation_matrix(mu)
-            
-            rot_matrix=numpy.repeat(rot_matrix[None,:,:], samplesize, axis=0)
-            
-            vecs=[ (pre_fac*circle_samples_x)[:,None], (pre_fac*circle_samples_y)[:,None], w_samples[:,None]]
-            vecs=numpy.concatenate(vecs, axis=1)
-                
-            return numpy.einsum("...ij,...j -> ...i", rot_matrix, vecs)
-
-        def newton_iter(arg, p, normed_length_summed_pts):
-            """
-            p is the Euclidean embedding dimension: p=3 -> 2-d sphere, p=2 -> 1-d circle
-            """
-            ## p = 2 -> p/2-1 = 0, p/2 = 1
-            ## p = 3 -> p/2-1 = 0.5, p/2 = 1.5
-
-            if(p==2):
-
-                a_p_k=i1(arg)/i0(arg)
-
-                return arg- ((a_p_k-normed_length_summed_pts)/(1.0-a_p_k**2- (1.0/arg)*a_p_k))
-
-               
-            elif(p==3):
-               
-                #a_p_k=iv(1.5, arg)/iv(0.5, arg)
-                # calculate ratio based on exact formulas from abramovitz & stegun (p.443)
-                a_p_k=-1.0/arg+1.0/numpy.tanh(arg)
-              
-              
-                temp=(a_p_k-normed_length_summed_pts)/(1.0-a_p_k**2- (2.0/arg)*a_p_k)
-               
-                return arg- ( (a_p_k-normed_length_summed_pts)/(1.0-a_p_k**2- (2.0/arg)*a_p_k) )
-
-        
-
         used_dtype, used_device=self.obtain_current_dtype_n_device()
 
         if(device is not None):
@@ -3197,148 +3848,35 @@ class pdf(nn.Module):
                 if(s2_entropy_scanning):
                     assert(self.pdf_defs_list[0]=="s2")
 
-                    ent_vec=[]
-                    samp_vec=[]
-
-                    if(conditional_input is None):
-
-                        nside=s2_entropy_scan_nside
-
-                        tot_sum=0.0
-
-                        diff_tol=0.001
+                    if(len(self.pdf_defs_list)!=1):
+                        raise Exception("S2 entropy scanning requires a pdf with a single s2 sub-pdf.")
+                    if(type(conditional_input)==list):
+                        raise Exception("S2 entropy scanning requires a single conditional input tensor.")
 
-                        is_still_bad=True
+                    scan_inputs=[None] if conditional_input is None else conditional_input
 
-                        MAX_SIZE=100000
-                        while( is_still_bad):
-
-                            nside=nside*2
-
-                            num_pix=healpy.nside2npix(nside)
-
-                            area_per_pixel=4*numpy.pi/num_pix
-
-                            theta, phi = healpy.pix2ang(nside=nside, ipix=numpy.arange(num_pix))
-
-                            target_angles=torch.from_numpy(numpy.concatenate([theta[:,None], phi[:,None]], axis=1))
-                           
-                            target_xyz,_=self.transform_target_space(target_angles, transform_from="intrinsic", transform_to="embedding")
-
-                            final_target=target_xyz.to(conditional_input)
-                            
-                            all_log_pdfs=[]
-
-                            other_iter=0
-                            next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                            
-                            while(len(next_target)>0):
-                                log_pdf,_,_=self.forward(next_target, conditional_input=None, force_embedding_coordinates=True)
-                                log_pdf=log_pdf.cpu().numpy()
-                                all_log_pdfs.append(log_pdf)
-
-                                other_iter+=1
-
-                                next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                                
-                            log_pdf=numpy.concatenate(all_log_pdfs)
-                            pdf_eval=numpy.exp(log_pdf)#numpy.exp(log_pdf)
-
-                            assert(len(pdf_eval)==num_pix), (len(pdf_eval), num_pix)
-                            probabilities=pdf_eval*area_per_pixel
-
-                            tot_sum=probabilities.sum()
-                           
-                            sample_indices=numpy.random.choice(numpy.arange(num_pix), samplesize, p=probabilities/tot_sum)
-
-                            num_unique_items=len(set(sample_indices))
-
-                            is_still_bad = (numpy.fabs(tot_sum-1.0)>diff_tol) | (num_unique_items < int(samplesize/10))
-                            print("nside ", nside," sidelen of pixel :", numpy.sqrt(area_per_pixel)*180.0/numpy.pi)
-                            print("num unique, ",num_unique_items)
-                            print("totsum ", tot_sum)
-                            print("BAD ? ", is_still_bad)
-                    
-                    else:
-
-                        for cur_cinput in conditional_input:
-
-                            nside=s2_entropy_scan_nside
-
-                            tot_sum=0.0
-
-                            diff_tol=0.001
-
-                            is_still_bad=True
-
-                            MAX_SIZE=100000
-                            while( is_still_bad):
-
-                                nside=nside*2
-
-                                num_pix=healpy.nside2npix(nside)
-
-                                area_per_pixel=4*numpy.pi/num_pix
-
-                                theta, phi = healpy.pix2ang(nside=nside, ipix=numpy.arange(num_pix))
-
-                                target_angles=torch.from_numpy(numpy.concatenate([theta[:,None], phi[:,None]], axis=1))
-                               
-                                target_xyz,_=self.transform_target_space(target_angles, transform_from="intrinsic", transform_to="embedding")
-
-                                final_target=target_xyz.to(conditional_input)
-                                final_cinput=cur_cinput[None,:].repeat(num_pix, 1)
-
-                                all_log_pdfs=[]
-
-                                other_iter=0
-                                next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                                next_cinput=final_cinput[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-
-                                while(len(next_target)>0):
-                                    log_pdf,_,_=self.forward(next_target, conditional_input=next_cinput, force_embedding_coordinates=True)
-                                    log_pdf=log_pdf.cpu().numpy()
-                                    all_log_pdfs.append(log_pdf)
-
-                                    other_iter+=1
-
-                                    next_target=final_target[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-                                    next_cinput=final_cinput[MAX_SIZE*other_iter:MAX_SIZE*other_iter+MAX_SIZE]
-
-                                    
-                                
-                                log_pdf=numpy.concatenate(all_log_pdfs)
-                                pdf_eval=numpy.exp(log_pdf)#numpy.exp(log_pdf)
-
-                                assert(len(pdf_eval)==num_pix), (len(pdf_eval), num_pix)
-                                probabilities=pdf_eval*area_per_pixel
-
-                                tot_sum=probabilities.sum()
-                               
-                                sample_indices=numpy.random.choice(numpy.arange(num_pix), samplesize, p=probabilities/tot_sum)
-
-                                num_unique_items=len(set(sample_indices))
-
-                                is_still_bad = (numpy.fabs(tot_sum-1.0)>diff_tol) | (num_unique_items < int(samplesize/10))
-                                print("nside ", nside," sidelen of pixel :", numpy.sqrt(area_per_pixel)*180.0/numpy.pi)
-                                print("num unique, ",num_unique_items)
-                                print("totsum ", tot_sum)
-                                print("BAD ? ", is_still_bad)
-                             
+                    ent_vec=[]
+                    samp_vec=[]
 
-                            theta, phi = healpy.pix2ang(nside=nside, ipix=sample_indices)
+                    for cur_cinput in scan_inputs:
 
-                            this_samples=torch.from_numpy(numpy.concatenate([theta[:,None], phi[:,None]], axis=1))
-                            this_samples,_=self.transform_target_space(this_samples, transform_from="intrinsic", transform_to="embedding")
-                            ent_vec.append((probabilities*(-log_pdf)).sum())
-                           
-                            samp_vec.append(this_samples.to(conditional_input))
+                        this_entropy, this_samples=self._s2_entropy_scan(conditional_input=cur_cinput,
+                                                                         samplesize=samplesize,
+                                                                         nside=s2_entropy_scan_nside,
+                                                                         max_nside=s2_entropy_scan_max_nside,
+                                                                         tolerance=s2_entropy_scan_tolerance,
+                                                                         tail_mass=s2_entropy_scan_tail_mass,
+                                                                         dtype=used_dtype,
+                                                                         device=used_device,
+                                                                         verbose=verbose)
+                        ent_vec.append(this_entropy)
+                        samp_vec.append(this_samples)
 
-                        entropy_dict=dict()
-                        entropy_dict[0]=torch.from_numpy(numpy.array(ent_vec)).to(conditional_input)
-                        entropy_dict["total"]=entropy_dict[0]
+                    entropy_dict=dict()
+                    entropy_dict[0]=torch.from_numpy(numpy.array(ent_vec)).to(dtype=used_dtype, device=used_device)
+                    entropy_dict["total"]=entropy_dict[0]
 
-                        samples=torch.cat(samp_vec, dim=0)
+                    samples=torch.cat(samp_vec, dim=0)
 
 
                 else:
@@ -3475,55 +4013,12 @@ class pdf(nn.Module):
                     elif("2" in sub_pdf_def):
                         p=3
 
-                    last_vec=(normalized_length_R*(p-normalized_length_R**2)/(1-normalized_length_R**2))
-                    
-                    max_iter=20
-        
-                    new_diff=None
-
-                    last_vec_cpu=last_vec.cpu()
-                    cpu_length=normalized_length_R.cpu()
-
-                    for i in range(max_iter):
-
-                        new_vec=newton_iter(last_vec_cpu, p,cpu_length)
-
-                        new_diff=torch.abs(new_vec-last_vec_cpu)
+                    ## batched Newton iterations for the concentration parameter
+                    this_var=estimate_mises_fisher_kappa(normalized_length_R, p, abs_precision=mises_abs_precision)
 
-                        if(new_diff.max()<mises_abs_precision):
-                            last_vec_cpu=new_vec
-                            break
+                    a_p_k=mises_fisher_mean_resultant_length(this_var, p)
+                    log_c_p_k=mises_fisher_log_normalization(this_var, p)
 
-                        last_vec_cpu=new_vec
-                        
-                    ## set back to device before newton iters
-                    this_var=last_vec_cpu
-
-                    if(p==2):
-
-                        c_p_k=(1.0/(2*numpy.pi*i0(this_var))).to(angle_mean)
-                        a_p_k=(i1(this_var)/i0(this_var)).to(angle_mean)
-
-                    elif(p==3):
-
-                        a_p_k=(-1.0/this_var+1.0/numpy.tanh(this_var)).to(angle_mean)
-                        
-                        #c_p_k=(this_var**(0.5)/( (2*numpy.pi)**1.5 * iv(0.5, this_var))).to(angle_mean)
-                        log_c_p_k=torch.zeros_like(a_p_k)
-
-
-
-                        log_c_p_k[this_var>50]=(torch.log(this_var)-numpy.log(2*numpy.pi)-this_var)[this_var>50].to(a_p_k)
-                        log_c_p_k[this_var<=50]=(torch.log(this_var)-numpy.log(2*numpy.pi)-torch.log(torch.exp(this_var)-torch.exp(-this_var)))[this_var<=50].to(a_p_k)
-
-                    
-                        #c_p_k*=1e-5
-                        #a_p_k=(iv(1.5, this_var)/iv(0.5, this_var)).to(angle_mean)
-                        
-
-
-                    this_var=this_var.to(angle_mean)
-                        
                     approx_entropy=(-log_c_p_k-this_var*a_p_k).squeeze(1)
 
                     #print("APPROX ENTORPY", approx_entropy)
@@ -3543,23 +4038,9 @@ class pdf(nn.Module):
                         ## reverse kl divergence
 
                         if(sub_pdf_dim==0):
-                            mises_samples=[]
-                            for cur_ind, cur_mean in enumerate(this_mean):
-                                
-                                #print("MEAN", cur_mean.cpu().numpy())
-                                #print("KAPPA", this_var[cur_ind].cpu().numpy())
-                                ms=obtain_fisher_mises_samples(cur_mean.cpu().numpy() , this_var[cur_ind].cpu().numpy() , samplesize=samplesize)
-                                #print(ms)
-                                lens=numpy.sqrt(numpy.sum(ms**2, axis=1))
-                                #print("LENS", lens)
-                                ## much slower
-                                #ms=random_VMF(cur_mean.cpu().numpy() , this_var[cur_ind].cpu().numpy() , size = samplesize)
-                               
-                                mises_samples.append(torch.from_numpy(ms).type_as(log_probs).to(log_probs))
-
-                            mises_samples=torch.cat(mises_samples, dim=0)
+                            mises_samples=sample_mises_fisher(this_mean, this_var, samplesize).reshape(-1, p)
 
-                            mises_samp_logprob_exact,_,_=self.forward(mises_samples, conditional_input=data_summary_repeated)
+                            mises_samp_logprob_exact,_,_=self.forward(mises_samples, conditional_input=data_summary_repeated, force_embedding_coordinates=True)
                             
                             
                             reverse_cross_entropy=-mises_samp_logprob_exact.reshape(-1, samplesize).mean(dim=1)
@@ -35,7 +35,8 @@ class fully_amortized_pdf(nn.Module):
         amortization_mlp_ranks=5,
         amortization_mlp_highway_mode=0,
         predict_log_normalization=False,
-        skip_mlp_initialization=False
+        skip_mlp_initialization=False,
+        skip_param_initialization=False
     ):  
         """
         A fully amortized PDF, where in contrast to the standard autoregressive conditional PDF, also the whole autoregressive transformation, including MLPs, is amortized.
@@ -64,6 +65,7 @@ class fully_amortized_pdf(nn.Module):
             amortization_mlp_highway_mode (int): The highway mode used for the amortization MLP. See *amortizable_mlp* class for more details.
             predict_log_normalization (bool): Predict log-mean of Poisson distribution.
             skip_mlp_initialization (bool): Indicates, whether to skip MLP inits entirely. Can be used for custom MLP initialization.
+            skip_param_initialization (bool): Lazy construction. Skips *init_params*, for example when a state dict is loaded right after construction.
           
         """
 
@@ -86,7 +88,8 @@ class fully_amortized_pdf(nn.Module):
                                        amortization_mlp_ranks=inner_mlp_ranks,
                                        amortization_mlp_highway_mode=inner_mlp_highway_mode,
                                        amortize_everything=True,
-                                       skip_mlp_initialization=skip_mlp_initialization
+                                       skip_mlp_initialization=skip_mlp_initialization,
+                                       skip_param_initialization=skip_param_initialization
                                        )
 
         # mirror some attributes
@@ -137,7 +140,7 @@ class fully_amortized_pdf(nn.Module):
 
         assert(predict_log_normalization == False), "TODO: Still need to implement log normalization prediction here."
 
-        if(skip_mlp_initialization==False):
+        if(skip_mlp_initialization==False and skip_param_initialization==False):
             self.init_params()
 
 
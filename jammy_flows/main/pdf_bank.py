@@ -0,0 +1,210 @@
+import copy
+
+import torch
+from torch import nn
+
+from . import default
+from .. import amortizable_mlp
+
+def _layer_parameter_vector(layer):
+    """
+    Flat parameter vector of a layer with permanent parameters, ordered like the parameters the layer takes as *extra_inputs* (and in *init_params*).
+    *init_params* copies (reshaped) slices of the vector into the parameters, so initializing a copy of the layer with the vector of indices reveals
+    the position of every parameter value in the vector. Internal MLPs are only partially initialized from the vector (e.g. their final bias),
+    but take their parameters as one contiguous block of *extra_inputs*, which is located by the partially copied indices.
+    The result is validated by initializing the copy with it.
+
+    Parameters:
+        layer (layer_base): Layer with permanent parameters.
+
+    Returns: Tensor of shape (total_param_num,), float64
+    """
+    num_params=layer.get_total_param_num()
+
+    if(num_params==0):
+        return torch.zeros(0, dtype=torch.float64)
+
+    probe=copy.deepcopy(layer)
+    probe.init_params(torch.arange(num_params, dtype=torch.float64))
+
+    vector=torch.zeros(num_params, dtype=torch.float64)
+    copied_masks=[]
+
+    for probe_param, param in zip(probe.parameters(), layer.parameters()):
+
+        indices=probe_param.detach().reshape(-1).to(torch.float64)
+        values=param.detach().reshape(-1).to(torch.float64)
+
+        if(len(indices)!=len(values)):
+            raise Exception("Parameters of layer ", type(layer).__name__, " change their size in *init_params*. They can not be mapped to amortization parameters.")
+
+        copied=(indices==indices.round()) & (indices>=0) & (indices<num_params)
+        copied_masks.append(copied)
+
+        if(copied.all()):
+            vector[indices.long()]=values
+
+        elif(copied.any()):
+            ## partially copied block (MLP) .. all copied entries must share the same offset into the vector
+            block_offsets=indices[copied].long()-torch.arange(len(indices))[copied]
+            block_start=int(block_offsets[0])
+
+            if(not (block_offsets==block_start).all() or block_start<0 or block_start+len(values)>num_params):
+                raise Exception("Parameters of layer ", type(layer).__name__, " are not initialized from a contiguous block of the parameter vector. They can not be mapped to amortization parameters.")
+
+            vector[block_start:block_start+len(values)]=values
+
+    probe.init_params(vector.clone())
+
+    for probe_param, param, copied in zip(probe.parameters(), layer.parameters(), copied_masks):
+        if(not torch.equal(probe_param.detach().reshape(-1).to(torch.float64)[copied], param.detach().reshape(-1).to(torch.float64)[copied])):
+            raise Exception("Parameters of layer ", type(layer).__name__, " can not be mapped to amortization parameters, since *init_params* does not copy them from the parameter vector.")
+
+    return vector
+
+def _amortization_vector(pdf):
+    """
+    All parameters of an unconditional pdf as a single vector, in the order of the *amortization_parameters* of the corresponding fully amortized pdf:
+    the layer parameters of the first sub-pdf, followed by the parameters of the MLPs of the other sub-pdfs.
+    """
+    vectors=[]
+
+    for pdf_index, layers in enumerate(pdf.layer_list):
+
+        if(pdf_index==0):
+            vectors.extend([_layer_parameter_vector(layer) for layer in layers])
+
+        elif(pdf.mlp_predictors[pdf_index] is not None):
+            vectors.append(pdf.mlp_predictors[pdf_index].u_v_b_pars.detach().reshape(-1).to(torch.float64))
+
+    return torch.cat(vectors)
+
+class pdf_bank(nn.Module):
+
+    def __init__(self, pdfs):
+        """
+        Bank of N structurally identical, unconditional pdfs that are evaluated and sampled in one batched call. The parameters of all pdfs are stacked
+        along a leading model dimension in *parameter_bank* (N, T). A single fully amortized pdf (*amortize_everything*) with the same structure evaluates every
+        row with the parameters of its model, passed as *amortization_parameters*. Accessed via *jammy_flows.pdf_bank*.
+
+        The bank holds copies of the parameters. Changes of the original pdfs are not reflected, and the bank parameters can be trained directly.
+
+        Parameters:
+            pdfs (list(jammy_flows.pdf)): Unconditional pdfs with identical definitions and options. Sub-pdfs after the first must use custom MLPs
+                                          (*amortization_mlp_use_custom_mode*), since only those can be amortized.
+        """
+        super().__init__()
+
+        if(len(pdfs)==0):
+            raise Exception("A pdf bank requires at least one pdf.")
+
+        reference=pdfs[0]
+
+        if(reference.conditional_input_dim is not None):
+            raise Exception("A pdf bank requires unconditional pdfs.")
+        if(reference.amortize_everything or reference.use_as_passthrough_instead_of_pdf or reference.predict_log_normalization):
+            raise Exception("A pdf bank requires pdfs with permanent parameters, without log-normalization prediction, that are not used as passthrough modules.")
+        if(reference.skip_mlp_initialization):
+            raise Exception("A pdf bank requires pdfs with initialized MLPs.")
+
+        for mlp_predictor in reference.mlp_predictors:
+            if(mlp_predictor is not None and type(mlp_predictor)!=amortizable_mlp.AmortizableMLP):
+                raise Exception("Sub-pdfs of a pdf bank must use custom MLPs (amortization_mlp_use_custom_mode=True), since only those can be amortized.")
+
+        embedding_flags=[[bool(layer.always_parametrize_in_embedding_space) for layer in ll] for ll in reference.layer_list]
+
+        for this_pdf in pdfs[1:]:
+            this_embedding_flags=[[bool(layer.always_parametrize_in_embedding_space) for layer in ll] for ll in this_pdf.layer_list]
+
+            if(this_pdf.model_definition!=reference.model_definition or this_pdf.flow_opts!=reference.flow_opts or this_embedding_flags!=embedding_flags):
+                raise Exception("All pdfs of a pdf bank must have identical definitions, options and embedding flags.")
+
+        ## the same structure, amortized .. custom MLPs are required for full amortization (the first sub-pdf has none)
+        model_definition=dict(reference.model_definition)
+        model_definition["amortize_everything"]=True
+        model_definition["amortization_mlp_use_custom_mode"]=True
+
+        self.bank_pdf=default.pdf(options_overwrite=default._options_overwrite_from_flow_opts(model_definition["flow_defs"], reference.flow_opts),
+                                  skip_param_initialization=True,
+                                  **model_definition)
+
+        for ll, flags in zip(self.bank_pdf.layer_list, embedding_flags):
+            for layer, flag in zip(ll, flags):
+                layer.always_parametrize_in_embedding_space=flag
+
+        self.bank_pdf.update_embedding_structure()
+
+        self.num_models=len(pdfs)
+
+        dtype, _=reference.obtain_current_dtype_n_device()
+
+        self.parameter_bank=nn.Parameter(torch.stack([_amortization_vector(this_pdf) for this_pdf in pdfs]).to(dtype))
+
+        assert(self.parameter_bank.shape[1]==self.bank_pdf.total_number_amortizable_params), (self.parameter_bank.shape[1], self.bank_pdf.total_number_amortizable_params)
+
+        # mirror some attributes
+        for name in ["pdf_defs_list", "flow_defs_list", "total_target_dim", "target_dim_indices_intrinsic", "target_dim_indices_embedded", "target_dim_indices", "base_dim_indices"]:
+            setattr(self, name, getattr(self.bank_pdf, name))
+
+    def forward(self,
+                x,
+                model_index,
+                force_embedding_coordinates=False,
+                force_intrinsic_coordinates=False):
+        """
+        Calculates the log-probability of every row of *x* under the pdf given by *model_index* of the same row.
+
+        Parameters:
+            x (Tensor): Target position, shape (B,D).
+            model_index (LongTensor): Index of the pdf in the bank for every row, shape (B,).
+            force_embedding_coordinates (bool): Enforces embedding coordinates in the input *x*.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates in the input *x*.
+
+        Returns:
+
+            Tensor
+                Log-probability, shape = (B,)
+            Tensor
+                Log-probability at base distribution, shape = (B,)
+            Tensor
+                Position at base distribution, shape = (B,D)
+        """
+        assert(x.shape[0]==model_index.shape[0]), "Require one model index per row."
+
+        return self.bank_pdf(x,
+                             amortization_parameters=self.parameter_bank[model_index],
+                             force_embedding_coordinates=force_embedding_coordinates,
+                             force_intrinsic_coordinates=force_intrinsic_coordinates)
+
+    def sample(self,
+               model_index,
+               seed=None,
+               allow_gradients=False,
+               force_embedding_coordinates=False,
+               force_intrinsic_coordinates=False):
+        """
+        Draws one sample per entry of *model_index* from the respective pdf.
+
+        Parameters:
+            model_index (LongTensor): Index of the pdf in the bank for every sample, shape (B,).
+            seed (None/int):
+            allow_gradients (bool): If False, does not propagate gradients and saves memory by not building the graph.
+            force_embedding_coordinates (bool): Enforces embedding coordinates for the sample.
+            force_intrinsic_coordinates (bool): Enforces intrinsic coordinates for the sample.
+
+        Returns:
+
+            Tensor
+                Sample in target space.
+            Tensor
+                Sample in base space.
+            Tensor
+                Log-pdf evaluation in target space
+            Tensor
+                Log-pdf evaluation in base space
+        """
+        return self.bank_pdf.sample(amortization_parameters=self.parameter_bank[model_index],
+                                    seed=seed,
+                                    allow_gradients=allow_gradients,
+                                    force_embedding_coordinates=force_embedding_coordinates,
+                                    force_intrinsic_coordinates=force_intrinsic_coordinates)
@@ -0,0 +1,123 @@
+import torch
+import functools
+
+## numerical tolerances per floating point type
+## newton_atol/newton_rtol: Newton convergence of the bisection+Newton solvers, |update| < atol + rtol*|x|
+## sphere_newton_tolerance: step size at which the sphere Newton solvers stop
+## target_residual: residual |f(x)-y| below which a solver call counts as converged
+## small_kappa: concentration below which vMF-type transformations are replaced by the identity
+## boundary_eps: distance kept from open interval boundaries to avoid infinities
+_TOLERANCES={
+    torch.float64: dict(newton_atol=1e-14,
+                        newton_rtol=0.0,
+                        sphere_newton_tolerance=1e-12,
+                        target_residual=1e-7,
+                        small_kappa=1e-8,
+                        boundary_eps=1e-8),
+    torch.float32: dict(newton_atol=1e-6,
+                        newton_rtol=1e-6,
+                        sphere_newton_tolerance=1e-6,
+                        target_residual=1e-4,
+                        small_kappa=1e-4,
+                        boundary_eps=1e-5)
+}
+
+## promote numerically sensitive computations (icdf approximations, vMF kappa handling, log-det accumulation) of lower-precision models to float64
+_use_float64_islands=True
+
+def tolerance(name, dtype):
+    """
+    Dtype-aware numerical tolerance.
+
+    Parameters:
+
+        name (str): One of "newton_atol", "newton_rtol", "sphere_newton_tolerance", "target_residual", "small_kappa" or "boundary_eps".
+        dtype (torch.dtype): Floating point type of the computation.
+
+    Returns:
+
+        float
+    """
+    if(dtype not in _TOLERANCES):
+        raise Exception("Require 32 or 64 bit float, got ", dtype)
+
+    if(name not in _TOLERANCES[dtype]):
+        raise Exception("Unknown tolerance ", name, " .. available: ", list(_TOLERANCES[dtype].keys()))
+
+    return _TOLERANCES[dtype][name]
+
+def set_float64_islands(use_islands):
+    """
+    Globally enables or disables float64 islands. If enabled (the default), float32 models run their numerically sensitive parts
+    (see *float64_island*) in float64 and accumulate log-determinants in float64. Disabling them runs everything in the model dtype.
+    """
+    global _use_float64_islands
+    _use_float64_islands=bool(use_islands)
+
+def float64_islands_enabled():
+    return _use_float64_islands
+
+def use_float64_island(dtype):
+    """
+    True if a computation in *dtype* should be promoted to float64.
+    """
+    return _use_float64_islands and dtype.is_floating_point and dtype!=torch.float64
+
+def accumulation_dtype(dtype):
+    """
+    Dtype in which log-determinants of a model in *dtype* are accumulated.
+    """
+    if(use_float64_island(dtype)):
+        return torch.float64
+
+    return dtype
+
+def float64_island(fn=None, condition=None):
+    """
+    Decorator that evaluates *fn* in float64 if its first floating point tensor argument has lower precision and islands are enabled.
+    All floating point tensor arguments are promoted, and all floating point tensor outputs (also inside tuples/lists) are cast back.
+    Gradients flow through the casts. Can be used as *@float64_island* or *@float64_island(condition=...)*.
+
+    Parameters:
+
+        fn (function): The function to wrap.
+        condition (function): Optional function that receives the first positional argument (e.g. *self* of a method) and returns
+                              False if the island should be skipped.
+    """
+    if(fn is None):
+        return functools.partial(float64_island, condition=condition)
+
+    @functools.wraps(fn)
+    def wrapped_fn(*args, **kwargs):
+
+        orig_dtype=None
+        for arg in list(args)+list(kwargs.values()):
+            if(torch.is_tensor(arg) and arg.is_floating_point()):
+                orig_dtype=arg.dtype
+                break
+
+        if(orig_dtype is None or not use_float64_island(orig_dtype)):
+            return fn(*args, **kwargs)
+
+        if(condition is not None and not condition(args[0])):
+            return fn(*args, **kwargs)
+
+        args=[_cast_floating(arg, torch.float64) for arg in args]
+        kwargs=dict([(k, _cast_floating(v, torch.float64)) for k,v in kwargs.items()])
+
+        return _cast_floating(fn(*args, **kwargs), orig_dtype)
+
+    return wrapped_fn
+
+def _cast_floating(obj, dtype):
+
+    if(torch.is_tensor(obj)):
+        if(obj.is_floating_point()):
+            return obj.to(dtype)
+        return obj
+    elif(type(obj)==tuple):
+        return tuple([_cast_floating(o, dtype) for o in obj])
+    elif(type(obj)==list):
+        return [_cast_floating(o, dtype) for o in obj]
+
+    return obj
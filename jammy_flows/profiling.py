@@ -0,0 +1,365 @@
+import torch
+import time
+import json
+import collections
+
+## the profiler that currently records events, None if profiling is disabled
+active_profiler=None
+
+def record_solver_call(telemetry):
+    """
+    Reports the convergence telemetry of a root-finding solver call (see *jammy_flows.layers.bisection_n_newton.solver_telemetry*) to the active profiler. 
+    Callers check *active_profiler is not None* before collecting telemetry, so disabled profiling costs a single attribute lookup.
+
+    Parameters:
+
+        telemetry (solver_telemetry): Diagnostics of the solver call.
+    """
+    if(active_profiler is None):
+        return
+
+    active_profiler._add_solver_call(telemetry)
+
+def _tensor_bytes(obj):
+    """
+    Bytes held by all tensors in a (nested) list/tuple/dict.
+    """
+    if(torch.is_tensor(obj)):
+        return obj.numel()*obj.element_size()
+    elif(type(obj)==list or type(obj)==tuple):
+        return sum([_tensor_bytes(o) for o in obj])
+    elif(type(obj)==dict):
+        return sum([_tensor_bytes(o) for o in obj.values()])
+
+    return 0
+
+def _batch_size(obj):
+    """
+    Batch size of the first tensor found in a (nested) list/tuple.
+    """
+    if(torch.is_tensor(obj)):
+        if(obj.dim()==0):
+            return None
+        return obj.shape[0]
+    elif(type(obj)==list or type(obj)==tuple):
+        for o in obj:
+            bs=_batch_size(o)
+            if(bs is not None):
+                return bs
+
+    return None
+
+class pdf_profiler(object):
+    """
+    Profiling context of a *pdf* (see *pdf.profile*). While the context is active, *forward*, *sample*, every layer's *flow_mapping*/*inv_flow_mapping*
+    and every *mlp_predictors* call are wrapped and their wall time, call counts, batch sizes and output tensor bytes are recorded.
+    Optionally, the net allocated CUDA memory (allocator statistics) and the net allocated CPU memory (memory events of *torch.profiler*) of every call are recorded.
+    Root-finding solvers report their iteration counts, which are attributed to all running (nested) calls.
+    The wrappers are instance attributes that are removed when the context is left, so a pdf that is not profiled runs the unmodified code.
+    """
+    def __init__(self, pdf, synchronize_cuda=True, record_cuda_memory=True, record_cpu_memory=False):
+        """
+        Parameters:
+
+            pdf (jammy_flows.pdf): The pdf to profile.
+            synchronize_cuda (bool): Synchronize CUDA before and after every wrapped call. Required for meaningful wall times on GPUs.
+            record_cuda_memory (bool): Record the change of allocated CUDA memory during every wrapped call.
+            record_cpu_memory (bool): Record the change of allocated CPU tensor memory during every wrapped call. Runs *torch.profiler* with memory 
+                                      profiling while the context is active, which slows down all calls.
+        """
+        self.pdf=pdf
+        self.synchronize_cuda=synchronize_cuda and torch.cuda.is_available()
+        self.record_cuda_memory=record_cuda_memory and torch.cuda.is_available()
+        self.record_cpu_memory=record_cpu_memory
+        self.torch_profiler=None
+
+        self.events=[]
+        self.call_stack=[]
+        self.wrapped_objects=[]
+        self.start_time=None
+        self.end_time=None
+
+    def __enter__(self):
+        global active_profiler
+
+        if(active_profiler is not None):
+            raise Exception("Another profiling context is already active.")
+
+        self.events=[]
+        self.call_stack=[]
+
+        self._wrap(self.pdf, "forward", "pdf/forward", "pdf")
+        self._wrap(self.pdf, "sample", "pdf/sample", "pdf")
+
+        for pdf_index, layer_list in enumerate(self.pdf.layer_list):
+            for layer_index, layer in enumerate(layer_list):
+
+                layer_name="pdf_%d/layer_%d_%s" % (pdf_index, layer_index, type(layer).__name__)
+
+                self._wrap(layer, "flow_mapping", layer_name+"/flow_mapping", "flow", pdf_index=pdf_index, layer_index=layer_index, layer=layer)
+                self._wrap(layer, "inv_flow_mapping", layer_name+"/inv_flow_mapping", "flow", pdf_index=pdf_index, layer_index=layer_index, layer=layer)
+
+            if(pdf_index<len(self.pdf.mlp_predictors) and self.pdf.mlp_predictors[pdf_index] is not None):
+                self._wrap(self.pdf.mlp_predictors[pdf_index], "forward", "pdf_%d/mlp_predictor" % pdf_index, "mlp", pdf_index=pdf_index)
+
+        if(self.record_cpu_memory):
+            self.num_profiler_ranges=0
+            self.torch_profiler=torch.profiler.profile(activities=[torch.profiler.ProfilerActivity.CPU], profile_memory=True)
+            self.torch_profiler.__enter__()
+
+        active_profiler=self
+        self.start_time=time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        global active_profiler
+
+        self.end_time=time.perf_counter()
+        active_profiler=None
+
+        if(self.torch_profiler is not None):
+            self.torch_profiler.__exit__(exc_type, exc_value, traceback)
+            self._add_cpu_memory()
+            self.torch_profiler=None
+
+        ## removing the instance attributes restores the class methods
+        for obj, attr_name in self.wrapped_objects:
+            delattr(obj, attr_name)
+
+        self.wrapped_objects=[]
+        self.call_stack=[]
+
+        return False
+
+    def _wrap(self, obj, attr_name, event_name, category, pdf_index=None, layer_index=None, layer=None):
+
+        original_fn=getattr(obj, attr_name)
+
+        def wrapped_fn(*args, **kwargs):
+
+            event=collections.OrderedDict()
+            event["name"]=event_name
+            event["category"]=category
+            event["pdf_index"]=pdf_index
+            event["layer_index"]=layer_index
+            event["batch_size"]=_batch_size(list(args)+list(kwargs.values()))
+            event["solver_calls"]=0
+            event["bisection_iterations"]=0
+            event["newton_iterations"]=0
+            event["num_non_converged"]=0
+            event["depth"]=len(self.call_stack)
+
+            if(self.synchronize_cuda):
+                torch.cuda.synchronize()
+            if(self.record_cuda_memory):
+                memory_before=torch.cuda.memory_allocated()
+
+            self.call_stack.append(event)
+            event["start"]=time.perf_counter()
+
+            try:
+                if(self.torch_profiler is not None):
+                    ## unique range name, so the memory events can be matched to this call when the context is left
+                    event["profiler_range"]="%s#%d" % (event_name, self.num_profiler_ranges)
+                    self.num_profiler_ranges+=1
+                    with torch.profiler.record_function(event["profiler_range"]):
+                        result=original_fn(*args, **kwargs)
+                else:
+                    result=original_fn(*args, **kwargs)
+            finally:
+                if(self.synchronize_cuda):
+                    torch.cuda.synchronize()
+
+                event["duration"]=time.perf_counter()-event["start"]
+                self.call_stack.pop()
+
+            if(self.record_cuda_memory):
+                event["cuda_allocated_bytes"]=torch.cuda.memory_allocated()-memory_before
+
+            event["output_bytes"]=_tensor_bytes(result)
+
+            ## ODE-based layers count their function evaluations
+            if(layer is not None and hasattr(layer, "num_evals")):
+                event["ode_evaluations"]=layer.num_evals()
+
+            self.events.append(event)
+
+            return result
+
+        setattr(obj, attr_name, wrapped_fn)
+        self.wrapped_objects.append((obj, attr_name))
+
+    def _add_cpu_memory(self):
+        """
+        Adds the net allocated CPU memory of every wrapped call (including nested calls) from the memory events of *torch.profiler*.
+        """
+        range_memory=dict()
+
+        for function_event in self.torch_profiler.events():
+            range_memory[function_event.name]=function_event.cpu_memory_usage
+
+        for event in self.events:
+            if("profiler_range" in event):
+                event["cpu_allocated_bytes"]=range_memory.get(event.pop("profiler_range"), 0)
+
+    def _add_solver_call(self, telemetry):
+
+        event=collections.OrderedDict()
+        event["name"]="solver/"+telemetry.solver_name
+        event["category"]="solver"
+        event["pdf_index"]=None
+        event["layer_index"]=None
+        event["batch_size"]=telemetry.batch_size
+        event["solver_calls"]=1
+        event["bisection_iterations"]=telemetry.bisection_iterations
+        event["newton_iterations"]=telemetry.newton_iterations
+        event["num_non_converged"]=telemetry.num_non_converged
+        event["depth"]=len(self.call_stack)
+        event["start"]=time.perf_counter()
+        event["duration"]=0.0
+        event["output_bytes"]=0
+        event["telemetry"]=telemetry.to_dict()
+
+        ## attribute the iterations to all running calls
+        for running_event in self.call_stack:
+            running_event["solver_calls"]+=1
+            running_event["bisection_iterations"]+=telemetry.bisection_iterations
+            running_event["newton_iterations"]+=telemetry.newton_iterations
+            running_event["num_non_converged"]+=telemetry.num_non_converged
+
+        self.events.append(event)
+
+    def report(self):
+        """
+        Aggregates the recorded events by name.
+
+        Returns:
+
+            Dictionary with the total profiled wall time ("total_time") and per-name statistics ("entries"): call counts, total/mean/max wall time,
+            batch sizes, bytes of the returned tensors ("output_bytes"), summed net changes of allocated CUDA memory ("cuda_allocated_bytes", only on GPUs 
+            with *record_cuda_memory*) and CPU memory ("cpu_allocated_bytes", only with *record_cpu_memory*), and solver iteration counts. Solver iteration counts of a call include all nested solver calls.
+            Solver entries additionally hold the summed residual histograms, non-finite counts and the maximum number of Newton iterations used.
+        """
+        entries=collections.OrderedDict()
+
+        for event in sorted(self.events, key=lambda ev: ev["start"]):
+
+            if(event["name"] not in entries):
+                entry=collections.OrderedDict()
+                entry["category"]=event["category"]
+                entry["pdf_index"]=event["pdf_index"]
+                entry["layer_index"]=event["layer_index"]
+                entry["calls"]=0
+                entry["total_time"]=0.0
+                entry["mean_time"]=0.0
+                entry["max_time"]=0.0
+                entry["total_batch_items"]=0
+                entry["min_batch_size"]=None
+                entry["max_batch_size"]=None
+                entry["output_bytes"]=0
+                entry["solver_calls"]=0
+                entry["bisection_iterations"]=0
+                entry["newton_iterations"]=0
+                entry["num_non_converged"]=0
+
+                entries[event["name"]]=entry
+
+            entry=entries[event["name"]]
+
+            entry["calls"]+=1
+            entry["total_time"]+=event["duration"]
+            entry["max_time"]=max(entry["max_time"], event["duration"])
+            entry["mean_time"]=entry["total_time"]/entry["calls"]
+
+            if(event["batch_size"] is not None):
+                entry["total_batch_items"]+=event["batch_size"]
+                entry["min_batch_size"]=event["batch_size"] if entry["min_batch_size"] is None else min(entry["min_batch_size"], event["batch_size"])
+                entry["max_batch_size"]=event["batch_size"] if entry["max_batch_size"] is None else max(entry["max_batch_size"], event["batch_size"])
+
+            entry["output_bytes"]+=event["output_bytes"]
+
+            for key in ["solver_calls", "bisection_iterations", "newton_iterations", "num_non_converged"]:
+                entry[key]+=event[key]
+
+            for key in ["cuda_allocated_bytes", "cpu_allocated_bytes", "ode_evaluations"]:
+                if(key in event):
+                    entry[key]=entry.get(key, 0)+event[key]
+
+            if("telemetry" in event):
+                telemetry=event["telemetry"]
+
+                entry["num_non_finite"]=entry.get("num_non_finite", 0)+telemetry["num_non_finite"]
+                entry["max_newton_iterations_used"]=max(entry.get("max_newton_iterations_used", 0), telemetry["newton_iterations"])
+
+                if(telemetry["residual_histogram"] is not None):
+                    entry["residual_bin_edges"]=telemetry["residual_bin_edges"]
+                    if("residual_histogram" not in entry):
+                        entry["residual_histogram"]=[0]*len(telemetry["residual_histogram"])
+                    entry["residual_histogram"]=[a+b for a,b in zip(entry["residual_histogram"], telemetry["residual_histogram"])]
+
+        total_time=None
+        if(self.start_time is not None and self.end_time is not None):
+            total_time=self.end_time-self.start_time
+
+        return dict(total_time=total_time, entries=entries)
+
+    def summary(self, sort_by="total_time"):
+        """
+        Human-readable table of *report*, sorted by *sort_by* (any numeric entry key).
+        """
+        rep=self.report()
+
+        lines=["%-60s %8s %12s %12s %12s %10s" % ("name", "calls", "total [ms]", "mean [ms]", "batch items", "newton it")]
+
+        for name, entry in sorted(rep["entries"].items(), key=lambda item: -item[1][sort_by]):
+            lines.append("%-60s %8d %12.3f %12.3f %12d %10d" % (name, entry["calls"], entry["total_time"]*1e3, entry["mean_time"]*1e3, entry["total_batch_items"], entry["newton_iterations"]))
+
+        if(rep["total_time"] is not None):
+            lines.append("total profiled time: %.3f ms" % (rep["total_time"]*1e3))
+
+        return "\n".join(lines)
+
+    def chrome_trace(self):
+        """
+        Recorded events in the Chrome trace event format (load in chrome://tracing or Perfetto). Nesting is given by the time stamps.
+
+        Returns:
+
+            Dictionary with a "traceEvents" list.
+        """
+        trace_events=[]
+
+        reference_time=self.start_time
+        if(reference_time is None):
+            reference_time=min([ev["start"] for ev in self.events]) if len(self.events)>0 else 0.0
+
+        for event in self.events:
+
+            args=dict([(k,v) for k,v in event.items() if k not in ["name", "category", "start", "duration", "depth"]])
+
+            trace_event=dict(name=event["name"],
+                             cat=event["category"],
+                             ph="X",
+                             ts=(event["start"]-reference_time)*1e6,
+                             dur=event["duration"]*1e6,
+                             pid=0,
+                             tid=0,
+                             args=args)
+
+            ## solver calls are instantaneous
+            if(event["category"]=="solver"):
+                trace_event["ph"]="i"
+                trace_event["s"]="t"
+                del trace_event["dur"]
+
+            trace_events.append(trace_event)
+
+        return dict(traceEvents=trace_events, displayTimeUnit="ms")
+
+    def export_chrome_trace(self, filename):
+        """
+        Writes *chrome_trace* as a JSON file.
+        """
+        with open(filename, "w") as f:
+            json.dump(self.chrome_trace(), f)
@@ -22,7 +22,7 @@ VERSION = '1.0.0'
 
 # What packages are required for this module to be executed?
 REQUIRED = [
-     "torch>=1.7" , "numpy>=1.18.5" , "scipy>=1.5.4", "matplotlib>=3.3.3", "torchdiffeq>=0.2.1", "healpy"
+     "torch>=1.11" , "numpy>=1.18.5" , "scipy>=1.5.4", "matplotlib>=3.3.3", "torchdiffeq>=0.2.1", "healpy"
 ]
 
 # What packages are optional?
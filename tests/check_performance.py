@@ -1,43 +1,439 @@
-import unittest
+"""
+Benchmark harness over all flow layers in *flow_options.opts_dict*.
+
+Run a benchmark and store it as JSON:
+
+    python check_performance.py run -output current.json
+
+Compare against a baseline (exit code 1 if any throughput dropped or peak memory grew by more than the tolerances):
+
+    python check_performance.py compare -current current.json -baseline baseline.json -tolerance 0.1 -memory_tolerance 0.1
+
+On the CPU, every configuration runs in a fresh process, so its peak memory is not inherited from earlier configurations.
+"""
+
 import sys
 import os
 import torch
 import numpy
-import pylab
-import torch.autograd.functional
 import time
+import json
+import copy
+import argparse
+import platform
+import subprocess
+import resource
+import multiprocessing
+import concurrent.futures
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-
 import jammy_flows.main.default as f
+from jammy_flows.flow_options import opts_dict
+
+ALL_MEASUREMENTS=["forward", "sample", "backward", "entropy", "init_params"]
+
+## manifold dimensions a layer type is benchmarked in
+DEFAULT_DIMENSIONS=dict(e=[1,3], s=[1,2], i=[1], a=[1,2])
+
+## sphere layers that only exist for one dimension
+SPHERE_LAYER_DIMENSIONS=dict(m=[1], o=[1], n=[2], v=[2], c=[2], f=[2])
+
+## option variants that are benchmarked in addition to the defaults
+OPTION_VARIANTS=dict()
+OPTION_VARIANTS["g"]=[dict(inverse_function_type=ift) for ift in ["inormal_partly_precise", "inormal_full_pade", "inormal_partly_crude"]]
+OPTION_VARIANTS["m"]=[dict(inverse_mode="tabulated")]
+OPTION_VARIANTS["c"]=[dict(fixed_step_inference=1, solver="rk4")]
+
+def manifold_strings(layer_type, flow_abbreviation, dimensions=None):
+    """
+    PDF definition strings a layer is benchmarked on.
+    """
+    dims=DEFAULT_DIMENSIONS[layer_type] if dimensions is None else dimensions
+
+    if(layer_type=="s" and flow_abbreviation in SPHERE_LAYER_DIMENSIONS.keys()):
+        dims=[d for d in dims if d in SPHERE_LAYER_DIMENSIONS[flow_abbreviation]]
+    if(layer_type=="i"):
+        ## interval flows are 1-dimensional
+        return ["i1_-1.0_1.0"]
+    if(layer_type=="s"):
+        dims=[d for d in dims if d in [1,2]]
+
+    return ["%s%d" % (layer_type, d) for d in dims]
+
+def _synchronize(device):
+    if(device.type=="cuda"):
+        torch.cuda.synchronize()
+
+def _time_fn(fn, device, repeats):
+    """
+    Median wall time of *fn* after one warmup call.
+    """
+    fn()
+    _synchronize(device)
+
+    times=[]
+    for _ in range(repeats):
+        tbef=time.perf_counter()
+        fn()
+        _synchronize(device)
+        times.append(time.perf_counter()-tbef)
+
+    return float(numpy.median(times))
+
+def _max_rss_bytes():
+    """
+    High water mark of the resident memory of this process (kilobytes on linux, bytes on macos).
+    """
+    max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return int(max_rss if sys.platform=="darwin" else max_rss*1024)
+
+def benchmark_config(pdf_def, flow_def, options, batch_size, dtype, conditional, measurements, device, repeats=3, seed=1):
+    """
+    Benchmarks a single configuration.
+
+    Peak memory (*peak_memory_bytes*) is the maximum allocated CUDA memory on GPUs. On the CPU it is the growth of the resident memory high water mark 
+    of the process during the configuration (model, data and all measurements), which is only meaningful if the configuration runs in a fresh 
+    process (see *benchmark_config_in_subprocess*).
+
+    Returns:
+
+        dict
+            Throughput (items per second) and median time of every measurement, and peak memory.
+    """
+    max_rss_before=_max_rss_bytes()
+
+    torch.manual_seed(seed)
+
+    conditional_input_dim=2 if conditional else None
+
+    options_overwrite=dict()
+    if(len(options)>0):
+        options_overwrite[flow_def[0]]=copy.deepcopy(options)
+
+    model=f.pdf(pdf_def, flow_def, options_overwrite=options_overwrite, conditional_input_dim=conditional_input_dim)
+    model.to(device=device, dtype=dtype)
+
+    conditional_input=None
+    if(conditional):
+        conditional_input=torch.randn(batch_size, conditional_input_dim, dtype=dtype, device=device)
+
+    with torch.no_grad():
+        samples,_,_,_=model.sample(samplesize=batch_size, conditional_input=conditional_input, seed=seed, dtype=dtype, device=device)
+
+    if(device.type=="cuda"):
+        torch.cuda.reset_peak_memory_stats(device)
+
+    result=dict()
+    result["measurements"]=dict()
+
+    has_parameters=len([p for p in model.parameters() if p.requires_grad])>0
+
+    for measurement in measurements:
+
+        if(measurement=="backward" and has_parameters==False):
+            result["measurements"][measurement]=dict(status="skipped")
+            continue
+
+        if(measurement=="forward"):
+            def fn():
+                with torch.no_grad():
+                    model(samples, conditional_input=conditional_input)
+        elif(measurement=="sample"):
+            def fn():
+                with torch.no_grad():
+                    model.sample(samplesize=batch_size, conditional_input=conditional_input, dtype=dtype, device=device)
+        elif(measurement=="backward"):
+            def fn():
+                model.zero_grad()
+                log_pdf,_,_=model(samples, conditional_input=conditional_input)
+                (-log_pdf.mean()).backward()
+        elif(measurement=="entropy"):
+            if(conditional):
+                ## entropy is defined per conditional input, use a single one
+                def fn():
+                    with torch.no_grad():
+                        model.entropy(conditional_input=conditional_input[:1], samplesize=batch_size, dtype=dtype, device=device)
+            else:
+                def fn():
+                    with torch.no_grad():
+                        model.entropy(samplesize=batch_size, dtype=dtype, device=device)
+        elif(measurement=="init_params"):
+            def fn():
+                model.init_params(data=samples)
+        else:
+            raise Exception("Unknown measurement %s" % measurement)
+
+        try:
+            median_time=_time_fn(fn, device, repeats)
+            result["measurements"][measurement]=dict(status="ok", median_time=median_time, throughput=batch_size/median_time)
+        except Exception as e:
+            result["measurements"][measurement]=dict(status="error", error=repr(e))
+
+    if(device.type=="cuda"):
+        result["peak_memory_bytes"]=int(torch.cuda.max_memory_allocated(device))
+    else:
+        result["peak_memory_bytes"]=_max_rss_bytes()-max_rss_before
+
+    return result
+
+def benchmark_config_in_subprocess(*args, **kwargs):
+    """
+    Runs *benchmark_config* in a freshly spawned process, so the resident memory high water mark starts at the bare interpreter 
+    and the peak memory of the configuration is measured in isolation.
+    """
+    with concurrent.futures.ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(benchmark_config, *args, **kwargs).result()
+
+def config_key(flow_def, pdf_def, options, batch_size, dtype, conditional):
+
+    option_str=",".join(["%s=%s" % (k, options[k]) for k in sorted(options.keys())])
+
+    return "%s|%s|%s|b%d|%s|%s" % (flow_def, pdf_def, option_str, batch_size, str(dtype).split(".")[-1], "conditional" if conditional else "unconditional")
+
+def run_benchmarks(flow_abbreviations=None,
+                   dimensions=None,
+                   batch_sizes=[100,10000],
+                   dtypes=[torch.float32, torch.float64],
+                   modes=["unconditional", "conditional"],
+                   measurements=ALL_MEASUREMENTS,
+                   num_layers=2,
+                   device="cpu",
+                   repeats=3,
+                   include_option_variants=True,
+                   isolate_configs=True,
+                   verbose=True):
+    """
+    Loops over flow layers, manifold dimensions, batch sizes, dtypes and conditional/unconditional modes.
+    With *isolate_configs*, every configuration on the CPU runs in a fresh process (see *benchmark_config_in_subprocess*). Otherwise 
+    CPU peak memory is not recorded, since the high water mark of a shared process only grows.
+
+    Returns:
+
+        dict
+            JSON-serializable results with metadata.
+    """
+    device=torch.device(device)
 
+    if(flow_abbreviations is None):
+        flow_abbreviations=list(opts_dict.keys())
 
-def test_gf_modes():
+    results=dict()
 
-    icdf_approximations=["inormal_full_pade", "inormal_partly_crude", "inormal_partly_precise", "isigmoid"]
+    for flow_abbreviation in flow_abbreviations:
 
-    for icdf_approx in icdf_approximations:
+        layer_type=opts_dict[flow_abbreviation]["type"]
+        flow_def=flow_abbreviation*num_layers
 
-        extra_flow_defs=dict()
-        extra_flow_defs["g"]=dict()
-        extra_flow_defs["g"]["kwargs"]=dict()
+        option_sets=[dict()]
+        if(include_option_variants and flow_abbreviation in OPTION_VARIANTS.keys()):
+            option_sets+=OPTION_VARIANTS[flow_abbreviation]
 
-        extra_flow_defs["g"]["kwargs"]["inverse_function_type"]=icdf_approx
+        for pdf_def in manifold_strings(layer_type, flow_abbreviation, dimensions=dimensions):
+            for options in option_sets:
+                for batch_size in batch_sizes:
+                    for dtype in dtypes:
+                        for mode in modes:
 
-        this_flow=f.pdf("e5", "gggg", flow_defs_detail=extra_flow_defs)
-        with torch.no_grad():
-            tbef=time.time()
-            
-            samples,_,_,_=this_flow.sample(samplesize=50000)
-            sample_time=time.time()-tbef
+                            conditional=(mode=="conditional")
+                            key=config_key(flow_def, pdf_def, options, batch_size, dtype, conditional)
 
-            tbef=time.time()
-            this_flow(samples)
-            eval_time=time.time()-tbef
-        
-        print("%s ... sampletime %d samples: %.2f / evaltime: %.2f" %(icdf_approx, len(samples), sample_time, eval_time))
+                            entry=dict(flow_def=flow_def, pdf_def=pdf_def, options=options, batch_size=batch_size, dtype=str(dtype), conditional=conditional)
+
+                            try:
+                                if(isolate_configs and device.type=="cpu"):
+                                    entry.update(benchmark_config_in_subprocess(pdf_def, flow_def, options, batch_size, dtype, conditional, measurements, device, repeats=repeats))
+                                else:
+                                    entry.update(benchmark_config(pdf_def, flow_def, options, batch_size, dtype, conditional, measurements, device, repeats=repeats))
+
+                                    if(device.type=="cpu"):
+                                        entry.pop("peak_memory_bytes")
+                                entry["status"]="ok"
+                            except Exception as e:
+                                entry["status"]="error"
+                                entry["error"]=repr(e)
+
+                            results[key]=entry
+
+                            if(verbose):
+                                if(entry["status"]=="ok"):
+                                    throughputs=" ".join(["%s: %.3g/s" % (m, v["throughput"]) if v["status"]=="ok" else "%s: error" % m for m,v in entry["measurements"].items()])
+                                    if("peak_memory_bytes" in entry.keys()):
+                                        throughputs+=" peak memory: %.3g MB" % (entry["peak_memory_bytes"]/1e6)
+                                    print("%s ... %s" % (key, throughputs))
+                                else:
+                                    print("%s ... %s" % (key, entry["error"]))
+
+    return dict(metadata=benchmark_metadata(device), results=results)
+
+def benchmark_metadata(device):
+
+    metadata=dict(torch_version=torch.__version__,
+                  numpy_version=numpy.__version__,
+                  python_version=platform.python_version(),
+                  platform=platform.platform(),
+                  processor=platform.processor(),
+                  num_threads=torch.get_num_threads(),
+                  device=str(device),
+                  timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"))
+
+    if(device.type=="cuda"):
+        metadata["device_name"]=torch.cuda.get_device_name(device)
+
+    try:
+        metadata["git_commit"]=subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        metadata["git_commit"]=None
+
+    return metadata
+
+def compare_results(current, baseline, tolerance=0.1, memory_tolerance=0.1, memory_slack_bytes=2**20):
+    """
+    Compares the throughput of all configurations and measurements, and the peak memory of all configurations, present in both result sets.
+
+    Parameters:
+
+        current (dict): Results of *run_benchmarks*.
+        baseline (dict): Baseline results of *run_benchmarks*.
+        tolerance (float): Relative throughput drop that is counted as regression.
+        memory_tolerance (float): Relative peak memory growth that is counted as regression.
+        memory_slack_bytes (int): Absolute peak memory changes below this are ignored (page granularity of the resident memory).
+
+    Returns:
+
+        dict
+            "regressions", "improvements" and "unchanged" lists of (key, measurement, baseline throughput, current throughput, ratio),
+            "memory_regressions" and "memory_improvements" lists of (key, baseline peak bytes, current peak bytes, ratio),
+            and "new_failures" / "missing" lists of (key, measurement).
+    """
+    comparison=dict(regressions=[], improvements=[], unchanged=[], memory_regressions=[], memory_improvements=[], new_failures=[], missing=[])
+
+    for key, baseline_entry in baseline["results"].items():
+
+        if(baseline_entry["status"]!="ok"):
+            continue
+
+        if(key not in current["results"].keys()):
+            comparison["missing"].append((key, None))
+            continue
+
+        current_entry=current["results"][key]
+
+        if(current_entry["status"]=="ok" and "peak_memory_bytes" in baseline_entry.keys() and "peak_memory_bytes" in current_entry.keys()):
+
+            baseline_memory=baseline_entry["peak_memory_bytes"]
+            current_memory=current_entry["peak_memory_bytes"]
+
+            ratio=current_memory/max(baseline_memory, 1)
+            item=(key, baseline_memory, current_memory, ratio)
+
+            if(current_memory>baseline_memory*(1.0+memory_tolerance)+memory_slack_bytes):
+                comparison["memory_regressions"].append(item)
+            elif(current_memory<baseline_memory*(1.0-memory_tolerance)-memory_slack_bytes):
+                comparison["memory_improvements"].append(item)
+
+        for measurement, baseline_measurement in baseline_entry["measurements"].items():
+
+            if(baseline_measurement["status"]!="ok"):
+                continue
+
+            if(current_entry["status"]!="ok" or measurement not in current_entry["measurements"].keys()):
+                comparison["missing" if current_entry["status"]=="ok" else "new_failures"].append((key, measurement))
+                continue
+
+            current_measurement=current_entry["measurements"][measurement]
+
+            if(current_measurement["status"]!="ok"):
+                comparison["new_failures"].append((key, measurement))
+                continue
+
+            ratio=current_measurement["throughput"]/baseline_measurement["throughput"]
+            item=(key, measurement, baseline_measurement["throughput"], current_measurement["throughput"], ratio)
+
+            if(ratio<1.0-tolerance):
+                comparison["regressions"].append(item)
+            elif(ratio>1.0+tolerance):
+                comparison["improvements"].append(item)
+            else:
+                comparison["unchanged"].append(item)
+
+    return comparison
+
+def print_comparison(comparison):
+
+    for name in ["regressions", "improvements"]:
+        print("%s (%d):" % (name, len(comparison[name])))
+        for key, measurement, baseline_tp, current_tp, ratio in sorted(comparison[name], key=lambda item: item[-1]):
+            print("  %-80s %-12s %12.4g -> %12.4g /s (x%.2f)" % (key, measurement, baseline_tp, current_tp, ratio))
+
+    print("unchanged: %d" % len(comparison["unchanged"]))
+
+    for name in ["memory_regressions", "memory_improvements"]:
+        print("%s (%d):" % (name, len(comparison[name])))
+        for key, baseline_bytes, current_bytes, ratio in sorted(comparison[name], key=lambda item: item[-1]):
+            print("  %-80s %12.4g -> %12.4g MB (x%.2f)" % (key, baseline_bytes/1e6, current_bytes/1e6, ratio))
+
+    for name in ["new_failures", "missing"]:
+        if(len(comparison[name])>0):
+            print("%s (%d):" % (name, len(comparison[name])))
+            for key, measurement in comparison[name]:
+                print("  %s %s" % (key, measurement))
+
+def _list_arg(arg, conversion=str):
+    if(arg==""):
+        return None
+    return [conversion(a) for a in arg.split(",")]
 
 if __name__ == '__main__':
-    
-    test_gf_modes()
\ No newline at end of file
+
+    parser = argparse.ArgumentParser('check_performance')
+    parser.add_argument("mode", type=str, choices=["run", "compare"])
+    parser.add_argument("-output", type=str, default="benchmark.json")
+    parser.add_argument("-layers", type=str, default="", help="Comma-separated flow abbreviations. Default: all entries of opts_dict.")
+    parser.add_argument("-dimensions", type=str, default="", help="Comma-separated manifold dimensions. Default: per manifold type.")
+    parser.add_argument("-batch_sizes", type=str, default="100,10000")
+    parser.add_argument("-dtypes", type=str, default="float32,float64")
+    parser.add_argument("-modes", type=str, default="unconditional,conditional")
+    parser.add_argument("-measurements", type=str, default=",".join(ALL_MEASUREMENTS))
+    parser.add_argument("-num_layers", type=int, default=2)
+    parser.add_argument("-repeats", type=int, default=3)
+    parser.add_argument("-option_variants", type=int, default=1)
+    parser.add_argument("-device", type=str, default="cpu")
+    parser.add_argument("-isolate_configs", type=int, default=1, help="Run every CPU configuration in a fresh process to measure its peak memory.")
+    parser.add_argument("-current", type=str, default="benchmark.json")
+    parser.add_argument("-baseline", type=str, default="benchmark_baseline.json")
+    parser.add_argument("-tolerance", type=float, default=0.1)
+    parser.add_argument("-memory_tolerance", type=float, default=0.1)
+
+    args=parser.parse_args()
+
+    if(args.mode=="run"):
+
+        results=run_benchmarks(flow_abbreviations=_list_arg(args.layers),
+                               dimensions=_list_arg(args.dimensions, int),
+                               batch_sizes=_list_arg(args.batch_sizes, int),
+                               dtypes=[getattr(torch, d) for d in _list_arg(args.dtypes)],
+                               modes=_list_arg(args.modes),
+                               measurements=_list_arg(args.measurements),
+                               num_layers=args.num_layers,
+                               device=args.device,
+                               repeats=args.repeats,
+                               include_option_variants=bool(args.option_variants),
+                               isolate_configs=bool(args.isolate_configs))
+
+        with open(args.output, "w") as outfile:
+            json.dump(results, outfile, indent=1)
+
+    else:
+
+        with open(args.current) as infile:
+            current=json.load(infile)
+        with open(args.baseline) as infile:
+            baseline=json.load(infile)
+
+        comparison=compare_results(current, baseline, tolerance=args.tolerance, memory_tolerance=args.memory_tolerance)
+        print_comparison(comparison)
+
+        if(len(comparison["regressions"])>0 or len(comparison["memory_regressions"])>0 or len(comparison["new_failures"])>0):
+            sys.exit(1)
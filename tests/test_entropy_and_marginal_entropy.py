@@ -445,5 +445,30 @@ class Test(unittest.TestCase):
     
     
 
+    def test_s2_entropy_scan(self):
+
+        print("-> Testing hierarchical healpix entropy scan <-")
+
+        seed_everything(1)
+
+        this_flow=f.pdf("s2", "fv", conditional_input_dim=2)
+        this_flow.double()
+
+        with torch.no_grad():
+            for p in this_flow.parameters():
+                p.data+=torch.randn_like(p)
+
+        cinput=torch.randn(2, 2, dtype=torch.float64)*2
+
+        scan_result=this_flow.marginal_moments(cinput, samplesize=2000, calc_kl_diff_and_entropic_quantities=True, s2_entropy_scanning=True)
+
+        seed_everything(1)
+        entropy_dict=this_flow.entropy(samplesize=5000, conditional_input=cinput)
+
+        print("scan entropy ", scan_result["entropy_0"], " sampled entropy ", entropy_dict["total"])
+
+        assert(scan_result["entropy_0"].shape==(2,))
+        assert( (scan_result["entropy_0"]-entropy_dict["total"]).abs().max()<0.1), (scan_result["entropy_0"], entropy_dict["total"])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
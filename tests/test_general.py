@@ -1,18 +1,26 @@
 import unittest
 import sys
 import os
+import tempfile
 import torch
 import numpy
 import pylab
 import torch.autograd.functional
 import random
+import io
+import concurrent.futures
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 
 import jammy_flows.main.default as f
+import jammy_flows.main.pdf_bank as pdf_bank
 
 import jammy_flows.helper_fns as helper_fns
+import jammy_flows.extra_functions as extra_functions
+import jammy_flows.layers.spline_fns as spline_fns
+import jammy_flows.precision as precision
+import jammy_flows.checkpoint as checkpoint
 
 
 def seed_everything(seed_no):
@@ -577,9 +585,542 @@ class Test(unittest.TestCase):
                 if(deriv_of_deriv_sums>1e-6 or numpy.isfinite(deriv_of_deriv_sums)==False):
                     raise Exception("Derivative of derivative is not finite", icdf_approx, deriv_of_deriv_sums)
                 
+    def test_spline_bin_search(self):
+        print("Testing binary bin search and deferred boundary checks of rq splines")
+
+        seed_everything(1)
+
+        for shared_bins in [True, False]:
+
+            bin_locations=torch.cumsum(torch.rand(1 if shared_bins else 100, 2, 9, dtype=torch.float64), dim=-1)
+            bin_locations=bin_locations-bin_locations[...,:1]
+            bin_locations=bin_locations/bin_locations[...,-1:]
+
+            inputs=torch.rand(100, 2, 1, dtype=torch.float64)
+            inputs[0]=1.0
+            inputs[1]=0.0
+
+            locations_before=bin_locations.clone()
+
+            ## O(K) reference implementation
+            brute_force_idx=torch.sum(inputs >= bin_locations[...,:-1], dim=-1, keepdims=True)-1
+
+            self.assertTrue( (spline_fns.searchsorted(bin_locations, inputs)==brute_force_idx).all() )
+            self.assertTrue( (locations_before==bin_locations).all() )
+
+        ## out-of-bounds inputs are only recorded, unless debug checks are active
+        spline_fns.rational_quadratic_spline(torch.tensor([[1.5]]), torch.randn(1,5), torch.randn(1,5), torch.randn(1,6))
+
+        with self.assertRaises(Exception):
+            spline_fns.check_deferred_violations()
+
+        spline_fns.check_deferred_violations()
+
+        ## pdf-level check .. inputs outside of the interval of an "r" layer
+        this_flow=f.pdf("i1_-1.0_1.0", "r")
+        this_flow.double()
+        r_layer=this_flow.layer_list[0][0]
+
+        this_flow(torch.tensor([[0.5]], dtype=torch.float64))
+        this_flow.check_spline_violations()
+
+        with spline_fns.recording_violations(this_flow.spline_violations):
+            r_layer.inv_flow_mapping([torch.tensor([[1.5]], dtype=torch.float64), torch.zeros(1, dtype=torch.float64)])
+
+        ## violations are recorded per pdf
+        other_flow=f.pdf("i1_-1.0_1.0", "r")
+        other_flow.check_spline_violations()
+        spline_fns.check_deferred_violations()
+
+        with self.assertRaises(Exception):
+            this_flow.check_spline_violations()
+
+        this_flow.check_spline_violations()
+
+        ## violations recorded concurrently from several threads
+        def eval_outside(_):
+            with spline_fns.recording_violations(this_flow.spline_violations):
+                r_layer.inv_flow_mapping([torch.tensor([[1.5]], dtype=torch.float64), torch.zeros(1, dtype=torch.float64)])
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(eval_outside, range(8)))
+
+        other_flow.check_spline_violations()
+        with self.assertRaises(Exception):
+            this_flow.check_spline_violations()
+
+        spline_fns.set_debug_checks(True)
+        try:
+            with self.assertRaises(Exception):
+                spline_fns.rational_quadratic_spline(torch.tensor([[1.5]]), torch.randn(1,5), torch.randn(1,5), torch.randn(1,6))
+        finally:
+            spline_fns.set_debug_checks(False)
+
+    def test_spline_knot_table_cache(self):
+        print("Testing knot table cache of rq spline layers")
+
+        seed_everything(1)
+
+        for pdf_def, flow_def in [("i1_-1.0_1.0", "rr"), ("s1", "oo")]:
+
+            this_flow=f.pdf(pdf_def, flow_def)
+            this_flow.double()
+
+            samples,_,_,_=this_flow.sample(samplesize=200)
+
+            with torch.no_grad():
+                log_pdf_first,_,_=this_flow(samples)
+                cached_tables=[l.knot_table_cache.table for l in this_flow.layer_list[0]]
+                log_pdf_second,_,_=this_flow(samples)
+
+            ## tables are reused without parameter changes
+            for ind, l in enumerate(this_flow.layer_list[0]):
+                self.assertTrue(l.knot_table_cache.table is cached_tables[ind])
+
+            self.assertTrue( (log_pdf_first==log_pdf_second).all() )
+
+            ## gradient mode builds the table in the graph and gives the same result
+            log_pdf_grad,_,_=this_flow(samples)
+            log_pdf_grad.sum().backward()
+
+            self.assertTrue( numpy.fabs((log_pdf_grad-log_pdf_first).detach().numpy()).max() < 1e-12 )
+
+            ## in-place parameter updates invalidate the cache
+            torch.optim.SGD(this_flow.parameters(), lr=0.1).step()
+
+            with torch.no_grad():
+                log_pdf_updated,_,_=this_flow(samples)
+
+            log_pdf_updated_grad,_,_=this_flow(samples)
+
+            self.assertTrue( numpy.fabs((log_pdf_updated-log_pdf_updated_grad).detach().numpy()).max() < 1e-12 )
+            self.assertTrue( numpy.fabs((log_pdf_updated-log_pdf_first).numpy()).max() > 1e-3 )
+
+            ## re-initialization writes into .data, which does not change the version counter .. the cached table must be dropped
+            for l in this_flow.layer_list[0]:
+                l.init_params(torch.randn(l.get_total_param_num(), dtype=torch.float64))
+                self.assertTrue(l.knot_table_cache.table is None)
+
+            with torch.no_grad():
+                log_pdf_reinitialized,_,_=this_flow(samples)
+
+                for l in this_flow.layer_list[0]:
+                    l.knot_table_cache.reset()
+
+                log_pdf_fresh_table,_,_=this_flow(samples)
+
+            self.assertTrue( (log_pdf_reinitialized==log_pdf_fresh_table).all() )
+
     
     
     
 
+    def test_profiling(self):
+        print("Testing profiling context of pdfs")
+
+        seed_everything(1)
+
+        this_flow=f.pdf("e1+s1", "gg+mm", conditional_input_dim=2)
+        cinput=torch.randn(50, 2)
+
+        with this_flow.profile() as prof:
+            samples,_,_,_=this_flow.sample(samplesize=50, conditional_input=cinput)
+            log_pdf,_,_=this_flow(samples, conditional_input=cinput)
+
+        report=prof.report()
+
+        self.assertTrue(report["entries"]["pdf/forward"]["calls"]==1)
+        self.assertTrue(report["entries"]["pdf_1/layer_0_moebius/flow_mapping"]["max_batch_size"]==50)
+        self.assertTrue(report["entries"]["pdf_0/mlp_predictor"]["calls"]==2)
+
+        ## sampling inverts the moebius layers with bisection/Newton
+        self.assertTrue(report["entries"]["pdf/sample"]["newton_iterations"]>0)
+        self.assertTrue(len(prof.chrome_trace()["traceEvents"])==len(prof.events))
+
+        ## wrappers are removed after the context
+        self.assertFalse("flow_mapping" in this_flow.layer_list[1][0].__dict__)
+        self.assertFalse("forward" in this_flow.__dict__)
+
+        ## CPU memory is only recorded on request .. the allocations of the mlp outputs are part of the allocations of the pdf call
+        self.assertFalse("cpu_allocated_bytes" in report["entries"]["pdf/forward"])
+
+        with this_flow.profile(record_cpu_memory=True) as prof:
+            with torch.no_grad():
+                log_pdf,_,_=this_flow(samples, conditional_input=cinput)
+
+        report=prof.report()
+
+        self.assertTrue(report["entries"]["pdf_0/mlp_predictor"]["cpu_allocated_bytes"]>0)
+        self.assertTrue(report["entries"]["pdf/forward"]["cpu_allocated_bytes"]>=report["entries"]["pdf/forward"]["output_bytes"])
+
+    def test_float32_precision_policy(self):
+        print("Testing float32 models with float64 islands")
+
+        seed_everything(1)
+
+        flow_32=f.pdf("e1+s2", "gg+f", options_overwrite=dict(g=dict(inverse_function_type="inormal_full_pade")))
+        flow_32.float()
+        flow_64=f.pdf("e1+s2", "gg+f", options_overwrite=dict(g=dict(inverse_function_type="inormal_full_pade")))
+        flow_64.double()
+        flow_64.load_state_dict(flow_32.state_dict())
+
+        samples_64,_,log_pdf_64,_=flow_64.sample(samplesize=200, seed=2)
+        samples_32,_,log_pdf_32,_=flow_32.sample(samplesize=200, seed=2)
+
+        self.assertTrue(samples_32.dtype==torch.float32 and log_pdf_32.dtype==torch.float32)
+        self.assertTrue((log_pdf_32.double()-log_pdf_64).abs().max()<1e-4)
+
+        evals_32,_,_=flow_32(samples_64.float())
+        self.assertTrue((evals_32.double()-log_pdf_64).abs().max()<1e-4)
+
+        ## without islands the full pade approximation loses precision close to cdf values of 0.5
+        precision.set_float64_islands(False)
+        try:
+            evals_32_no_islands,_,_=flow_32(samples_64.float())
+        finally:
+            precision.set_float64_islands(True)
+
+        self.assertTrue((evals_32_no_islands.double()-log_pdf_64).abs().max()>(evals_32.double()-log_pdf_64).abs().max())
+
+        with self.assertRaises(Exception):
+            precision.tolerance("newton_atol", torch.float16)
+
+    def test_mlp_precision(self):
+        print("Testing reduced precision of amortization MLPs")
+
+        seed_everything(1)
+
+        this_flow=f.pdf("e1+s2", "g+f", conditional_input_dim=3, amortization_mlp_dims="64-64")
+        this_flow.float()
+
+        cinput=torch.randn(100, 3)
+        samples,_,_,_=this_flow.sample(samplesize=100, conditional_input=cinput)
+        log_pdf_before,_,_=this_flow(samples, conditional_input=cinput)
+
+        this_flow.set_mlp_precision(torch.bfloat16)
+        self.assertTrue(this_flow.mlp_predictors[0][0].weight.dtype==torch.bfloat16)
+
+        ## flow layers and log-probs stay in float32
+        bf16_samples,_,bf16_log_pdf,_=this_flow.sample(samplesize=100, conditional_input=cinput)
+        self.assertTrue(bf16_samples.dtype==torch.float32 and bf16_log_pdf.dtype==torch.float32)
+        self.assertTrue(torch.isfinite(bf16_log_pdf).all())
+
+        ## switching back restores the full-precision weights exactly
+        this_flow.set_mlp_precision(None)
+        log_pdf_after,_,_=this_flow(samples, conditional_input=cinput)
+        self.assertTrue((log_pdf_after==log_pdf_before).all())
+
+        deviations=this_flow.validate_mlp_precision(samples, conditional_input=cinput, mlp_dtype=torch.bfloat16)
+        self.assertTrue(deviations["num_non_finite"]==0)
+        self.assertTrue(deviations["max_abs_deviation"]>0 and deviations["max_relative_deviation"]<0.5)
+        self.assertTrue(this_flow.mlp_precision is None)
+
+    def test_inference_export(self):
+        print("Testing static inference modules")
+
+        seed_everything(1)
+
+        this_flow=f.pdf("e1+s2", "g+n", conditional_input_dim=2)
+        this_flow.double()
+
+        cinput=torch.randn(30, 2, dtype=torch.float64)
+        samples, base_samples, sample_log_pdf,_=this_flow.sample(samplesize=30, conditional_input=cinput)
+        log_pdf,_,_=this_flow(samples, conditional_input=cinput)
+
+        log_prob_module=this_flow.export_inference_module("log_prob")
+        self.assertTrue(torch.allclose(log_prob_module(samples, cinput), log_pdf))
+
+        sample_module=this_flow.export_inference_module("sample")
+        module_samples, module_log_pdf=sample_module(base_samples, cinput)
+        self.assertTrue(torch.allclose(module_samples, samples))
+        self.assertTrue(torch.allclose(module_log_pdf, sample_log_pdf))
+
+        ## traced modules work for other batch sizes and survive a save/load roundtrip
+        traced=this_flow.export_inference_module("log_prob", example_inputs=(samples, cinput))
+
+        buffer=io.BytesIO()
+        torch.jit.save(traced, buffer)
+        buffer.seek(0)
+        loaded=torch.jit.load(buffer)
+
+        self.assertTrue(torch.allclose(loaded(samples[:7], cinput[:7]), log_pdf[:7]))
+
+    def test_contours_and_coverage(self):
+        print("Testing vectorized contour and coverage calculations")
+
+        ## standard normal in 2-d .. the density level enclosing probability p is (1-p)/(2*pi)
+        xvals=numpy.linspace(-6,6,601)
+        xx,yy=numpy.meshgrid(xvals, xvals)
+        pdf_vals=numpy.exp(-0.5*(xx**2+yy**2))/(2*numpy.pi)
+        bin_volume=(xvals[1]-xvals[0])**2
+
+        contours=helper_fns.calculate_contours_batched(numpy.stack([pdf_vals, 0.5*pdf_vals]), bin_volume, probs=[0.68, 0.95])
+
+        self.assertTrue(numpy.allclose(contours[0], (1.0-numpy.array([0.68,0.95]))/(2*numpy.pi), rtol=1e-2))
+        ## the second event only encloses probability 0.5
+        self.assertTrue(numpy.isnan(contours[1]).all())
+        self.assertTrue(numpy.allclose(helper_fns.calculate_contours(pdf_vals, bin_volume, probs=[0.68, 0.95]), contours[0]))
+
+        ## coverage of exact standard normal base evaluations matches the expectation
+        seed_everything(1)
+        base_points=numpy.random.normal(size=(20000,3))
+        base_evals=-0.5*(base_points**2).sum(axis=1)-1.5*numpy.log(2*numpy.pi)
+        expected_probs=numpy.array([0.1,0.5,0.9])
+
+        coverage,_=extra_functions._calculate_coverage(base_evals, 3, expected_probs)
+        self.assertTrue(numpy.abs(coverage-expected_probs).max()<0.02)
+
+        batched_coverage,_=extra_functions._calculate_coverage(numpy.stack([base_evals, base_evals[::-1]]), 3, expected_probs)
+        self.assertTrue(batched_coverage.shape==(2,3))
+        self.assertTrue(numpy.allclose(batched_coverage[1], coverage))
+
+    def test_streaming_coverage(self):
+        print("Testing streaming coverage accumulation")
+
+        for dtype in [torch.float64, torch.float32]:
+
+            seed_everything(1)
+
+            this_flow=f.pdf("e1+s2", "g+n", conditional_input_dim=2)
+            this_flow.to(dtype)
+
+            cinput=torch.randn(1000, 2, dtype=dtype)
+            samples,_,_,_=this_flow.sample(samplesize=1000, conditional_input=cinput)
+
+            reference=this_flow.coverage(samples, conditional_input=cinput, sub_manifolds=[-1,1])
+
+            ## two workers with partial accumulators
+            batches=[(samples[i:i+300], cinput[i:i+300]) for i in range(0, 1000, 300)]
+
+            acc_1=this_flow.coverage_streaming(batches[:2], sub_manifolds=[-1,1], return_accumulator=True)
+            acc_2=this_flow.coverage_streaming(batches[2:], sub_manifolds=[-1,1], return_accumulator=True)
+
+            result=acc_1.merge(acc_2).result()
+
+            self.assertTrue(result["num_events"]["total"]==1000)
+            self.assertTrue(numpy.allclose(result["expected"], reference["expected"]))
+
+            ## identical counts, also in float32
+            for key in ["total", 1]:
+                self.assertTrue(numpy.array_equal(result["true"][key], reference["true"][key]))
+
+    def test_mises_fisher_functions(self):
+        print("Testing batched von Mises-Fisher kappa estimation and sampling")
+
+        seed_everything(1)
+
+        for p in [2,3]:
+
+            kappa=torch.tensor([1e-3, 0.5, 3.0, 50.0, 1e4], dtype=torch.float64)
+            mean_resultant_length=extra_functions.mises_fisher_mean_resultant_length(kappa, p)
+
+            estimated_kappa=extra_functions.estimate_mises_fisher_kappa(mean_resultant_length, p)
+            self.assertTrue(torch.allclose(estimated_kappa, kappa, rtol=1e-6))
+
+            mean=torch.randn(len(kappa), p, dtype=torch.float64)
+            mean=mean/mean.norm(dim=1, keepdim=True)
+
+            samples=extra_functions.sample_mises_fisher(mean, kappa, 50000)
+
+            self.assertTrue(samples.shape==(len(kappa), 50000, p))
+            self.assertTrue(torch.allclose(samples.norm(dim=2), torch.ones(1, dtype=torch.float64)))
+            self.assertTrue(torch.allclose((samples.mean(dim=1)*mean).sum(dim=1), mean_resultant_length, atol=1e-2))
+
+    def test_streaming_init(self):
+        print("Testing data initialization with streamed data chunks")
+
+        data=torch.randn(6000, 3, dtype=torch.float64)*torch.tensor([1.0, 3.0, 0.5], dtype=torch.float64)+2.0
+
+        log_probs=[]
+
+        for init_data in [data, list(data.split(1000))]:
+            seed_everything(1)
+
+            this_flow=f.pdf("e3", "gg")
+            this_flow.double()
+
+            seed_everything(2)
+            this_flow.init_params(data=init_data)
+
+            log_probs.append(this_flow(data[:500])[0])
+
+        self.assertTrue(torch.allclose(log_probs[0], log_probs[1], atol=1e-4))
+
+        ## generators can not be passed over multiple times
+        with self.assertRaises(Exception):
+            this_flow.init_params(data=(chunk for chunk in data.split(1000)))
+
+    def test_parallel_init(self):
+        print("Testing parallel data initialization of independent sub-pdfs")
+
+        data=torch.randn(3000, 6, dtype=torch.float64)*torch.linspace(0.5, 3.0, 6, dtype=torch.float64)
+
+        log_probs=[]
+
+        for num_workers in [1,3]:
+            seed_everything(1)
+
+            this_flow=f.pdf("e2+e2+e2", "gg+gg+t")
+            this_flow.double()
+
+            seed_everything(2)
+            this_flow.init_params(data=data, num_workers=num_workers, reservoir_size=1000)
+
+            log_probs.append(this_flow(data[:500])[0])
+
+        self.assertTrue(torch.equal(log_probs[0], log_probs[1]))
+
+    def test_lazy_construction(self):
+        print("Testing lazy construction and cached structure descriptors")
+
+        for pdf_defs, flow_defs, conditional_input_dim in [("e2+s2+s1", "gg+n+m", None), ("e2+s2", "gt+n", 2)]:
+
+            seed_everything(1)
+
+            this_flow=f.pdf(pdf_defs, flow_defs, conditional_input_dim=conditional_input_dim)
+            lazy_flow=f.pdf(pdf_defs, flow_defs, conditional_input_dim=conditional_input_dim, skip_param_initialization=True)
+
+            this_flow.double()
+            lazy_flow.double()
+
+            self.assertTrue(this_flow.structure_descriptor is lazy_flow.structure_descriptor)
+
+            lazy_flow.load_state_dict(this_flow.state_dict())
+
+            conditional_input=None
+            if(conditional_input_dim is not None):
+                conditional_input=torch.randn(100, conditional_input_dim, dtype=torch.float64)
+
+            samples,_,_,_=this_flow.sample(samplesize=100, conditional_input=conditional_input)
+
+            self.assertTrue(torch.equal(this_flow(samples, conditional_input=conditional_input)[0], lazy_flow(samples, conditional_input=conditional_input)[0]))
+
+        ## the cache key does not depend on the insertion order of options, and pdfs do not share their definitions and options
+        options_overwrite=dict(g=dict(fit_normalization=1, nonlinear_stretch_type="classic"), n=dict(add_rotation=1))
+        reordered_options_overwrite=dict(n=dict(add_rotation=1), g=dict(nonlinear_stretch_type="classic", fit_normalization=1))
+
+        this_flow=f.pdf("e2+s2", "gg+n", options_overwrite=options_overwrite)
+        other_flow=f.pdf("e2+s2", "gg+n", options_overwrite=reordered_options_overwrite)
+
+        self.assertTrue(this_flow.structure_descriptor is other_flow.structure_descriptor)
+        self.assertTrue(this_flow.flow_opts is not other_flow.flow_opts)
+
+        this_flow.flow_opts[0][0]["fit_normalization"]=0
+        this_flow.pdf_defs_list.append("e1")
+        options_overwrite["g"]["fit_normalization"]=0
+
+        new_flow=f.pdf("e2+s2", "gg+n", options_overwrite=dict(g=dict(fit_normalization=1, nonlinear_stretch_type="classic"), n=dict(add_rotation=1)))
+
+        self.assertTrue(new_flow.flow_opts[0][0]["fit_normalization"]==1)
+        self.assertTrue(new_flow.pdf_defs_list==["e2", "s2"])
+        self.assertTrue(new_flow.flow_opts==other_flow.flow_opts)
+
+    def test_checkpoint(self):
+        print("Testing versioned checkpoints with memory-mapped loading")
+
+        seed_everything(1)
+
+        this_flow=f.pdf("e2+s2+i1", "gt+n+r", conditional_input_dim=2, options_overwrite=dict(t=dict(cov_type="full")))
+        this_flow.double()
+        this_flow.set_use_embedding_parameters_flag(True, sub_pdf_index=1)
+
+        conditional_input=torch.randn(100, 2, dtype=torch.float64)
+        samples,_,_,_=this_flow.sample(samplesize=100, conditional_input=conditional_input)
+        log_probs=this_flow(samples, conditional_input=conditional_input)[0]
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            filename=os.path.join(tmpdir, "model.jf")
+            this_flow.save_checkpoint(filename)
+
+            for mmap in [False, True]:
+                loaded_flow=f.pdf.from_checkpoint(filename, mmap=mmap)
+                self.assertTrue(torch.equal(loaded_flow(samples, conditional_input=conditional_input)[0], log_probs))
+
+            ## direct assignment used by torch versions without *load_state_dict(assign=True)*
+            _, tensors=checkpoint.read_checkpoint(filename)
+            checkpoint.assign_state_dict(loaded_flow, {k: torch.zeros_like(v) for k,v in tensors.items()}, use_assign=False)
+            checkpoint.assign_state_dict(loaded_flow, tensors, use_assign=False)
+            self.assertTrue(torch.equal(loaded_flow(samples, conditional_input=conditional_input)[0], log_probs))
+
+            ## training the memory-mapped model does not modify the file
+            optimizer=torch.optim.Adam(loaded_flow.parameters(), lr=0.1)
+            (-loaded_flow(samples, conditional_input=conditional_input)[0].mean()).backward()
+            optimizer.step()
+
+            loaded_flow=f.pdf.from_checkpoint(filename)
+            self.assertTrue(torch.equal(loaded_flow(samples, conditional_input=conditional_input)[0], log_probs))
+
+            ## MLPs in reduced precision are saved in full precision and switched to reduced precision again when loading
+            this_flow.set_mlp_precision(torch.bfloat16)
+            bf16_log_probs=this_flow(samples, conditional_input=conditional_input)[0]
+            this_flow.save_checkpoint(filename)
+
+            loaded_flow=f.pdf.from_checkpoint(filename)
+            self.assertTrue(loaded_flow.mlp_precision==torch.bfloat16)
+            self.assertTrue(torch.equal(loaded_flow(samples, conditional_input=conditional_input)[0], bf16_log_probs))
+
+            loaded_flow.set_mlp_precision(None)
+            self.assertTrue(torch.equal(loaded_flow(samples, conditional_input=conditional_input)[0], log_probs))
+
+    def test_closed_form_init_helpers(self):
+        print("Testing Householder decomposition and closed-form multivariate normal initialization")
+
+        seed_everything(1)
+
+        orthogonal_matrices=torch.linalg.qr(torch.randn(4, 5, 5, dtype=torch.float64))[0]
+
+        this_flow=f.pdf("e5", "g")
+        this_flow.double()
+        gblock=this_flow.layer_list[0][0]
+
+        vs=extra_functions.householder_vectors_from_orthogonal(orthogonal_matrices)
+        reconstructed=gblock.compute_householder_matrix(vs)
+
+        ## equal up to the signs of the columns
+        self.assertTrue(torch.allclose(reconstructed.abs(), orthogonal_matrices.abs(), atol=1e-10))
+        self.assertTrue(torch.allclose((reconstructed*orthogonal_matrices).sum(dim=1).abs(), torch.ones(1, dtype=torch.float64)))
+
+        this_flow=f.pdf("e3", "t", options_overwrite=dict(t=dict(cov_type="full")))
+        this_flow.double()
+        mvn_layer=this_flow.layer_list[0][0]
+
+        random_matrix=torch.randn(3,3, dtype=torch.float64)
+        covariance=random_matrix.matmul(random_matrix.T)+0.1*torch.eye(3, dtype=torch.float64)
+
+        _, lower_triangular=extra_functions.mvn_params_from_covariance(mvn_layer, covariance)
+        self.assertTrue(torch.allclose(lower_triangular.matmul(lower_triangular.T), covariance))
+
+    def test_pdf_bank(self):
+        print("Testing batched evaluation of a bank of structurally identical pdfs")
+
+        seed_everything(1)
+
+        flows=[]
+        for _ in range(3):
+            this_flow=f.pdf("e2+s2", "gg+n", amortization_mlp_use_custom_mode=True)
+            this_flow.double()
+            with torch.no_grad():
+                for param in this_flow.parameters():
+                    param.add_(0.1*torch.randn_like(param))
+            flows.append(this_flow)
+
+        bank=pdf_bank.pdf_bank(flows)
+
+        model_index=torch.randint(0, 3, (50,))
+        samples,_,log_probs,_=bank.sample(model_index)
+
+        self.assertTrue(samples.shape==(50,4))
+
+        log_probs_bank=bank(samples, model_index)[0]
+        self.assertTrue(torch.allclose(log_probs_bank, log_probs))
+
+        for index, this_flow in enumerate(flows):
+            mask=model_index==index
+            self.assertTrue(torch.allclose(log_probs_bank[mask], this_flow(samples[mask])[0]))
+
+        ## the default MLPs of later sub-pdfs can not be amortized
+        with self.assertRaises(Exception):
+            pdf_bank.pdf_bank([f.pdf("e2+s2", "gg+n")])
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
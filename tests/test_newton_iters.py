@@ -376,5 +376,45 @@ class Test(unittest.TestCase):
         
 
 
+    def test_solver_telemetry(self):
+        """
+        Telemetry of the bisection/Newton solvers on a function with a known inverse.
+        """
+        seed_everything(1)
+
+        target=torch.rand(500,1, dtype=torch.float64)*4-2
+
+        func=lambda x: x**3+x
+        grad_func=lambda x: 3*x**2+1
+        joint_func=lambda x: (x**3+x, 3*x**2+1)
+
+        res, telemetry=bn.inverse_bisection_n_newton_joint_func_and_grad(func, joint_func, target, min_boundary=-5.0, max_boundary=5.0, num_bisection_iter=10, num_newton_iter=20, return_telemetry=True)
+
+        self.assertTrue( torch.abs(func(res)-target).max() < 1e-10)
+        self.assertTrue(telemetry.converged)
+        self.assertTrue(telemetry.newton_iterations < 20)
+        self.assertTrue(telemetry.fraction_converged[-1]==1.0)
+        self.assertTrue(sum(telemetry.residual_histogram)==500)
+
+        ## too few newton iterations are reported as non-converged
+        res, telemetry=bn.inverse_bisection_n_newton(func, grad_func, target, min_boundary=-5.0, max_boundary=5.0, num_bisection_iter=5, num_newton_iter=1, return_telemetry=True)
+
+        self.assertFalse(telemetry.converged)
+        self.assertTrue(telemetry.num_non_converged > 0)
+
+        ## non-finite values raise an error that holds the telemetry
+        with self.assertRaises(bn.solver_non_finite_error) as context:
+            bn.inverse_bisection_n_newton(func, lambda x: 0*x, target, min_boundary=-5.0, max_boundary=5.0, num_bisection_iter=5, num_newton_iter=3)
+
+        self.assertTrue(context.exception.telemetry.num_non_finite==500)
+
+        ## float32 uses dtype-aware tolerances and stops early instead of iterating towards float64 precision
+        res, telemetry=bn.inverse_bisection_n_newton_joint_func_and_grad(func, joint_func, target.float(), min_boundary=-5.0, max_boundary=5.0, num_bisection_iter=10, num_newton_iter=20, return_telemetry=True)
+
+        self.assertTrue(res.dtype==torch.float32)
+        self.assertTrue(telemetry.converged)
+        self.assertTrue(telemetry.newton_iterations < 20)
+
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
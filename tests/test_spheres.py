@@ -12,6 +12,9 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')
 
 import jammy_flows.main.default as f
 import jammy_flows.helper_fns as helper_fns
+import jammy_flows.extra_functions as extra_functions
+import jammy_flows.layers.spheres.moebius_1d as moebius_1d
+import jammy_flows.layers.spheres.cnf_sphere_charts as cnf_sphere_charts
 
 def seed_everything(seed_no):
     random.seed(seed_no)
@@ -74,9 +77,308 @@ class Test(unittest.TestCase):
 
         self.assertTrue( (numpy.isfinite((ev).detach().numpy())==0).sum()==0)
 
-        
-    
-      
+    def test_fvm_analytic_fast_path(self):
+
+        print("Testing analytic vMF path vs generic path of f-layers")
+
+        for use_embedding in [False, True]:
+
+            seed_everything(1)
+
+            this_flow=f.pdf("s2", "ff")
+            this_flow.double()
+            this_flow.set_use_embedding_parameters_flag(use_embedding)
+
+            for l in this_flow.layer_list[0]:
+                self.assertTrue(l.analytic_vmf_fast_path)
+
+            with torch.no_grad():
+
+                seed_everything(2)
+                samples_fast,_,evals_fast,_=this_flow.sample(samplesize=1000)
+                log_pdf_fast,_,_=this_flow(samples_fast)
+
+                for l in this_flow.layer_list[0]:
+                    l.analytic_vmf_fast_path=False
+
+                seed_everything(2)
+                samples_generic,_,evals_generic,_=this_flow.sample(samplesize=1000)
+                log_pdf_generic,_,_=this_flow(samples_fast)
+
+            self.assertTrue( numpy.fabs((samples_fast-samples_generic).numpy()).max() < 1e-6 )
+            self.assertTrue( numpy.fabs((evals_fast-evals_generic).numpy()).max() < 1e-6 )
+            self.assertTrue( numpy.fabs((log_pdf_fast-log_pdf_generic).numpy()).max() < 1e-6 )
+
+    def test_embedding_chains(self):
+
+        print("Testing embedding-native layer chains vs per-layer coordinate transformations")
+
+        for flow_def in ["ff", "vv", "fvf"]:
+
+            seed_everything(1)
+
+            this_flow=f.pdf("s2", flow_def)
+            this_flow.double()
+
+            self.assertTrue(all(this_flow.layer_embedding_modes[0]))
+            self.assertFalse(this_flow.default_embedding_modes[0])
+
+            with torch.no_grad():
+
+                seed_everything(2)
+                samples_chain,_,evals_chain,_=this_flow.sample(samplesize=500)
+                log_pdf_chain,_,_=this_flow(samples_chain)
+
+                ## switch off chains -> every layer transforms to intrinsic coordinates
+                for l in this_flow.layer_list[0]:
+                    l.embedding_chain_coordinates=False
+                this_flow.layer_embedding_modes=[[l.works_in_embedding_space() for l in ll] for ll in this_flow.layer_list]
+
+                seed_everything(2)
+                samples_single,_,evals_single,_=this_flow.sample(samplesize=500)
+                log_pdf_single,_,_=this_flow(samples_chain)
+
+            self.assertTrue( numpy.fabs((samples_chain-samples_single).numpy()).max() < 1e-6 )
+            self.assertTrue( numpy.fabs((evals_chain-evals_single).numpy()).max() < 1e-6 )
+            self.assertTrue( numpy.fabs((log_pdf_chain-log_pdf_single).numpy()).max() < 1e-6 )
+
+    def test_moebius_joint_kernel(self):
+
+        print("Testing joint value/derivative kernel of moebius flows")
+
+        for natural_direction in [0, 1]:
+
+            seed_everything(1)
+
+            extra_flow_defs=dict()
+            extra_flow_defs["m"]=dict()
+            extra_flow_defs["m"]["natural_direction"]=natural_direction
+
+            this_flow=f.pdf("s1", "mm", options_overwrite=extra_flow_defs)
+            this_flow.double()
+
+            ## derivative of the joint kernel vs autograd derivative of the value
+            layer=this_flow.layer_list[0][0]
+            test_x=(torch.rand(500, 1, dtype=torch.float64)*2-1)*numpy.pi
+            test_x.requires_grad_(True)
+
+            moebius_constants=layer.moebius_constants(layer.moebius_pars)
+            value, deriv=layer.moebius_trafo_and_deriv(test_x, *moebius_constants)
+            autograd_deriv=torch.autograd.grad(value.sum(), test_x)[0]
+
+            self.assertTrue( numpy.fabs((deriv-autograd_deriv).detach().numpy()).max() < 1e-10 )
+            self.assertTrue( numpy.fabs((value-layer.simple_moebius_trafo(test_x, layer.moebius_pars)).detach().numpy()).max() < 1e-12 )
+
+            ## Newton inverse in sampling / evaluation
+            with torch.no_grad():
+                samples,_,evals,_=this_flow.sample(samplesize=500, seed=2)
+                log_pdf,_,_=this_flow(samples)
+
+            self.assertTrue( numpy.fabs((log_pdf-evals).numpy()).max() < 1e-8 )
+
+    def test_moebius_tabulated_inverse(self):
+
+        print("Testing closed-form and tabulated inverse of moebius flows vs bisection")
+
+        for num_basis_functions in [1, 5]:
+            for conditional_input_dim in [None, 2]:
+
+                seed_everything(1)
+
+                extra_flow_defs=dict()
+                extra_flow_defs["m"]=dict()
+                extra_flow_defs["m"]["num_basis_functions"]=num_basis_functions
+                extra_flow_defs["m"]["inverse_mode"]="tabulated"
+
+                this_flow=f.pdf("s1", "mm", options_overwrite=extra_flow_defs, conditional_input_dim=conditional_input_dim)
+                this_flow.double()
+
+                cinput=None
+                if(conditional_input_dim is not None):
+                    cinput=torch.randn(500, conditional_input_dim, dtype=torch.float64)
+
+                with torch.no_grad():
+                    samples_tabulated,_,evals_tabulated,_=this_flow.sample(samplesize=500, conditional_input=cinput, seed=2)
+
+                    for l in this_flow.layer_list[0]:
+                        l.inverse_mode="bisection"
+
+                    samples_bisection,_,evals_bisection,_=this_flow.sample(samplesize=500, conditional_input=cinput, seed=2)
+
+                self.assertTrue( numpy.fabs((samples_tabulated-samples_bisection).numpy()).max() < 1e-10 )
+                self.assertTrue( numpy.fabs((evals_tabulated-evals_bisection).numpy()).max() < 1e-10 )
+
+        ## re-initialization writes into .data, which does not change the version counter .. the cached inverse table must be dropped
+        this_flow=f.pdf("s1", "m", options_overwrite=dict(m=dict(inverse_mode="tabulated")))
+        this_flow.double()
+        layer=this_flow.layer_list[0][0]
+
+        with torch.no_grad():
+            this_flow.sample(samplesize=100, seed=2)
+            self.assertTrue(layer.inverse_table_cache.table is not None)
+
+            layer.init_params(torch.randn(layer.get_total_param_num(), dtype=torch.float64))
+            self.assertTrue(layer.inverse_table_cache.table is None)
+
+            samples_reinitialized,_,_,_=this_flow.sample(samplesize=100, seed=2)
+            layer.inverse_table_cache.reset()
+            samples_fresh_table,_,_,_=this_flow.sample(samplesize=100, seed=2)
+
+        self.assertTrue( (samples_reinitialized==samples_fresh_table).all() )
+
+    def test_moebius_branch_cut(self):
+
+        print("Testing moebius flows at the -pi/pi boundaries")
+
+        seed_everything(1)
+
+        extra_flow_defs=dict()
+        extra_flow_defs["m"]=dict()
+        extra_flow_defs["m"]["num_basis_functions"]=5
+
+        this_flow=f.pdf("s1", "m", options_overwrite=extra_flow_defs)
+        layer=this_flow.layer_list[0][0]
+
+        for dtype in [torch.float32, torch.float64]:
+
+            this_flow.to(dtype)
+
+            ## at the boundaries, just inside and just beyond (as after rounding)
+            boundary_x=numpy.array([-numpy.pi, numpy.pi, -numpy.pi+1e-6, numpy.pi-1e-6, -numpy.pi-1e-6, numpy.pi+1e-6, -numpy.nextafter(numpy.pi, 4), numpy.nextafter(numpy.pi, 4)])
+            test_x=torch.from_numpy(boundary_x)[:,None].to(dtype)
+            boundaries=torch.where(test_x<0, -numpy.pi, numpy.pi)
+
+            ## output deviates from the boundary at most by the largest derivative times the input deviation (with a few units of rounding)
+            max_deviation=moebius_1d.MAX_COMPONENT_DERIVATIVE*((test_x.double()-boundaries.double()).abs()+10*torch.finfo(dtype).eps)
+
+            for _ in range(50):
+                with torch.no_grad():
+                    layer.moebius_pars.data=3*torch.randn_like(layer.moebius_pars)
+
+                    value=layer.simple_moebius_trafo(test_x, layer.moebius_pars)
+
+                self.assertTrue( ((value.double()-boundaries.double()).abs()<=max_deviation).all() )
+
+    def test_cnf_fixed_step_inference(self):
+
+        print("Testing fixed-step inference path of the sphere CNF")
+
+        extra_flow_defs=dict()
+        extra_flow_defs["c"]=dict()
+        extra_flow_defs["c"]["cnf_network_hidden_dims"]=""
+        extra_flow_defs["c"]["solver"]="rk4"
+
+        for conditional_input_dim in [None, 2]:
+
+            seed_everything(1)
+
+            this_flow=f.pdf("s2", "c", options_overwrite=extra_flow_defs, conditional_input_dim=conditional_input_dim)
+            this_flow.double()
+
+            cinput=None
+            if(conditional_input_dim is not None):
+                cinput=torch.randn(200, conditional_input_dim, dtype=torch.float64)
+
+            samples,_,_,_=this_flow.sample(samplesize=200, conditional_input=cinput, seed=2)
+
+            fixed_step_results=[]
+
+            ## step sizes that do and do not divide the chart interval (1/num_charts), changed after the first call
+            for step_size in [1.0/32.0, 0.1, 0.25]:
+
+                this_flow.layer_list[0][0].step_size=step_size
+
+                with torch.no_grad():
+                    log_pdf_torchdiffeq,_,_=this_flow(samples, conditional_input=cinput)
+
+                    this_flow.layer_list[0][0].fixed_step_inference=1
+                    log_pdf_fixed_step,_,_=this_flow(samples, conditional_input=cinput)
+                    this_flow.layer_list[0][0].fixed_step_inference=0
+
+                ## same rk4 scheme and time grid, so both paths agree to numerical precision
+                self.assertTrue( numpy.fabs((log_pdf_torchdiffeq-log_pdf_fixed_step).numpy()).max() < 1e-10 )
+
+                fixed_step_results.append(log_pdf_fixed_step)
+
+            self.assertFalse(torch.equal(fixed_step_results[0], fixed_step_results[2]))
+
+            this_flow.layer_list[0][0].step_size=1.0/32.0
+
+            accuracy=extra_functions.check_fixed_step_inference_accuracy(this_flow, samples, conditional_input=cinput)
+
+            self.assertTrue(accuracy["max_abs_logprob_error"] < 1e-3)
+            self.assertTrue(this_flow.layer_list[0][0].solver=="rk4")
+
+    def test_cnf_hutchinson_estimator(self):
+
+        print("Testing Hutchinson divergence estimator of the sphere CNF in training mode")
+
+        seed_everything(1)
+
+        extra_flow_defs=dict()
+        extra_flow_defs["c"]=dict()
+        extra_flow_defs["c"]["cnf_network_hidden_dims"]=""
+        extra_flow_defs["c"]["divergence_mode"]="hutchinson"
+
+        this_flow=f.pdf("s2", "c", options_overwrite=extra_flow_defs)
+        this_flow.double()
+
+        with torch.no_grad():
+            for p in this_flow.parameters():
+                p.add_(0.5*torch.randn_like(p))
+
+        ## eval mode uses the exact divergence
+        this_flow.eval()
+        samples,_,_,_=this_flow.sample(samplesize=20, seed=2)
+        with torch.no_grad():
+            exact_log_pdf,_,_=this_flow(samples)
+
+        this_flow.train()
+
+        ## record the noise of every function evaluation
+        recorded_noise=[]
+        divergence_approx=cnf_sphere_charts.divergence_approx
+
+        def recording_divergence_approx(dy, y, e=None):
+            recorded_noise.append(e.detach().clone())
+            return divergence_approx(dy, y, e=e)
+
+        cnf_sphere_charts.divergence_approx=recording_divergence_approx
+
+        try:
+            estimates=[]
+            first_solve_noise=None
+
+            for seed in range(30):
+                torch.manual_seed(seed)
+                recorded_noise.clear()
+
+                log_pdf,_,_=this_flow(samples)
+
+                ## the estimator is used, with the same noise for all evaluations of one solve and new noise for every solve
+                self.assertTrue(len(recorded_noise)>0)
+                self.assertTrue(all([torch.equal(e, recorded_noise[0]) for e in recorded_noise]))
+
+                if(seed==0):
+                    first_solve_noise=recorded_noise[0]
+
+                    log_pdf.sum().backward()
+
+                    for p in this_flow.parameters():
+                        self.assertTrue(p.grad is not None)
+                        self.assertTrue(torch.isfinite(p.grad).all() and (p.grad.abs().sum()>0))
+                else:
+                    self.assertFalse(torch.equal(recorded_noise[0], first_solve_noise))
+
+                estimates.append(log_pdf.detach())
+        finally:
+            cnf_sphere_charts.divergence_approx=divergence_approx
+
+        ## unbiased .. the mean over seeds matches the exact log-prob within the standard error
+        estimates=torch.stack(estimates)
+        standard_error=estimates.std(dim=0)/numpy.sqrt(estimates.shape[0])
+
+        self.assertTrue( ((estimates.mean(dim=0)-exact_log_pdf).abs() < 4*standard_error+1e-6).all() )
 
     def test_2d_sphere_evals(self):
 
@@ -186,6 +488,19 @@ class Test(unittest.TestCase):
         with torch.no_grad():
             check_flow(this_flow)
 
+        ## hutchinson estimator is only used in training mode, eval mode falls back to the exact divergence
+
+        extra_flow_defs["c"]["divergence_mode"]="hutchinson"
+
+        this_flow=f.pdf("s2", "c", options_overwrite=extra_flow_defs)
+        this_flow.eval()
+        with torch.no_grad():
+            check_flow(this_flow)
+
+        ## function evaluation counters of the chart scheduler
+        self.assertTrue(this_flow.layer_list[0][0].num_evals()>0)
+        self.assertTrue(this_flow.layer_list[0][0].num_evals(total=True)>=this_flow.layer_list[0][0].num_evals())
+
       
 
 